@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+"""
+Timer on the shared scheduler against AsyncTimer on an event loop. Many timers with deadlines spread over a few
+seconds pause a fake mpd, how late they fired comes from their `fired` events, and the threads alive meanwhile are
+counted. A start, extend and stop round is also timed on its own for both.
+
+    python benchmarks/bench_aio.py [--timers 200] [--spread 2] [--rounds 20000]
+
+Prints one JSON object per mode. Python 3 only.
+"""
+
+from __future__ import print_function
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.aio import AsyncTimer, AsyncMPDPauser, AsyncEventBus
+from mpd_auto_stop.events import EventBus
+from mpd_auto_stop.fakempd import FakeMPD
+from mpd_auto_stop.logger import OFF
+from mpd_auto_stop.metrics import monotonic
+from mpd_auto_stop.testing import percentile
+
+def own_threads():
+    # fake mpd's serving and connection threads aren't the timers'
+    return sum(1 for thread in threading.enumerate() if thread.name != "fake-mpd" and "process_request" not in thread.name)
+
+def summary(mode, lateness, threads, baseline, pauses, round_microseconds):
+    return {
+        "mode": mode,
+        "timers": len(lateness),
+        "pauses": pauses,
+        "late_p50_ms": round(percentile(lateness, 0.5) * 1000, 3),
+        "late_p99_ms": round(percentile(lateness, 0.99) * 1000, 3),
+        "late_max_ms": round(max(lateness) * 1000, 3),
+        "threads_started": threads - baseline,
+        "round_microseconds": round(round_microseconds, 3)
+    }
+
+def run_threads(args, mpd):
+    bus = EventBus(max_pending=args.timers * 4)
+    subscription = bus.subscribe()
+    timers = []
+
+    for index in range(args.timers):
+        timer = mas_app.Timer("timer-{0}".format(index), events=bus)
+        timer.mpd_host = "127.0.0.1"
+        timer.mpd_port = mpd.port
+        timers.append(timer)
+
+    baseline = threads = own_threads()
+
+    for timer in timers:
+        timer.start("{0:.3f}s".format(0.1 + random.random() * args.spread))
+
+    lateness = []
+    stopped = 0
+
+    # stopped comes after the pause, like closing the asyncio timers waits for theirs
+    while stopped < args.timers:
+        event = subscription.get(0.01)
+        threads = max(threads, own_threads())
+
+        if event is not None and event.type == "fired":
+            lateness.append(-event.data["remaining_time"])
+        elif event is not None and event.type == "stopped":
+            stopped += 1
+
+    timer = mas_app.Timer(events=EventBus())
+    started = monotonic()
+
+    for _ in range(args.rounds):
+        timer.start("1h")
+        timer.extend("1m")
+        timer.stop()
+
+    return summary("threads", lateness, threads, baseline, len(mpd.paused_at), (monotonic() - started) / args.rounds * 1000000)
+
+async def run_asyncio(args, mpd):
+    bus = AsyncEventBus(max_pending=args.timers * 4)
+    subscription = bus.subscribe()
+    pauser = AsyncMPDPauser("127.0.0.1", mpd.port)
+    timers = [AsyncTimer("timer-{0}".format(index), pauser, bus) for index in range(args.timers)]
+    baseline = threads = own_threads()
+
+    for timer in timers:
+        await timer.start("{0:.3f}s".format(0.1 + random.random() * args.spread))
+
+    lateness = []
+
+    while len(lateness) < args.timers:
+        event = await subscription.get()
+        threads = max(threads, own_threads())
+
+        if event.type == "fired":
+            lateness.append(-event.data["remaining_time"])
+
+    for timer in timers:
+        await timer.close()
+
+    timer = AsyncTimer(pauser=pauser)
+    started = monotonic()
+
+    for _ in range(args.rounds):
+        await timer.start("1h")
+        await timer.extend("1m")
+        await timer.stop()
+
+    return summary("asyncio", lateness, threads, baseline, len(mpd.paused_at), (monotonic() - started) / args.rounds * 1000000)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks Timer against AsyncTimer")
+    parser.add_argument("--timers", help="Timers to start [default: 200]", default=200, type=int)
+    parser.add_argument("--spread", help="Seconds the deadlines are spread over [default: 2]", default=2.0, type=float)
+    parser.add_argument("--rounds", help="Start, extend and stop rounds timed on their own [default: 20000]", default=20000, type=int)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.logger.level = OFF
+
+    # asyncio first, the scheduler's and pools' threads stay around once started
+    mpd = FakeMPD()
+    print(json.dumps(asyncio.run(run_asyncio(args, mpd)), sort_keys=True))
+    mpd.close()
+
+    mpd = FakeMPD()
+    print(json.dumps(run_threads(args, mpd), sort_keys=True))
+    mpd.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+
+"""
+What the response cache saves: the index page in full, gzipped and revalidated, and /timer polled in full against
+revalidated with its ETag, over one keep-alive connection.
+
+    python benchmarks/bench_caching.py [--requests 2000]
+
+Prints one JSON object per case, with the bytes each response took on the wire.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.logger import OFF
+from mpd_auto_stop.metrics import monotonic
+from mpd_auto_stop.testing import free_port, percentile
+
+class CountingSocket(object):
+    """
+    Counts what the client receives, headers included
+    """
+    def __init__(self, sock, counter):
+        self._sock = sock
+        self._counter = counter
+
+    def makefile(self, *args, **kwargs):
+        counter = self._counter
+        stream = self._sock.makefile(*args, **kwargs)
+        read = stream.read
+        readline = stream.readline
+        readinto = getattr(stream, "readinto", None)
+
+        def counted(function):
+            def call(*args):
+                data = function(*args)
+                counter[0] += len(data) if isinstance(data, bytes) else data
+
+                return data
+
+            return call
+
+        stream.read = counted(read)
+        stream.readline = counted(readline)
+
+        if readinto:
+            stream.readinto = counted(readinto)
+
+        return stream
+
+    def __getattr__(self, name):
+        return getattr(self._sock, name)
+
+def run(port, name, path, headers, requests, revalidate):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+    connection.connect()
+    received = [0]
+    connection.sock = CountingSocket(connection.sock, received)
+    latencies = []
+    statuses = set()
+    headers = dict(headers)
+
+    for _ in range(requests):
+        started = monotonic()
+        connection.request("GET", path, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        latencies.append((monotonic() - started) * 1000)
+        statuses.add(response.status)
+
+        if revalidate and response.getheader("ETag"):
+            headers["If-None-Match"] = response.getheader("ETag")
+
+    connection.close()
+
+    return {
+        "case": name,
+        "requests": requests,
+        "statuses": sorted(statuses),
+        "bytes_per_response": round(received[0] / float(requests), 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks cached and conditional responses")
+    parser.add_argument("--requests", help="Requests per case [default: 2000]", default=2000, type=int)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.logger.level = OFF
+
+    port = free_port()
+    app = mas_app.App("127.0.0.1", port, 2, 64, 5.0, args.requests * 2)
+    thread = threading.Thread(target=app.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    # a started timer, its remaining time changes on every response
+    mas_app.timer.start("1h")
+
+    cases = (
+        ("index", "/", {}, False),
+        ("index-gzip", "/", {"Accept-Encoding": "gzip"}, False),
+        ("index-revalidated", "/", {"Accept-Encoding": "gzip"}, True),
+        ("timer", "/timer", {}, False),
+        ("timer-revalidated", "/timer", {}, True)
+    )
+
+    for (name, path, headers, revalidate) in cases:
+        print(json.dumps(run(port, name, path, headers, args.requests, revalidate), sort_keys=True))
+
+    mas_app.timer.stop()
+    app.stop()
+    thread.join(5)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Cold start under socket activation: like systemd, listens on a socket, starts the service with it as
+LISTEN_FDS when a client connects, and measures from the connection to the first response. A second request
+on the running service is timed for comparison.
+
+    python benchmarks/bench_cold_start.py [--runs 10] [--workers 0]
+
+Prints one JSON object with the percentiles over all runs.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, ROOT)
+
+from mpd_auto_stop import VERSION
+from mpd_auto_stop.metrics import monotonic
+from mpd_auto_stop.systemd import LISTEN_FDS_START
+from mpd_auto_stop.testing import percentile
+
+SERVICE = "import mpd_auto_stop; mpd_auto_stop.main()"
+
+def request(port):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=30)
+    connection.request("GET", "/timer")
+    response = connection.getresponse()
+    response.read()
+    connection.close()
+
+    return response.status
+
+def run(listener, port, workers):
+    def activate():
+        # what systemd does in the child between fork and exec
+        if listener.fileno() == LISTEN_FDS_START:
+            # dup2 onto itself doesn't clear close-on-exec, python 2 doesn't set it in the first place
+            if hasattr(os, "set_inheritable"):
+                os.set_inheritable(LISTEN_FDS_START, True)
+        else:
+            os.dup2(listener.fileno(), LISTEN_FDS_START)
+
+        os.environ["LISTEN_FDS"] = "1"
+        os.environ["LISTEN_PID"] = str(os.getpid())
+
+    started = monotonic()
+    service = subprocess.Popen([sys.executable, "-c", SERVICE, "--log-level", "error", "--workers", str(workers)], cwd=ROOT, preexec_fn=activate, close_fds=False)
+
+    try:
+        # the connection waits in the listen backlog until the service accepts it
+        status = request(port)
+        cold = monotonic() - started
+
+        started = monotonic()
+        request(port)
+        warm = monotonic() - started
+    finally:
+        service.terminate()
+        service.wait()
+
+    if status != 200:
+        raise RuntimeError("Unexpected status {0}".format(status))
+
+    return (cold, warm)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the first response of a socket activated service")
+    parser.add_argument("--runs", help="Times the service is started [default: 10]", default=10, type=int)
+    parser.add_argument("--workers", help="Server worker threads [default: 0]", default=0, type=int)
+    args = parser.parse_args()
+
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen(16)
+    port = listener.getsockname()[1]
+    results = [run(listener, port, args.workers) for _ in range(args.runs)]
+    listener.close()
+
+    cold = [result[0] * 1000 for result in results]
+    warm = [result[1] * 1000 for result in results]
+
+    print(json.dumps({
+        "version": ".".join(str(part) for part in VERSION),
+        "runs": args.runs,
+        "workers": args.workers,
+        "cold_p50_ms": round(percentile(cold, 0.5), 2),
+        "cold_max_ms": round(max(cold), 2),
+        "warm_p50_ms": round(percentile(warm, 0.5), 3)
+    }, sort_keys=True))
+
+if __name__ == "__main__":
+    main()
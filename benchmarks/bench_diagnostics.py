@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+"""
+What the diagnostics hooks cost. GET /timer goes through TimerRequestHandler in process, writing to memory,
+with diagnostics off, tracing and profiling. With them off the hooks left in the request path, a flag check per
+span and the lock wrapper, are also timed on their own and compared to the whole request.
+
+    python benchmarks/bench_diagnostics.py [--requests 20000]
+
+Prints one JSON object per mode and one for the disabled hooks.
+"""
+
+from __future__ import print_function
+import argparse
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.diagnostics import TracedLock
+from mpd_auto_stop.logger import OFF
+
+def make_handler():
+    # everything BaseHTTPRequestHandler would have set up from a parsed request
+    handler = mas_app.TimerRequestHandler.__new__(mas_app.TimerRequestHandler)
+    handler.server = None
+    handler.client_address = ("127.0.0.1", 0)
+    handler.command = "GET"
+    handler.path = "/timer"
+    handler.request_version = "HTTP/1.1"
+    handler.requestline = "GET /timer HTTP/1.1"
+    handler.headers = {}
+    handler.keep_alive = True
+    handler.keep_alive_requests = 1 << 30
+    handler.requests_served = 0
+
+    return handler
+
+def run(mode, requests):
+    handler = make_handler()
+
+    def request():
+        handler.wfile = io.BytesIO()
+        handler.do_GET()
+
+    seconds = min(timeit.repeat(request, number=requests, repeat=3))
+
+    return {
+        "mode": mode,
+        "requests": requests,
+        "microseconds_per_request": round(seconds / requests * 1000000, 3)
+    }
+
+def disabled_hooks(requests):
+    tracer = mas_app.tracer
+    profiler = mas_app.profiler
+    lock = threading.RLock()
+    traced = TracedLock(threading.RLock(), tracer)
+
+    # what _dispatch, _handle and the status handler add to a request with diagnostics off
+    def hooks():
+        profiler.active
+        tracer.start("GET /timer")
+
+        for _ in range(4):
+            with tracer.span("span"):
+                pass
+
+    def plain_lock():
+        with lock:
+            pass
+
+    def traced_lock():
+        with traced:
+            pass
+
+    per_request = min(timeit.repeat(hooks, number=requests, repeat=3)) / requests
+    lock_overhead = (min(timeit.repeat(traced_lock, number=requests, repeat=3)) - min(timeit.repeat(plain_lock, number=requests, repeat=3))) / requests
+
+    return {
+        "mode": "disabled-hooks",
+        "hooks_microseconds_per_request": round(per_request * 1000000, 3),
+        "lock_wrapper_microseconds": round(lock_overhead * 1000000, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the overhead of tracing and profiling")
+    parser.add_argument("--requests", help="Requests per mode [default: 20000]", default=20000, type=int)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.logger.level = OFF
+    directory = tempfile.mkdtemp()
+    mas_app.profiler.path = os.path.join(directory, "bench.prof")
+
+    off = run("off", args.requests)
+    print(json.dumps(off, sort_keys=True))
+
+    mas_app.tracer.enabled = True
+    print(json.dumps(run("tracing", args.requests), sort_keys=True))
+    mas_app.tracer.enabled = False
+
+    mas_app.profiler.start()
+    print(json.dumps(run("profiling", args.requests), sort_keys=True))
+    mas_app.profiler.stop()
+
+    hooks = disabled_hooks(args.requests)
+    hooks["share_of_request_percent"] = round(hooks["hooks_microseconds_per_request"] / off["microseconds_per_request"] * 100, 2)
+    print(json.dumps(hooks, sort_keys=True))
+
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+"""
+How late timers fire, many short named timers on the shared scheduler with mpd pause stubbed out.
+
+    python benchmarks/bench_fire_jitter.py [--timers 200] [--spread 2]
+
+Prints the fire jitter histogram as JSON.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.logger import OFF
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks timer fire jitter")
+    parser.add_argument("--timers", help="Timers to start [default: 200]", default=200, type=int)
+    parser.add_argument("--spread", help="Seconds the deadlines are spread over [default: 2]", default=2.0, type=float)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.logger.level = OFF
+    mas_app.Timer._pause = lambda self: None
+    mas_app.fire_jitter.reset()
+
+    for index in range(args.timers):
+        mas_app.timers.start("timer-{0}".format(index), "{0:.3f}s".format(0.1 + random.random() * args.spread))
+
+    while len(mas_app.timers):
+        time.sleep(0.1)
+
+    result = mas_app.fire_jitter.snapshot()
+    result["timers"] = args.timers
+
+    print(json.dumps(result))
+
+if __name__ == "__main__":
+    main()
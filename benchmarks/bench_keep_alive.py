@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+"""
+Requests per second polling /timer over one keep-alive connection per client against a new connection per request,
+over TCP and, where there are unix domain sockets, over the --unix-socket listener.
+
+    python benchmarks/bench_keep_alive.py [--clients 4] [--requests 500] [--workers 4]
+
+Prints one JSON object per transport and mode.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.testing import free_port, percentile
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path, timeout):
+        httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.path)
+
+def connect(address):
+    if isinstance(address, int):
+        return httplib.HTTPConnection("127.0.0.1", address, timeout=10)
+
+    return UnixHTTPConnection(address, timeout=10)
+
+def client(address, requests, keep_alive, latencies):
+    connection = None
+
+    for _ in range(requests):
+        started = time.time()
+
+        if connection is None:
+            connection = connect(address)
+
+        connection.request("GET", "/timer", headers={} if keep_alive else {"Connection": "close"})
+        connection.getresponse().read()
+
+        if not keep_alive:
+            connection.close()
+            connection = None
+
+        latencies.append((time.time() - started) * 1000)
+
+    if connection:
+        connection.close()
+
+def run(address, clients, requests, keep_alive):
+    latencies = []
+    threads = [threading.Thread(target=client, args=(address, requests, keep_alive, latencies)) for _ in range(clients)]
+    started = time.time()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = time.time() - started
+
+    return {
+        "transport": "tcp" if isinstance(address, int) else "unix",
+        "mode": "keep-alive" if keep_alive else "close",
+        "clients": clients,
+        "requests": len(latencies),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks keep-alive against a connection per request")
+    parser.add_argument("--clients", help="Concurrent clients [default: 4]", default=4, type=int)
+    parser.add_argument("--requests", help="Requests per client [default: 500]", default=500, type=int)
+    parser.add_argument("--workers", help="Server worker threads [default: 4]", default=4, type=int)
+    args = parser.parse_args()
+
+    # request logging would dominate the numbers
+    mas_app.TimerRequestHandler.log_message = lambda *args: None
+
+    port = free_port()
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, "mpd-auto-stop.sock") if hasattr(socket, "AF_UNIX") else None
+    app = mas_app.App("127.0.0.1", port, args.workers, 64, 5.0, args.requests + 1, unix_socket=path)
+    thread = threading.Thread(target=app.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    for address in (port, path):
+        if address is None:
+            continue
+
+        for keep_alive in (False, True):
+            print(json.dumps(run(address, args.clients, args.requests, keep_alive)))
+
+    app.stop()
+    thread.join(5)
+    shutil.rmtree(directory)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""
+End to end load against the real App and TimerRequestHandler, with a fake mpd in process so timers really
+pause something. Three scenarios run one after the other:
+
+* status - clients polling /timer over keep-alive connections
+* churn - clients starting, extending and stopping their own named timers
+* fire - short named timers started over HTTP, measured by when the fake mpd saw each pause
+
+    python benchmarks/bench_load.py [--clients 8] [--seconds 5] [--workers 8] [--timers 100]
+                                    [--mpd-latency 0] [--mpd-error-rate 0]
+
+Prints one JSON object per scenario, save the output of two versions and compare them line by line.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import random
+import socket
+import sys
+import threading
+import time
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.logger import OFF
+from mpd_auto_stop.fakempd import FakeMPD, monotonic
+from mpd_auto_stop.testing import free_port, percentile
+
+def status_client(port, index, deadline):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+
+    while monotonic() < deadline:
+        yield connection, "GET", "/timer"
+
+def churn_client(port, index, deadline):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+    name = "churn-{0}".format(index)
+
+    while monotonic() < deadline:
+        yield connection, "GET", "/timer/{0}/1000s/start".format(name)
+        yield connection, "GET", "/timer/{0}/10s/extend".format(name)
+        yield connection, "GET", "/timer/{0}".format(name)
+        yield connection, "GET", "/timer/{0}/stop".format(name)
+
+def drive(requests, result):
+    for (connection, method, path) in requests:
+        started = monotonic()
+
+        try:
+            connection.request(method, path)
+            response = connection.getresponse()
+            response.read()
+
+            if response.status >= 500:
+                result["errors"] += 1
+        except (socket.error, httplib.HTTPException):
+            result["errors"] += 1
+            connection.close()
+
+        result["latencies"].append((monotonic() - started) * 1000)
+
+def run(scenario, port, clients, seconds):
+    deadline = monotonic() + seconds
+    results = []
+    threads = []
+
+    for index in range(clients):
+        result = {
+            "latencies": [],
+            "errors": 0
+        }
+        requests = scenario(port, index, deadline)
+        results.append(result)
+        threads.append(threading.Thread(target=drive, args=(requests, result)))
+
+    started = monotonic()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = monotonic() - started
+    latencies = [latency for result in results for latency in result["latencies"]]
+
+    return {
+        "requests": len(latencies),
+        "errors": sum(result["errors"] for result in results),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 3)
+    }
+
+def fire(port, mpd, timers, spread):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+    deadlines = []
+    pauses = len(mpd.paused_at)
+
+    for index in range(timers):
+        duration = 0.2 + random.random() * spread
+        connection.request("GET", "/timer/fire-{0}/{1:.3f}s/start".format(index, duration))
+        connection.getresponse().read()
+        # the timer was armed before the response went out, so this is its latest possible deadline
+        deadlines.append(monotonic() + duration)
+
+    connection.close()
+    wait_until = monotonic() + spread + 5
+
+    while len(mpd.paused_at) - pauses < timers and monotonic() < wait_until:
+        time.sleep(0.05)
+
+    # deadlines are spread far wider than the jitter, sorted pauses line up with sorted deadlines
+    paused_at = sorted(mpd.paused_at[pauses:])
+    lateness = [(paused - deadline) * 1000 for (paused, deadline) in zip(paused_at, sorted(deadlines))]
+
+    return {
+        "timers": timers,
+        "fired": len(paused_at),
+        "fire_late_p50_ms": round(percentile(lateness, 0.5), 3) if lateness else None,
+        "fire_late_p99_ms": round(percentile(lateness, 0.99), 3) if lateness else None,
+        "fire_late_max_ms": round(max(lateness), 3) if lateness else None
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the whole service against a fake mpd")
+    parser.add_argument("--clients", help="Concurrent clients [default: 8]", default=8, type=int)
+    parser.add_argument("--seconds", help="Seconds each load scenario runs [default: 5]", default=5.0, type=float)
+    parser.add_argument("--workers", help="Server worker threads [default: 8]", default=8, type=int)
+    parser.add_argument("--timers", help="Timers started in the fire scenario [default: 100]", default=100, type=int)
+    parser.add_argument("--spread", help="Seconds the fire deadlines are spread over [default: 2]", default=2.0, type=float)
+    parser.add_argument("--mpd-latency", help="Seconds the fake mpd waits before every reply [default: 0]", default=0.0, type=float)
+    parser.add_argument("--mpd-error-rate", help="Fraction of mpd commands answered with an error [default: 0]", default=0.0, type=float)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.TimerRequestHandler.log_message = lambda *args: None
+    mas_app.logger.level = OFF
+
+    mpd = FakeMPD(latency=args.mpd_latency, error_rate=args.mpd_error_rate)
+    mas_app.timer.mpd_host = mas_app.timers.mpd_host = "127.0.0.1"
+    mas_app.timer.mpd_port = mas_app.timers.mpd_port = mpd.port
+
+    port = free_port()
+    app = mas_app.App("127.0.0.1", port, args.workers, 64, 5.0, 1000000)
+    thread = threading.Thread(target=app.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    common = {
+        "version": ".".join(str(part) for part in mas_app.VERSION),
+        "clients": args.clients,
+        "workers": args.workers,
+        "mpd_latency": args.mpd_latency,
+        "mpd_error_rate": args.mpd_error_rate
+    }
+
+    for (name, scenario) in (("status", status_client), ("churn", churn_client)):
+        result = dict(common, scenario=name)
+        result.update(run(scenario, port, args.clients, args.seconds))
+        print(json.dumps(result, sort_keys=True))
+
+    result = dict(common, scenario="fire")
+    result.update(fire(port, mpd, args.timers, args.spread))
+    print(json.dumps(result, sort_keys=True))
+
+    app.stop()
+    thread.join(5)
+    mpd.close()
+
+if __name__ == "__main__":
+    main()
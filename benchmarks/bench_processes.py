@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+"""
+/timer reads across cores. The service is started on its own with one process and then with --processes, and
+client processes poll /timer over keep-alive connections while the timer runs. A writer meanwhile starts and stops
+the timer and reads it back on a new connection right after each change, counting reads that didn't see the change
+yet, whichever worker answered them.
+
+    python benchmarks/bench_processes.py [--processes 4] [--clients 8] [--seconds 5]
+
+Prints one JSON object per mode.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import time
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+sys.path.insert(0, ROOT)
+
+from mpd_auto_stop.metrics import monotonic
+from mpd_auto_stop.testing import free_port, percentile
+
+def start_server(port, processes, workers):
+    command = [sys.executable, "-m", "mpd_auto_stop", "--host", "127.0.0.1", "--port", str(port), "--workers", str(workers), "--keep-alive-requests", str(1 << 30), "--mpd-port", "1", "--log-level", "error"]
+
+    if processes:
+        command += ["--processes", str(processes)]
+
+    server = subprocess.Popen(command, cwd=ROOT)
+
+    for _ in range(250):
+        try:
+            socket.create_connection(("127.0.0.1", port), 1).close()
+
+            return server
+        except socket.error:
+            time.sleep(0.02)
+
+    server.kill()
+
+    raise RuntimeError("server didn't come up")
+
+def get(connection, path):
+    connection.request("GET", path)
+    response = connection.getresponse()
+
+    return json.loads(response.read().decode("utf8"))
+
+def poll(port, seconds, results):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+    latencies = []
+    deadline = monotonic() + seconds
+
+    while monotonic() < deadline:
+        started = monotonic()
+        get(connection, "/timer")
+        latencies.append((monotonic() - started) * 1000)
+
+    connection.close()
+    results.put(latencies)
+
+def churn(port, seconds, results):
+    deadline = monotonic() + seconds
+    changes = 0
+    stale = 0
+
+    while monotonic() < deadline:
+        for (path, expected) in (("/timer/1h/start", "started"), ("/timer/stop", "stopped")):
+            connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+            get(connection, path)
+            connection.close()
+
+            # a new connection, likely another worker
+            connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+            stale += get(connection, "/timer")["status"] != expected
+            connection.close()
+            changes += 1
+
+        time.sleep(0.01)
+
+    results.put((changes, stale))
+
+def run(mode, processes, args):
+    port = free_port()
+    server = start_server(port, processes, args.workers)
+    results = multiprocessing.Queue()
+    churn_results = multiprocessing.Queue()
+
+    try:
+        get(httplib.HTTPConnection("127.0.0.1", port, timeout=10), "/timer/1h/start")
+        clients = [multiprocessing.Process(target=poll, args=(port, args.seconds, results)) for _ in range(args.clients)]
+        writer = multiprocessing.Process(target=churn, args=(port, args.seconds, churn_results))
+
+        for client in clients + [writer]:
+            client.start()
+
+        latencies = []
+
+        for _ in clients:
+            latencies.extend(results.get())
+
+        (changes, stale) = churn_results.get()
+
+        for client in clients + [writer]:
+            client.join()
+    finally:
+        server.terminate()
+        server.wait()
+
+    return {
+        "mode": mode,
+        "processes": processes or 1,
+        "clients": args.clients,
+        "requests_per_second": round(len(latencies) / args.seconds, 1),
+        "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 3),
+        "changes": changes,
+        "stale_reads": stale
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks /timer reads with one process against worker processes")
+    parser.add_argument("--processes", help="Worker processes [default: 4]", default=4, type=int)
+    parser.add_argument("--clients", help="Client processes polling /timer [default: 8]", default=8, type=int)
+    parser.add_argument("--workers", help="Threads per process [default: 4]", default=4, type=int)
+    parser.add_argument("--seconds", help="Seconds each mode runs for [default: 5]", default=5.0, type=float)
+    args = parser.parse_args()
+
+    print(json.dumps(run("single", 0, args), sort_keys=True))
+    print(json.dumps(run("processes", args.processes, args), sort_keys=True))
+
+if __name__ == "__main__":
+    main()
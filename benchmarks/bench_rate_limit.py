@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+
+"""
+What rate limiting buys a well behaved client. One client polls /timer while others hammer /timer/<duration>/start
+and /timer/restart over keep-alive connections as fast as they're answered, first with no limits and then with
+--rate-limit-write. The check done on every request is also timed on its own, for a known client and with the
+client table full and evicting.
+
+    python benchmarks/bench_rate_limit.py [--seconds 3] [--hammers 4]
+
+Prints one JSON object per mode and one for the check.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import timeit
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.logger import OFF
+from mpd_auto_stop.metrics import monotonic
+from mpd_auto_stop.ratelimit import RateLimiter
+from mpd_auto_stop.testing import free_port, percentile
+
+def hammer(port, stopped, counts):
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+    paths = ("/timer/1h/start", "/timer/restart")
+    index = 0
+
+    while not stopped.is_set():
+        connection.request("GET", paths[index % 2])
+        response = connection.getresponse()
+        response.read()
+        counts[response.status] = counts.get(response.status, 0) + 1
+        index += 1
+
+        if response.getheader("Connection") == "close":
+            connection.close()
+
+    connection.close()
+
+def run(mode, port, seconds, hammers):
+    stopped = threading.Event()
+    counts = {}
+    threads = [threading.Thread(target=hammer, args=(port, stopped, counts)) for _ in range(hammers)]
+
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=10)
+    latencies = []
+    deadline = monotonic() + seconds
+
+    while monotonic() < deadline:
+        started = monotonic()
+        connection.request("GET", "/timer")
+        connection.getresponse().read()
+        latencies.append((monotonic() - started) * 1000)
+        # a dashboard polls, it doesn't spin
+        time.sleep(0.01)
+
+    stopped.set()
+
+    for thread in threads:
+        thread.join(10)
+
+    connection.close()
+
+    return {
+        "mode": mode,
+        "polls": len(latencies),
+        "poll_p50_ms": round(percentile(latencies, 0.5), 3),
+        "poll_p99_ms": round(percentile(latencies, 0.99), 3),
+        "hammer_statuses": dict((str(status), count) for (status, count) in sorted(counts.items()))
+    }
+
+def check(requests):
+    known = RateLimiter(1e9, 1 << 30)
+    full = RateLimiter(1e9, 1 << 30, max_clients=1024)
+    addresses = ["10.0.{0}.{1}".format(index // 256, index % 256) for index in range(4096)]
+    counter = [0]
+
+    def new_client():
+        counter[0] += 1
+        full.acquire(addresses[counter[0] % len(addresses)])
+
+    return {
+        "mode": "check",
+        "known_client_microseconds": round(min(timeit.repeat(lambda: known.acquire("127.0.0.1"), number=requests, repeat=3)) / requests * 1000000, 3),
+        "evicting_microseconds": round(min(timeit.repeat(new_client, number=requests, repeat=3)) / requests * 1000000, 3),
+        "clients_kept": len(full)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks per client rate limiting")
+    parser.add_argument("--seconds", help="Seconds each mode runs for [default: 3]", default=3.0, type=float)
+    parser.add_argument("--hammers", help="Clients hammering the mutating routes [default: 4]", default=4, type=int)
+    parser.add_argument("--requests", help="Checks timed on their own [default: 100000]", default=100000, type=int)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.logger.level = OFF
+
+    port = free_port()
+    app = mas_app.App("127.0.0.1", port, args.hammers + 2, 64, 5.0, 1 << 30)
+    thread = threading.Thread(target=app.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    print(json.dumps(run("unlimited", port, args.seconds, args.hammers), sort_keys=True))
+
+    # every client is on 127.0.0.1 here, the poller is only spared because reads have their own budget
+    mas_app.write_limiter.rate = 1.0
+    mas_app.write_limiter.burst = 5
+    print(json.dumps(run("limited", port, args.seconds, args.hammers), sort_keys=True))
+    mas_app.write_limiter.rate = 0.0
+
+    mas_app.timer.stop()
+    app.stop()
+    thread.join(5)
+
+    print(json.dumps(check(args.requests), sort_keys=True))
+
+if __name__ == "__main__":
+    main()
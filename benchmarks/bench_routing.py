@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+
+"""
+Dispatch cost per request, the old per-request list of Route regexes against the shared Router.
+
+    python benchmarks/bench_routing.py [--iterations 20000]
+
+Prints one JSON object per dispatcher.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+
+PATHS = [
+    "/timer",
+    "/timer/30m/start",
+    "/timer/kitchen",
+    "/timer/kitchen/10m/extend",
+    "/timer/stop",
+    "/does/not/exist"
+]
+
+PATTERNS = [
+    "/?$",
+    "/timer$",
+    "/timer/events$",
+    "/timer/(?P<duration>[\\.0-9a-zA-Z]+)/start$",
+    "/timer/stop$",
+    "/timer/restart$",
+    "/timer/(?P<duration>[\\.0-9a-zA-Z]+)/extend$",
+    "/timers$",
+    "/timer/(?P<name>[-_0-9a-zA-Z]+)$",
+    "/timer/(?P<name>[-_0-9a-zA-Z]+)/(?P<duration>[\\.0-9a-zA-Z]+)/start$",
+    "/timer/(?P<name>[-_0-9a-zA-Z]+)/stop$",
+    "/timer/(?P<name>[-_0-9a-zA-Z]+)/restart$",
+    "/timer/(?P<name>[-_0-9a-zA-Z]+)/(?P<duration>[\\.0-9a-zA-Z]+)/extend$",
+    ".*"
+]
+
+def linear_dispatch(path):
+    # what every request used to do, a fresh handler instance building and scanning its own route list
+    routes = [re.compile(pattern) for pattern in PATTERNS]
+
+    for route in routes:
+        match = route.match(path)
+
+        if match:
+            return match.groupdict()
+
+def router_dispatch(path):
+    return mas_app.TimerRequestHandler.router.match("GET", path)
+
+def run(name, dispatch, iterations):
+    def requests():
+        for path in PATHS:
+            dispatch(path)
+
+    seconds = min(timeit.repeat(requests, number=iterations, repeat=3))
+
+    return {
+        "dispatcher": name,
+        "requests": iterations * len(PATHS),
+        "microseconds_per_request": round(seconds / (iterations * len(PATHS)) * 1000000, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks request dispatch")
+    parser.add_argument("--iterations", help="Passes over the sample paths [default: 20000]", default=20000, type=int)
+    args = parser.parse_args()
+
+    for (name, dispatch) in (("linear", linear_dispatch), ("router", router_dispatch)):
+        print(json.dumps(run(name, dispatch, args.iterations)))
+
+if __name__ == "__main__":
+    main()
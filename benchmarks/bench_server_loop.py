@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+"""
+Idle CPU and request latency of the serving loop, the old busy polling loop against the selector based App.
+
+    python benchmarks/bench_server_loop.py [--idle 5] [--requests 200]
+
+Prints one JSON object per loop.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.testing import free_port, percentile
+
+class PollingApp(mas_app.App):
+    """
+    The loop App.start used to run, a non-blocking listening socket spun with _handle_request_noblock
+    """
+    def start(self):
+        self.server = mas_app.HTTPServer((self.host, self.port), mas_app.TimerRequestHandler)
+        self.server.socket.setblocking(False)
+
+        while not self.stopped:
+            self.server._handle_request_noblock()
+
+        self.server.server_close()
+
+    def stop(self):
+        self.stopped = 1
+
+def fetch(port, path):
+    # raw socket rather than httplib, so the numbers don't depend on the response framing
+    sock = socket.create_connection(("127.0.0.1", port), 5)
+    sock.sendall("GET {0} HTTP/1.0\r\n\r\n".format(path).encode("ascii"))
+
+    while sock.recv(4096):
+        pass
+
+    sock.close()
+
+def cpu_time():
+    times = os.times()
+
+    return times[0] + times[1]
+
+def run(name, app_class, idle, requests):
+    port = free_port()
+    app = app_class("127.0.0.1", port)
+    thread = threading.Thread(target=app.start)
+    thread.daemon = True
+    thread.start()
+    time.sleep(0.5)
+
+    before = cpu_time()
+    time.sleep(idle)
+    idle_cpu = cpu_time() - before
+
+    latencies = []
+
+    for _ in range(requests):
+        started = time.time()
+        fetch(port, "/timer")
+        latencies.append((time.time() - started) * 1000)
+
+    started = time.time()
+    app.stop()
+    thread.join(5)
+    shutdown = (time.time() - started) * 1000
+
+    return {
+        "loop": name,
+        "idle_seconds": idle,
+        "idle_cpu_seconds": round(idle_cpu, 4),
+        "idle_cpu_percent": round(idle_cpu / idle * 100, 2),
+        "requests": requests,
+        "latency_p50_ms": round(percentile(latencies, 0.5), 3),
+        "latency_p99_ms": round(percentile(latencies, 0.99), 3),
+        "shutdown_ms": round(shutdown, 3)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the server loop")
+    parser.add_argument("--idle", help="Seconds to sit idle [default: 5]", default=5.0, type=float)
+    parser.add_argument("--requests", help="Requests to time [default: 200]", default=200, type=int)
+    args = parser.parse_args()
+
+    # request logging would dominate the latency numbers
+    mas_app.TimerRequestHandler.log_message = lambda *args: None
+
+    for (name, app_class) in (("polling", PollingApp), ("selector", mas_app.App)):
+        print(json.dumps(run(name, app_class, args.idle, args.requests)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+"""
+Status reads under write churn: reader threads poll the default timer's status while writer threads keep
+starting, extending and stopping it, mpd pause stubbed out. Readers go through both paths `/timer` could use:
+
+* json - get_status_json, the cached serialization of the current snapshot
+* dict - get_status and json.dumps on every read
+
+    python benchmarks/bench_status_contention.py [--readers 16] [--writers 2] [--seconds 3]
+
+Prints one JSON object per read path.
+"""
+
+from __future__ import print_function
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from mpd_auto_stop import app as mas_app
+from mpd_auto_stop.logger import OFF
+from mpd_auto_stop.metrics import monotonic
+from mpd_auto_stop.testing import percentile
+
+def read_json(timer):
+    return timer.get_status_json()
+
+def read_dict(timer):
+    return json.dumps(timer.get_status())
+
+def reader(timer, read, deadline, result):
+    latencies = result["latencies"]
+
+    while monotonic() < deadline:
+        started = monotonic()
+        read(timer)
+        latencies.append(monotonic() - started)
+        # a real reader waits on its socket between requests, spinning here would starve the writers of the GIL
+        time.sleep(0)
+
+def writer(timer, deadline, result):
+    while monotonic() < deadline:
+        try:
+            timer.start("1000s")
+            timer.extend("10s")
+            timer.stop()
+            result["writes"] += 3
+        except mas_app.InvalidTimerStateError:
+            # another writer stopped it in between
+            pass
+
+        time.sleep(0)
+
+def run(timer, read, readers, writers, seconds):
+    deadline = monotonic() + seconds
+    read_results = [{"latencies": []} for _ in range(readers)]
+    write_results = [{"writes": 0} for _ in range(writers)]
+    threads = [threading.Thread(target=reader, args=(timer, read, deadline, result)) for result in read_results]
+    threads.extend(threading.Thread(target=writer, args=(timer, deadline, result)) for result in write_results)
+    started = monotonic()
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    elapsed = monotonic() - started
+    latencies = [latency for result in read_results for latency in result["latencies"]]
+
+    return {
+        "reads": len(latencies),
+        "reads_per_second": round(len(latencies) / elapsed, 1),
+        "writes_per_second": round(sum(result["writes"] for result in write_results) / elapsed, 1),
+        "read_p50_us": round(percentile(latencies, 0.5) * 1000000, 2),
+        "read_p99_us": round(percentile(latencies, 0.99) * 1000000, 2)
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks timer status reads during start/extend churn")
+    parser.add_argument("--readers", help="Reader threads [default: 16]", default=16, type=int)
+    parser.add_argument("--writers", help="Writer threads [default: 2]", default=2, type=int)
+    parser.add_argument("--seconds", help="Seconds each read path runs [default: 3]", default=3.0, type=float)
+    args = parser.parse_args()
+
+    # logging would dominate the numbers
+    mas_app.logger.level = OFF
+    timer = mas_app.Timer()
+    timer._pause = lambda: None
+
+    for (name, read) in (("json", read_json), ("dict", read_dict)):
+        result = {
+            "path": name,
+            "readers": args.readers,
+            "writers": args.writers
+        }
+        result.update(run(timer, read, args.readers, args.writers, args.seconds))
+        print(json.dumps(result, sort_keys=True))
+
+    timer.stop()
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,33 @@
 from .app import xint, xstr, xfloat
 from .app import main
+from .app import App
+from .app import Router
+from .app import PlayerPolicy
 from .app import parse_args
 from .app import Timer
-from .app import InvalidTimerStateError
-from .app import VERSION
\ No newline at end of file
+from .app import TimerRegistry
+from .app import StateMirror
+from .core import TimerState, TimerStatus, InvalidTimerStateError
+from .app import VERSION
+from .mpd import MPDClient, MPDConnectionPool
+from .mpd import MPDError, MPDCommandError, MPDConnectionError, MPDProtocolError
+from .scheduler import Scheduler
+from .pool import WorkerPool, PoolFullError
+from .events import EventBus
+from .metrics import Histogram, Counter, Registry
+from .journal import Journal
+from .fade import Fader
+from .watcher import PlayerWatcher
+from .schedules import ScheduleBook, Schedule, CronRule, ScheduleNotFoundError, parse_duration
+from .fleet import Fleet, Target
+from .logger import Logger
+from .systemd import listen_fds, listen_sockets
+from .caching import StaticAsset, accepts_gzip, etag_matches
+from .diagnostics import Tracer, Profiler, TracedLock
+from .ratelimit import RateLimiter, TokenBucket
+from .prefork import SharedRecord, Forwarder, WorkerProcesses
+try:
+    from .aio import AsyncTimer, AsyncMPDClient, AsyncMPDPauser, AsyncEventBus
+except (SyntaxError, ImportError):
+    # python 2, no asyncio
+    pass
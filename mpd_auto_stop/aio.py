@@ -0,0 +1,457 @@
+#!/usr/bin/env python
+
+# asyncio, python 3 only, the package imports this only where it compiles
+
+from __future__ import print_function
+import asyncio
+import collections
+from .core import InvalidTimerStateError, TimerState
+from .events import Event
+from .mpd import MPDError, MPDConnectionError, MPDProtocolError, HELLO_PREFIX, SUCCESS, NEXT, format_command, format_command_list, parse_line, _split_host
+from .schedules import parse_duration
+
+# python 3.7, get_event_loop is the running loop inside a coroutine too
+get_running_loop = getattr(asyncio, "get_running_loop", asyncio.get_event_loop)
+
+# mpd
+class AsyncMPDClient(object):
+    """
+    MPDClient over asyncio streams, for coroutines on one event loop, one command at a time. Talks either TCP or a
+    unix socket (host starting with `/` or `@`), every connect, read and write gives up after `timeout`.
+    """
+    def __init__(self, host="localhost", port=6600, timeout=5.0):
+        self._password, self._host = _split_host(host)
+        self._port = port
+        self._timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._version = None
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def connected(self):
+        return self._writer is not None
+
+    def _open(self):
+        if self._host.startswith("/") or self._host.startswith("@"):
+            address = self._host
+
+            if address.startswith("@"):
+                address = "\0" + address[1:]
+
+            return asyncio.open_unix_connection(address)
+
+        return asyncio.open_connection(self._host, self._port)
+
+    async def connect(self):
+        if self.connected:
+            return
+
+        try:
+            (self._reader, self._writer) = await asyncio.wait_for(self._open(), self._timeout)
+        except asyncio.TimeoutError:
+            raise MPDConnectionError("Can't connect to mpd @ {0}:{1}: timed out".format(self._host, self._port))
+        except OSError as exp:
+            raise MPDConnectionError("Can't connect to mpd @ {0}:{1}: {2}".format(self._host, self._port, exp))
+
+        hello = await self._read_line()
+
+        if not hello.startswith(HELLO_PREFIX):
+            self.close()
+
+            raise MPDProtocolError("Unexpected greeting from mpd: {0}".format(hello))
+
+        self._version = hello[len(HELLO_PREFIX):]
+
+        if self._password:
+            await self.command("password", self._password)
+
+    def close(self):
+        writer, self._writer = self._writer, None
+        self._reader = None
+
+        if writer is not None:
+            writer.close()
+
+    async def _write(self, text):
+        try:
+            self._writer.write(text.encode("utf8"))
+            await asyncio.wait_for(self._writer.drain(), self._timeout)
+        except asyncio.TimeoutError:
+            self.close()
+
+            raise MPDConnectionError("Error writing to mpd: timed out")
+        except OSError as exp:
+            self.close()
+
+            raise MPDConnectionError("Error writing to mpd: {0}".format(exp))
+
+    async def _read_line(self):
+        try:
+            line = await asyncio.wait_for(self._reader.readline(), self._timeout)
+        except asyncio.TimeoutError:
+            self.close()
+
+            raise MPDConnectionError("Error reading from mpd: timed out")
+        except (OSError, ValueError) as exp:
+            # ValueError, a line longer than the stream's limit
+            self.close()
+
+            raise MPDConnectionError("Error reading from mpd: {0}".format(exp))
+
+        if not line:
+            self.close()
+
+            raise MPDConnectionError("Connection to mpd lost")
+
+        return line.decode("utf8").rstrip("\n")
+
+    async def _read_response(self, terminators=(SUCCESS,)):
+        pairs = []
+
+        while True:
+            line = await self._read_line()
+
+            try:
+                pair = parse_line(line, terminators)
+            except MPDProtocolError:
+                self.close()
+
+                raise
+
+            if pair is None:
+                return (pairs, line)
+
+            pairs.append(pair)
+
+    async def command(self, command, *args):
+        """
+        Sends a single command, returns the response as a dict
+        """
+        await self.connect()
+        await self._write(format_command(command, args))
+        (pairs, _) = await self._read_response()
+
+        return dict(pairs)
+
+    async def command_list(self, commands):
+        """
+        Sends all the commands in one round trip, like MPDClient.command_list
+        """
+        await self.connect()
+        await self._write(format_command_list(commands))
+
+        results = []
+
+        while True:
+            (pairs, terminator) = await self._read_response((SUCCESS, NEXT))
+
+            if terminator == SUCCESS:
+                return results
+
+            results.append(dict(pairs))
+
+    async def __aenter__(self):
+        await self.connect()
+
+        return self
+
+    async def __aexit__(self, *args):
+        self.close()
+
+class AsyncMPDPauser(object):
+    """
+    How an AsyncTimer pauses mpd, over a connection of its own per pause. `mpc` is the command to fall back to when
+    mpd can't be talked to, off by default: depending on the loop's child watcher waiting on a subprocess can cost a
+    thread. Anything with a `pause()` coroutine answering like this one will do in its place.
+    """
+    def __init__(self, host="localhost", port=6600, timeout=5.0, mpc=None):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.mpc = mpc
+
+    async def _pause_with_mpc(self):
+        try:
+            process = await asyncio.create_subprocess_exec(self.mpc, "--host={0}".format(self.host), "--port={0}".format(self.port), "pause", stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE)
+            (_, errors) = await process.communicate()
+        except OSError as exp:
+            return {
+                "status": "failed",
+                "error": str(exp)
+            }
+
+        if process.returncode:
+            return {
+                "status": "failed",
+                "error": errors.decode("utf8", "replace").strip() or "mpc exited with {0}".format(process.returncode)
+            }
+
+        return {
+            "status": "paused",
+            "via": "mpc"
+        }
+
+    async def pause(self):
+        client = AsyncMPDClient(self.host, self.port, self.timeout)
+
+        try:
+            await client.command("pause", 1)
+
+            return {
+                "status": "paused"
+            }
+        except MPDError as exp:
+            if self.mpc:
+                return await self._pause_with_mpc()
+
+            return {
+                "status": "failed",
+                "error": str(exp)
+            }
+        finally:
+            client.close()
+
+# events
+class AsyncSubscription(object):
+    """
+    Subscription for coroutines, `async for` over it ends once it's closed and drained. Pushed to and read from on
+    the loop's thread only.
+    """
+    def __init__(self, bus, max_pending):
+        self._bus = bus
+        self._events = collections.deque()
+        self._max_pending = max_pending
+        self._waiter = None
+        self._closed = False
+        self.dropped = 0
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _wake(self):
+        waiter, self._waiter = self._waiter, None
+
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    def push(self, event):
+        if self._closed:
+            return
+
+        if len(self._events) >= self._max_pending:
+            self._events.popleft()
+            self.dropped += 1
+
+        self._events.append(event)
+        self._wake()
+
+    async def get(self):
+        """
+        Returns the next event, None once the subscription is closed and drained
+        """
+        while not self._events and not self._closed:
+            self._waiter = get_running_loop().create_future()
+            await self._waiter
+
+        if self._events:
+            return self._events.popleft()
+
+        return None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        event = await self.get()
+
+        if event is None:
+            raise StopAsyncIteration
+
+        return event
+
+    def close(self):
+        self._bus.unsubscribe(self)
+        self._closed = True
+        self._wake()
+
+class AsyncEventBus(object):
+    """
+    EventBus for one event loop, no locks, everything happens on the loop's thread
+    """
+    def __init__(self, max_pending=64):
+        self._max_pending = max_pending
+        self._subscriptions = ()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, max_pending=None):
+        subscription = AsyncSubscription(self, max_pending or self._max_pending)
+        self._subscriptions = self._subscriptions + (subscription,)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions = tuple(item for item in self._subscriptions if item is not subscription)
+
+    def publish(self, type, **data):
+        if not self._subscriptions:
+            return
+
+        event = Event(type, data)
+
+        for subscription in self._subscriptions:
+            subscription.push(event)
+
+    def close_all(self):
+        for subscription in self._subscriptions:
+            subscription.close()
+
+# timer
+class AsyncTimer(object):
+    """
+    A sleep timer for asyncio programs, on the caller's event loop without threads: the deadline is a loop.call_at,
+    the pause a coroutine of `pauser`. It goes through the same TimerState transitions as Timer, with deadlines on
+    loop.time(), and publishes the same events to `events`.
+
+    Fades and fleet targets stay with Timer. It doesn't log either, a failed pause is in its `paused` event.
+    """
+    def __init__(self, name=None, pauser=None, events=None):
+        self._name = name
+        self._pauser = pauser or AsyncMPDPauser()
+        self._events = events or AsyncEventBus()
+        self._state = TimerState()
+        self._loop = None
+        self._handle = None
+        # pauses under way, the loop only keeps weak references to tasks
+        self._pausing = set()
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def state(self):
+        return self._state
+
+    def _time(self):
+        return get_running_loop().time()
+
+    def _publish(self, type, **extra):
+        state = self._state
+        data = dict(extra, timer=self._name, status=state.status)
+
+        if state.started:
+            data["remaining_time"] = state.deadline - self._loop.time()
+
+        self._events.publish(type, **data)
+
+    def _cancel(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+    def _arm(self, state):
+        self._cancel()
+        self._loop = get_running_loop()
+        self._state = state
+        self._handle = self._loop.call_at(state.deadline, self._fire, state.deadline)
+
+    def _fire(self, deadline):
+        if not self._state.due(deadline):
+            return
+
+        self._handle = None
+        self._publish("fired")
+
+        task = self._loop.create_task(self._pause(deadline))
+        self._pausing.add(task)
+        task.add_done_callback(self._pausing.discard)
+
+    async def _pause(self, deadline):
+        try:
+            try:
+                result = await self._pauser.pause()
+            except asyncio.CancelledError:
+                raise
+            except Exception as exp:
+                result = {
+                    "status": "failed",
+                    "error": str(exp)
+                }
+
+            self._publish("paused", targets={"default": result})
+        finally:
+            self._stop(deadline)
+
+    def _stop(self, deadline=None):
+        if self._state.due(deadline):
+            self._cancel()
+            self._state = self._state.stop()
+            self._publish("stopped")
+
+    async def start(self, duration):
+        now = self._time()
+
+        if self._state.expired(now):
+            self._stop()
+
+            raise InvalidTimerStateError("Timer has already ended, but state is started")
+
+        if self._state.started:
+            return self._state.remaining(now)
+
+        self._arm(self._state.start(now, parse_duration(duration)))
+        self._publish("started")
+
+        return self._state.remaining(self._time())
+
+    async def restart(self):
+        self._arm(self._state.restart(self._time()))
+        self._publish("restarted")
+
+        return self._state.remaining(self._time())
+
+    async def extend(self, duration):
+        state = self._state
+        self._arm(state.extend(parse_duration(duration) if state.started else 0))
+        self._publish("extended")
+
+        return self._state.remaining(self._time())
+
+    async def stop(self):
+        self._stop()
+
+        return {}
+
+    async def status(self):
+        return self._state.to_dict(self._time())
+
+    def events(self, max_pending=None):
+        """
+        A subscription to the timer's events, `async for event in timer.events()`, close it when done. Timers sharing
+        a bus share their events, `timer` in the data tells them apart.
+        """
+        return self._events.subscribe(max_pending)
+
+    async def close(self):
+        """
+        Stops the timer and waits for a pause under way, for shutting down
+        """
+        self._stop()
+
+        if self._pausing:
+            await asyncio.wait(list(self._pausing))
@@ -10,10 +10,48 @@ try:
 except ImportError:
     import urllib.parse as urlparse
 import json
+import collections
+import functools
 import signal
 import sys
+import socket
+import errno
+import math
+import os
+import stat
+import tempfile
+try:
+    import grp
+except ImportError:
+    # windows
+    grp = None
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+try:
+    import selectors
+except ImportError:
+    # python 2
+    import selectors34 as selectors
 import argparse
-from datetime import datetime, timedelta
+from .mpd import MPDError, pool as mpd_pool
+from .scheduler import scheduler as default_scheduler
+from .pool import WorkerPool, PoolFullError
+from .events import bus as default_bus
+from .metrics import Histogram, Gauge, registry, monotonic
+from .logger import logger, LEVEL_NAMES
+from .journal import Journal, wall_clock
+from .fade import Fader
+from .watcher import PlayerWatcher
+from .fleet import Target, fleet, parse_target, parse_group
+from .schedules import ScheduleBook, ScheduleNotFoundError, parse_duration
+from .systemd import listen_sockets
+from .caching import StaticAsset, etag_matches
+from .diagnostics import TracedLock, tracer, profiler
+from .ratelimit import RateLimiter
+from .core import InvalidTimerStateError, TimerStatus, TimerState
+from .prefork import SharedRecord, Forwarder, ForwardingError, WorkerProcesses, reuseport_socket, watch_parent
 try:
     # python 2
     from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
@@ -45,40 +83,182 @@ def xfloat(text, default=0.0):
     except Exception as exp:
         return default
 
+def dump_json(data):
+    # a span of its own in request traces
+    with tracer.span("json"):
+        return json.dumps(data)
+
 class Log(object):
+    """
+    Goes through the queue-backed logger, the caller never waits on stdout. `fields` are appended as key=value.
+    """
     @staticmethod
-    def print_ok(format, *args):
-        format = xstr(format)
+    def debug(format, *args, **fields):
+        logger.debug(xstr(format), *args, **fields)
 
-        print(format.format(*args))
+    @staticmethod
+    def info(format, *args, **fields):
+        logger.info(xstr(format), *args, **fields)
+
+    @staticmethod
+    def warning(format, *args, **fields):
+        logger.warning(xstr(format), *args, **fields)
+
+    @staticmethod
+    def error(format, *args, **fields):
+        logger.error(xstr(format), *args, **fields)
+
+    # before there were levels
+    print_ok = info
 
 # exceptions
 class TimerExistsError(Exception): pass
 
-class InvalidTimerStateError(Exception): pass
-
 # timer
-class TimerStatus(object):
-    @staticmethod
-    def started():
-        return "started"
+def settles(method):
+    """
+    For Timer methods taking its lock, the fader I/O they leave for after it is done once they return
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._settle()
 
-    @staticmethod
-    def stopped():
-        return "stopped"
+    return wrapper
+
+class StateMirror(object):
+    """
+    The default timer's state and the player state, published by the process running the timer to a SharedRecord,
+    for the worker processes it forks to serve /timer from. Readers keep what they decoded until the record changes.
+    """
+    fields = ("status", "deadline", "duration", "fade", "target", "version")
+
+    def __init__(self, record):
+        self._record = record
+        self._lock = threading.Lock()
+        self._state = TimerState()
+        self._player_state = None
+        # (sequence, (state, player state)) last read
+        self._read = (None, (TimerState(), None))
+
+    def _write(self):
+        data = dict((name, getattr(self._state, name)) for name in self.fields)
+        data["player_state"] = self._player_state
+        self._record.write(json.dumps(data).encode("utf8"))
+
+    def publish_state(self, state):
+        with self._lock:
+            self._state = state
+            self._write()
+
+    def player_changed(self, previous, current):
+        # a PlayerWatcher listener, the player state is part of /timer and its ETag
+        with self._lock:
+            self._player_state = current["state"] if current else None
+            self._write()
+
+    def read(self):
+        """
+        (state, player state) as last published
+        """
+        (sequence, data) = self._record.read(self._read[0])
+
+        if data is not None:
+            values = json.loads(data.decode("utf8"))
+            player_state = values.pop("player_state")
+            # a racing reader may decode it too, they'd store the same thing
+            self._read = (sequence, (TimerState(**values), player_state))
+
+        return self._read[1]
+
+class MetricsMirror(object):
+    """
+    The request metrics of the worker processes with --processes, each one publishes its own to a SharedRecord of its
+    own every `interval` seconds, and the main process, the one answering /metrics, adds them to its own.
+    """
+    names = ("mpd_auto_stop_http_requests_total", "mpd_auto_stop_http_request_seconds")
+
+    def __init__(self, records, interval=1.0):
+        self._records = records
+        self.interval = interval
+        # (sequence, decoded) last read, per worker
+        self._read = [(None, {})] * len(records)
+
+    def publish(self, index, stopped):
+        """
+        Runs in worker `index` until `stopped` is set, publishing once more then
+        """
+        record = self._records[index]
+        published = None
+
+        while True:
+            done = stopped.wait(self.interval)
+            data = json.dumps(registry.export(self.names), sort_keys=True).encode("utf8")
+
+            if data != published:
+                try:
+                    record.write(data)
+                    published = data
+                except ValueError as exp:
+                    Log.warning("Can't publish request metrics", error=exp)
+
+            if done:
+                return
+
+    def collect(self):
+        """
+        What the workers published last, a Registry source
+        """
+        result = []
+
+        for (index, record) in enumerate(self._records):
+            (sequence, data) = record.read(self._read[index][0])
+
+            if data is not None:
+                self._read[index] = (sequence, json.loads(data.decode("utf8")))
+
+            result.append(self._read[index][1])
+
+        return result
 
 class Timer(object):
-    def __init__(self):
-        self._duration_pattern = re.compile("^([0-9]*)(\.?)([0-9]+)([smh])$")
-        self._status = TimerStatus.stopped()
-        self._started = None
-        self._duration = 0
+    def __init__(self, name=None, scheduler=None, on_stopped=None, events=None):
+        self._name = name
+        self._scheduler = scheduler or default_scheduler
+        self._on_stopped = on_stopped
+        self._events = events or default_bus
+        # only replaced, under _lock, never changed in place
+        self._state = TimerState()
         self._timer = None
-        self._lock = threading.Lock()
+        # target name to the Fader lowering its volume
+        self._faders = {}
+        # faders cancelled and created under the lock, their mpd I/O waits for it to be released, see _settle
+        self._restoring = []
+        self._starting = []
+        self._lock = TracedLock(threading.RLock(), tracer)
+        self._mpd_host = "localhost"
+        self._mpd_port = 6600
+        self.journal = None
+        # a StateMirror worker processes serve /timer from, see --processes
+        self.mirror = None
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def state(self):
+        return self._state
 
     @property
     def status(self):
-        return self._status
+        return self._state.status
+
+    @property
+    def target(self):
+        return self._state.target
 
     @property
     def mpd_host(self):
@@ -96,417 +276,2354 @@ class Timer(object):
     def mpd_port(self, value):
         self._mpd_port = value
 
-    def _worker(self):
+    def _endpoints(self):
+        return self._state.targets or [Target("default", self._mpd_host, self._mpd_port)]
+
+    def _pause_with_mpc(self, target):
+        try:
+            output = subprocess.check_output(["mpc", "--host={0}".format(target.host), "--port={0}".format(target.port), "pause"])
+
+            Log.info("Paused with mpc", target=target.name, output=output.decode("utf8", "replace").strip())
+
+            return {
+                "status": "paused",
+                "via": "mpc"
+            }
+        except (subprocess.CalledProcessError, OSError) as exp:
+            Log.error("Error calling mpc", target=target.name, error=exp)
+
+            pause_failures.inc(("mpc",))
+
+            return {
+                "status": "failed",
+                "error": xstr(exp)
+            }
+
+    def _pause_target(self, target, faders):
+        fader = faders.get(target.name)
+        volume = fader.finish() if fader else None
+        state = player_watcher.state if player_watcher and player_watcher.follows(target.host, target.port) else None
+
+        # nothing to pause, the user already did, don't bother mpd
+        if state and state["state"] != "play":
+            if volume is not None:
+                fader.cancel()
+
+            Log.info("Player isn't playing, not pausing", target=target.name, player_state=state["state"])
+
+            return {
+                "status": "skipped",
+                "player_state": state["state"]
+            }
+
+        started = monotonic()
+
         try:
-            output = subprocess.check_output(["mpc", "--host={0}".format(self._mpd_host), "--port={0}".format(self._mpd_port), "pause"])
+            if volume is None:
+                mpd_pool.command(target.host, target.port, "pause", 1)
+            else:
+                # one round trip, so the volume is back by the time anyone presses play
+                mpd_pool.command_list(target.host, target.port, [("pause", 1), ("setvol", volume)])
+
+            Log.info("Paused mpd", target=target.name, host=target.host, port=target.port)
+
+            return {
+                "status": "paused"
+            }
+        except MPDError as exp:
+            Log.warning("Error talking to mpd, falling back to mpc", target=target.name, error=exp)
 
-            Log.print_ok(output)
-        except subprocess.CalledProcessError as exp:
-            Log.print_ok("Error calling command: {0}", exp.message)
+            pause_failures.inc(("mpd",))
+
+            return self._pause_with_mpc(target)
         finally:
-            self.stop()
+            pause_seconds.observe(monotonic() - started)
 
-    def _parse_duration(self, duration):
-        duration = xstr(duration)
-        duration = duration.lower()
-        match = self._duration_pattern.match(duration)
-        
-        if not match:
-            raise ValueError("Invalid duration: " + duration)
+    def _pause(self):
+        faders, self._faders = self._faders, {}
 
-        duration = xfloat("".join(match.groups()[:3]))
-        
-        unit = xstr(match.groups()[3])
+        # every target at once, pausing a fleet takes as long as its slowest member
+        results = fleet.run(self._endpoints(), self._pause_target, faders)
 
-        if unit == "m":
-            duration = duration * 60
-        
-        if unit == "h":
-            duration = duration * 60 * 60
+        for (name, result) in results.items():
+            if result["status"] == "failed":
+                Log.error("Failed to pause", timer=self._name, target=name, error=result.get("error"))
+
+        return results
+
+    def _publish(self, type, **extra):
+        timer_operations.inc((type,))
+
+        state = self._state
+        data = dict(extra, timer=self._name, status=state.status)
+
+        if state.started:
+            data["remaining_time"] = state.deadline - self._scheduler.time()
+
+        self._events.publish(type, **data)
+
+    def _mirror(self):
+        # under the lock, so the mirror sees states in the order they were swapped in
+        if self.mirror is not None:
+            self.mirror.publish_state(self._state)
+
+    def _record(self, op):
+        if self.journal is None:
+            return
+
+        state = self._state
+
+        if op == "stop":
+            self.journal.record(op, self._name)
+        else:
+            self.journal.record(op, self._name, wall_clock(state.deadline, self._scheduler.time), state.duration, state.fade, state.target)
+
+    def _worker(self, deadline=None):
+        with self._lock:
+            # a restart or extend won the race with the dispatcher, the deadline this call was for is gone
+            if deadline is not None and deadline != self._state.deadline:
+                return
+
+            self._publish("fired")
+
+        try:
+            results = self._pause()
+
+            if results:
+                with self._lock:
+                    self._publish("paused", targets=results)
+
+            if deadline is not None:
+                fire_jitter.observe(self._scheduler.time() - deadline)
+        finally:
+            self._stop(deadline)
 
-        return duration
+    def _parse_duration(self, duration):
+        return parse_duration(xstr(duration))
 
     def _stop_timer(self):
         if self._timer:
             self._timer.cancel()
             self._timer = None
 
+        faders, self._faders = self._faders, {}
+
+        for fader in faders.values():
+            fader.finish(wait=False)
+
+        self._restoring.extend(faders.values())
+
+    def _settle(self):
+        """
+        Puts back the volume of faders cancelled under the lock, then starts the new ones, a restart within the fade
+        has the new fader read the restored volume. Outside the lock, a slow mpd doesn't hold up the timer.
+        """
+        with self._lock:
+            restoring, self._restoring = self._restoring, []
+            starting, self._starting = self._starting, []
+
+        for fader in restoring:
+            fader.restore()
+
+        for fader in starting:
+            fader.start()
+
     def _get_remaining_time(self):
-        now = datetime.now()
-        timer_endtime = self._started + timedelta(seconds=self._duration)
+        return self._state.deadline - self._scheduler.time()
+
+    def _arm(self, state):
+        """
+        Makes `state` the current one and schedules its deadline
+        """
+        self._stop_timer()
+        self._state = state
+        self._mirror()
+        deadline = state.deadline
+        self._timer = self._scheduler.call_at(deadline, self._worker, deadline)
+
+        if state.fade > 0:
+            fade_start = max(self._scheduler.time(), deadline - state.fade)
+            # a fleet's steps go through its pool, so one slow speaker doesn't hold up the others' fades
+            executor = fleet.submit if len(self._endpoints()) > 1 else None
 
-        remaining_time = (timer_endtime - now).total_seconds()
+            for target in self._endpoints():
+                fader = self._faders[target.name] = Fader(self._scheduler, target.host, target.port, fade_start, deadline, executor=executor)
+                self._starting.append(fader)
 
-        return remaining_time
+    def _player_state(self):
+        # cached from the idle connection, no mpd round trip
+        state = player_watcher.state if player_watcher else None
+
+        return state["state"] if state else None
 
     def get_status(self):
-        result = {
-            "status": self.status
-        }
+        # lock free, one snapshot read can't see half of an extend
+        return self._state.to_dict(self._scheduler.time(), self._player_state())
 
-        if self.status == TimerStatus.started():
-            result["remaining_time"] = "{0} seconds".format(self._get_remaining_time())
-        
-        return result
+    def get_status_json(self):
+        """
+        get_status already serialized, mostly cached between changes
+        """
+        return self._state.to_json(self._scheduler.time(), self._player_state())
+
+    def get_status_with_etag(self):
+        """
+        (get_status_json, its ETag), both of the same state
+        """
+        state = self._state
+        player_state = self._player_state()
 
-    def start(self, duration):
+        return (state.to_json(self._scheduler.time(), player_state), state.etag(player_state))
+
+    def _resolve(self, target, mpd_host=None, mpd_port=None):
+        # resolved up front, an unknown target fails the start rather than the pause
+        if target:
+            return fleet.resolve(target)
+
+        # another mpd for this run only, the timer's own stays its default
+        if mpd_host or mpd_port:
+            return [Target("default", mpd_host or self._mpd_host, mpd_port or self._mpd_port)]
+
+        return None
+
+    @settles
+    def start(self, duration, fade=None, target=None, mpd_host=None, mpd_port=None):
         with self._lock:
-            if self.status == TimerStatus.started():
-                now = datetime.now()
-                timer_endtime = self._started + timedelta(seconds=self._duration)
+            if self._state.expired(self._scheduler.time()):
+                self.stop()
 
-                if timer_endtime < now:
-                    self.stop()
+                Log.warning("Timer has already ended, but state is started", timer=self._name)
 
-                    Log.print_ok("Timer has already ended, but state is started")
+                raise InvalidTimerStateError("Timer has already ended, but state is started")
 
-                    raise InvalidTimerStateError("Timer has already ended, but state is started")
+            if self._state.started:
+                return self._state.remaining(self._scheduler.time())
 
-                remaining_time = (timer_endtime - now).total_seconds()
+            duration = self._parse_duration(duration)
+            fade = self._parse_duration(fade) if fade else 0
+            targets = self._resolve(target, mpd_host, mpd_port)
+            self._arm(self._state.start(self._scheduler.time(), duration, fade, target, targets))
 
-                return {
-                    "remaining_time": "{0} seconds".format(remaining_time)
-                }
+            Log.info("Timer started", timer=self._name, duration=duration, fade=self._state.fade or None, target=target)
 
-            self._stop_timer()
+            self._record("start")
+            self._publish("started")
 
-            self._status = TimerStatus.started()
-            self._started = datetime.now()
-            self._duration = duration = self._parse_duration(duration)
+            return self._state.remaining(self._scheduler.time())
 
-            self._timer = threading.Timer(duration, self._worker)
-            self._timer.start()
+    @settles
+    def resume(self, remaining_time, duration, fade=0, target=None):
+        """
+        Re-arms a timer recovered from the journal, a deadline that passed while we were down fires right away
+        """
+        with self._lock:
+            targets = self._resolve(target)
+            self._arm(self._state.resume(self._scheduler.time(), remaining_time, duration, fade, target, targets))
 
-            Log.print_ok("Timer started with duration {0} seconds", duration)
+            Log.info("Timer resumed", timer=self._name, remaining_time=max(remaining_time, 0), target=target)
 
-            return {
-                "remaining_time": "{0} seconds".format(self._get_remaining_time())
-            }
+            self._record("start")
+            self._publish("started")
 
-    def stop(self):
+            return self._state.remaining(self._scheduler.time())
+
+    def _stop(self, deadline=None):
         with self._lock:
-            if self.status == TimerStatus.started():
+            if self._state.due(deadline):
                 self._stop_timer()
 
-                self._status = TimerStatus.stopped()
-                self._started = None
-                self._duration = 0
+                self._state = self._state.stop()
+                self._mirror()
+
+                Log.info("Timer stopped", timer=self._name)
 
-                Log.print_ok("Timer stopped")
+                self._record("stop")
+                self._publish("stopped")
+
+        self._settle()
+
+        # outside the lock, the callback may take the lock of whoever owns this timer
+        if self._on_stopped:
+            self._on_stopped(self)
 
         return {}
 
+    def stop(self):
+        return self._stop()
+
+    @settles
     def restart(self):
         with self._lock:
-            if self.status == TimerStatus.started():
-                self._stop_timer()
+            try:
+                state = self._state.restart(self._scheduler.time())
+            except InvalidTimerStateError as exp:
+                Log.warning(exp, timer=self._name)
 
-                self._started = datetime.now()
+                raise
 
-                self._timer = threading.Timer(self._duration, self._worker)
-                self._timer.start()
+            self._arm(state)
 
-                Log.print_ok("Timer restarted with duration {0} seconds", self._duration)
+            Log.info("Timer restarted", timer=self._name, duration=state.duration)
 
-                return {
-                    "remaining_time": "{0} seconds".format(self._get_remaining_time())
-                }
-            else:
-                Log.print_ok("Can't restart a stopped timer")
+            self._record("restart")
+            self._publish("restarted")
 
-                raise InvalidTimerStateError("Can't restart a stopped timer")
+            return state.remaining(self._scheduler.time())
 
+    @settles
     def extend(self, duration):
         with self._lock:
-            if self.status == TimerStatus.started():
-                self._stop_timer()
+            state = self._state
 
-                remaining_time = self._get_remaining_time()
-                self._duration = duration = remaining_time + self._parse_duration(duration)
+            try:
+                # stopped is what a stopped timer is told, whatever the duration
+                state = state.extend(self._parse_duration(duration) if state.started else 0)
+            except InvalidTimerStateError as exp:
+                Log.warning(exp, timer=self._name)
 
-                self._timer = threading.Timer(duration, self._worker)
-                self._timer.start()
+                raise
 
-                Log.print_ok("Timer extended with duration {0} seconds", duration)
+            self._arm(state)
 
-                return {
-                    "remaining_time": "{0} seconds".format(duration)
-                }
-            else:
-                Log.print_ok("Can't extend a stopped timer")
+            Log.info("Timer extended", timer=self._name, remaining_time=state.deadline - self._scheduler.time())
 
-                raise InvalidTimerStateError("Can't extend a stopped timer")
+            self._record("extend")
+            self._publish("extended")
 
-# server
-class Route(object):
-    def __init__(self, pattern, handler):
-        self._pattern = pattern
-        self._handler = handler
+            return state.remaining(self._scheduler.time())
 
-    @property
-    def pattern(self):
-        return self._pattern
+class TimerRegistry(object):
+    """
+    Named timers sharing one scheduler, stopped timers are dropped so only pending ones take up memory
+    """
+    def __init__(self, scheduler=None):
+        self._scheduler = scheduler or default_scheduler
+        self._timers = {}
+        self._lock = TracedLock(threading.RLock(), tracer)
+        self.mpd_host = "localhost"
+        self.mpd_port = 6600
+        self.journal = None
 
-    @property
-    def handler(self):
-        return self._handler
+    def __len__(self):
+        return len(self._timers)
 
-class TimerRequestHandler(BaseHTTPRequestHandler):
-    routes = None
-
-    def _get_routes(self):
-        if not self.routes:
-            self.routes = []
-            self.routes.append(Route(re.compile('/?$'), self._index))
-            self.routes.append(Route(re.compile('/timer$'), self._timer_status))
-            self.routes.append(Route(re.compile('/timer/(?P<duration>[\.0-9a-zA-Z]+)/start$'), self._timer_start))
-            self.routes.append(Route(re.compile('/timer/stop$'), self._timer_stop))
-            self.routes.append(Route(re.compile('/timer/restart$'), self._timer_restart))
-            self.routes.append(Route(re.compile('/timer/(?P<duration>[\.0-9a-zA-Z]+)/extend$'), self._timer_extend))
-            self.routes.append(Route(re.compile('.*'), self._match_all))
-        
-        return self.routes
+    def _discard(self, timer):
+        with self._lock:
+            if self._timers.get(timer.name) is timer and timer.status == TimerStatus.stopped():
+                del self._timers[timer.name]
 
-    def _match_route(self, path):
-        for route in self._get_routes():
-            match = route.pattern.match(path)
+    def _get(self, name):
+        timer = self._timers.get(name)
 
-            if match:
-                return (match, route)
+        if timer is None:
+            raise InvalidTimerStateError("No timer named {0}".format(name))
 
-    def do_GET(self):
-        path = urlparse.urlparse(self.path).path
-        (match, route) = self._match_route(path)
+        return timer
 
-        (status, headers, result) = route.handler(match)
+    def get_status(self, name):
+        timer = self._timers.get(name)
 
-        for header in headers.items():
-            self.send_header(header[0], header[1])
+        if timer is None:
+            return {
+                "status": TimerStatus.stopped()
+            }
 
-        self.send_response(status)
-        self.end_headers()
-        self.wfile.write(result.encode("utf8"))
+        return timer.get_status()
 
-        return
-    
-    def _index(self, match):
-        content = r"""
-        <html>
-            <header>
-                <title>MPD Auto Stop</title>
-                <style>
-                    body {
-                        font-family: sans-serif, verdana;
-                    }
-
-                    pre {
-                        margin-bottom: -10px;
-                    }
-                </style>
-            </header>
-            <body>
-                <div>
-                    <pre>,-.-.,---.,--.     ,---..   .--.--,---.    ,---.--.--,---.,---.</pre>
-                    <pre>| | ||---'|   |    |---||   |  |  |   |    `---.  |  |   ||---'</pre>
-                    <pre>| | ||    |   |    |   ||   |  |  |   |        |  |  |   ||    </pre>
-                    <pre>` ' '`    `--'     `   '`---'  `  `---'    `---'  `  `---'`    </pre>
-                </div>
-                <br/>
-                <div>
-                    <div>The following actions are available,</div>
-                    <ul>
-                        <li>
-                            Status - /timer
-                        </li>
-                        <li>
-                            Start Timer - /timer/<time>/start. Ex: /timer/3600s/start, /timer/1h/start, /timer/60m/start
-                        </li>
-                        <li>
-                            Stop Timer - /timer/stop
-                        </li>
-                        <li>
-                            Reset Timer - /timer/reset
-                        </li>
-                        <li>
-                            Extend Timer - /timer/<time>/extend. Ex: /timer/1800s/extend, /timer/0.5h/extend, /timer/30m/extend
-                        </li>
-                    </ul>
-                </div>
-            </body>
-        </html>
-        """
+    def get_status_json(self, name):
+        return self.get_status_with_etag(name)[0]
 
-        headers = {
-            "Content-Type": "text/html"
-        }
+    def get_status_with_etag(self, name):
+        timer = self._timers.get(name)
 
-        return (200, headers, content)
+        if timer is None:
+            return (json.dumps(self.get_status(name)), TimerState().etag())
 
-    def _timer_status(self, match):
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            result = timer.get_status()
+        return timer.get_status_with_etag()
 
-            return (200, headers, json.dumps(result))
-        except Exception as exp:
-            result = {
-                "error": exp.message
-            }
+    def get_statuses(self):
+        with self._lock:
+            timers = list(self._timers.values())
 
-            return (500, headers, json.dumps(result))
+        return dict((timer.name, timer.get_status()) for timer in timers)
 
-    def _timer_start(self, match):
-        headers = {
-            "Content-Type": "application/json"
-        }
+    def _create(self, name, mpd_host=None, mpd_port=None):
+        timer = Timer(name, self._scheduler, self._discard)
+        timer.mpd_host = mpd_host or self.mpd_host
+        timer.mpd_port = mpd_port or self.mpd_port
+        timer.journal = self.journal
 
-        try:
-            duration = match.groupdict()["duration"]
-            result = timer.start(duration)
+        return timer
 
-            return (200, headers, json.dumps(result))
-        except ValueError as exp:
-            result = {
-                "error": exp.message
-            }
+    def start(self, name, duration, fade=None, mpd_host=None, mpd_port=None, target=None):
+        with self._lock:
+            timer = self._timers.get(name) or self._create(name, mpd_host, mpd_port)
 
-            return (400, headers, json.dumps(result))
-        except InvalidTimerStateError as exp:
-            result = {
-                "error": exp.message
-            }
+            result = timer.start(duration, fade, target)
+            self._timers[name] = timer
 
-            return (400, headers, json.dumps(result))
-        except Exception as exp:
-            result = {
-                "error": exp.message
-            }
+            return result
 
-            return (500, headers, json.dumps(result))
+    def resume(self, name, remaining_time, duration, fade=0, target=None):
+        with self._lock:
+            timer = self._timers.get(name) or self._create(name)
 
-    def _timer_stop(self, match):
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            result = timer.stop()
+            result = timer.resume(remaining_time, duration, fade, target)
+            self._timers[name] = timer
 
-            return (200, headers, json.dumps(result))
-        except Exception as exp:
-            result = {
-                "error": exp.message
-            }
+            return result
 
-            return (500, headers, json.dumps(result))
+    def stop(self, name):
+        with self._lock:
+            timer = self._timers.pop(name, None)
 
-    def _timer_restart(self, match):
-        headers = {
-            "Content-Type": "application/json"
-        }
-        
-        try:
-            result = timer.restart()
+        if timer:
+            timer.stop()
 
-            return (200, headers, json.dumps(result))
-        except InvalidTimerStateError as exp:
-            result = {
-                "error": exp.message
-            }
+        return {}
 
-            return (400, headers, json.dumps(result))
-        except Exception as exp:
-            result = {
-                "error": exp.message
-            }
+    def restart(self, name):
+        with self._lock:
+            return self._get(name).restart()
 
-            return (500, headers, json.dumps(result))
+    def extend(self, name, duration):
+        with self._lock:
+            return self._get(name).extend(duration)
 
-    def _timer_extend(self, match):
-        headers = {
-            "Content-Type": "application/json"
-        }
+    def _mpd_targets(self, operation):
+        if operation.get("target"):
+            return fleet.resolve(operation["target"])
 
-        try:
-            duration = match.groupdict()["duration"]
-            result = timer.extend(duration)
+        mpd_host = operation.get("mpd_host") or self.mpd_host
+        mpd_port = xint(operation.get("mpd_port"), None) or self.mpd_port
 
-            return (200, headers, json.dumps(result))
-        except ValueError as exp:
-            result = {
-                "error": exp.message
-            }
+        if (mpd_host, mpd_port) == (self.mpd_host, self.mpd_port):
+            return [Target("default", mpd_host, mpd_port)]
 
-            return (400, headers, json.dumps(result))
-        except InvalidTimerStateError as exp:
-            result = {
-                "error": exp.message
-            }
+        return [Target("{0}:{1}".format(mpd_host, mpd_port), mpd_host, mpd_port)]
 
-            return (400, headers, json.dumps(result))
-        except Exception as exp:
-            result = {
-                "error": exp.message
-            }
+    def _apply(self, operation, default, commands):
+        op = operation.get("op")
+        name = operation.get("timer")
+        mpd_host = operation.get("mpd_host")
+        mpd_port = xint(operation.get("mpd_port"), None)
+        target = operation.get("target")
 
-            return (500, headers, json.dumps(result))
+        if op in ("pause", "setvol"):
+            command = ("pause", 1) if op == "pause" else ("setvol", xint(operation.get("volume"), -1))
+            targets = self._mpd_targets(operation)
 
-    def _match_all(self, match):
-        return (404, {}, "Not found")
+            for item in targets:
+                commands.setdefault(item.name, (item, []))[1].append(command)
 
-# app
-class App(object):
-    def __init__(self, host, port):
-        self.host = host
-        self.port = port
-        self.stopped = 0
+            # answered once the command lists have been sent, by the targets they went to
+            return [item.name for item in targets]
 
-    def _signal_handler(self, signal_number, frame):
-        Log.print_ok("Received signal {0}, stopping server...", signal_number)
-        self.stopped = 1
+        if op not in ("start", "stop", "restart", "extend"):
+            raise ValueError("Unknown op: {0}".format(op))
 
-    def _register_signals(self):
-        signal.signal(signal.SIGTERM, self._signal_handler)
+        if op in ("start", "extend") and not operation.get("duration"):
+            raise ValueError("Missing duration for {0}".format(op))
 
-    def start(self):
-        self.server = HTTPServer((self.host, self.port), TimerRequestHandler)
-        self._register_signals()
-        
-        Log.print_ok("Starting server @ {0}:{1}, use <Ctrl-C> to stop", self.host, self.port)
+        if name is not None:
+            if op == "start":
+                return self.start(name, operation["duration"], operation.get("fade"), mpd_host, mpd_port, target)
 
-        try:
-            while not self.stopped:
-                self.server._handle_request_noblock()
-            
-            Log.print_ok("Stopped...")
-        except KeyboardInterrupt:
-            self.server.server_close()
-            Log.print_ok("Stopped...")
+            if op == "extend":
+                return self.extend(name, operation["duration"])
 
-# arguments
-def parse_args(args):
-    parser = argparse.ArgumentParser(description="MPD Auto Stop - auto stopping Music Player Daemon, by setting up timers")
-    parser.add_argument("-a", "--host", help="Host to run the server on [default: 0.0.0.0]", default="0.0.0.0")
-    parser.add_argument("-p", "--port", help="Port to the server should listen on [default: 9090]", default=9090, type=int)
-    parser.add_argument("-mh", "--mpd-host", help="Host where mpd runs [default: localhost]", default="localhost")
-    parser.add_argument("-mp", "--mpd-port", help="Port where mpd listens on [default: 6600]", default=6600, type=int)
+            return getattr(self, op)(name)
 
-    return parser.parse_args(args)
+        if default is None:
+            raise ValueError("Missing timer")
 
-# main
-def main():
-    args = parse_args(sys.argv[1:])
+        if op == "start":
+            return default.start(operation["duration"], operation.get("fade"), target, mpd_host, mpd_port)
+
+        if op == "extend":
+            return default.extend(operation["duration"])
+
+        return getattr(default, op)()
 
-    timer.mpd_host = args.mpd_host
-    timer.mpd_port = args.mpd_port
+    def _send(self, target, commands):
+        mpd_pool.command_list(target.host, target.port, commands)
+
+        return {
+            "status": "ok"
+        }
+
+    def apply(self, operations, default=None):
+        """
+        Runs a batch of operations, dicts with `op`, `timer` and their arguments, in one pass under the registry
+        lock. `timer` null means `default`. `pause` and `setvol` ops are sent afterwards, one command list per
+        mpd, to all of them at once. Returns one result per operation, with the HTTP status it would have had on
+        its own, mpd ops also get the outcome for each `targets` they went to.
+        """
+        results = []
+        pending = {}
+        # target name to (target, commands), in the order they first appear
+        commands = collections.OrderedDict()
+
+        with self._lock:
+            for (index, operation) in enumerate(operations):
+                try:
+                    if not isinstance(operation, dict):
+                        raise ValueError("Operations must be objects")
+
+                    result = self._apply(operation, default, commands)
+
+                    if isinstance(result, list):
+                        pending[index] = result
+                        result = None
+                    else:
+                        result = dict(result, status=200)
+                except (ValueError, InvalidTimerStateError) as exp:
+                    result = {"status": 400, "error": xstr(exp)}
+                except Exception as exp:
+                    result = {"status": 500, "error": xstr(exp)}
+
+                results.append(result)
+
+        # network round trips happen outside the lock
+        sent = fleet.run([target for (target, _) in commands.values()], lambda target: self._send(target, commands[target.name][1])) if commands else {}
+
+        for (index, names) in pending.items():
+            outcomes = dict((name, sent[name]) for name in names)
+            failed = any(outcome["status"] == "failed" for outcome in outcomes.values())
+
+            results[index] = {
+                "status": 502 if failed else 200,
+                "targets": outcomes
+            }
 
-    app = App(args.host, args.port)
-    app.start()
+        return results
 
+class PlayerPolicy(object):
+    """
+    Reacts to player state changes, cancels timers once playback stops and arms a default timer once it starts
+    """
+    def __init__(self, auto_cancel=False, auto_arm=None):
+        self.auto_cancel = auto_cancel
+        self.auto_arm = auto_arm
+
+    def __call__(self, previous, current):
+        was_playing = previous is not None and previous["state"] == "play"
+        is_playing = current["state"] == "play"
+
+        if self.auto_cancel and was_playing and not is_playing:
+            Log.info("Playback stopped, cancelling timers", player_state=current["state"])
+
+            timer.stop()
+
+            for name in timers.get_statuses():
+                timers.stop(name)
+
+        if self.auto_arm and is_playing and not was_playing and timer.status == TimerStatus.stopped():
+            Log.info("Playback started, arming a timer", duration=self.auto_arm)
+
+            timer.start(self.auto_arm)
+
+def fire_schedule(schedule, at):
+    """
+    Runs `fade` ahead of a schedule's time, starts its named timer to end right at it
+    """
+    remaining_time = max(at - time.time(), 0)
+
+    Log.info("Schedule fired", schedule=schedule.id, remaining_time=round(remaining_time, 1), target=schedule.target)
+
+    timers.start(schedule.timer_name, "{0:.3f}s".format(remaining_time), "{0:.3f}s".format(schedule.fade_seconds) if schedule.fade_seconds else None, target=schedule.target)
+
+# server
+class Router(object):
+    """
+    Maps (method, path) to handlers. Static paths are a dict lookup, parameterized ones like `/timer/<duration>/start`
+    are all tried at once through one combined pattern, in the order they were added.
+    """
+    parameters = {
+        "duration": "[\\.0-9a-zA-Z]+",
+        "name": "[-_0-9a-zA-Z]+",
+        "id": "[-_0-9a-zA-Z]+",
+        "target": "[-_0-9a-zA-Z]+"
+    }
+
+    def __init__(self):
+        self._static = {}
+        self._dynamic = []
+        self._pattern = None
+        # handler to the path it was first added under, a bounded label for metrics
+        self.paths = {}
+        # handlers that change state, rate limited on their own budget
+        self.mutating = set()
+
+    def _compile_path(self, index, path):
+        def parameter(match):
+            return "(?P<r{0}_{1}>{2})".format(index, match.group(1), self.parameters[match.group(1)])
+
+        return re.sub("<([a-z_]+)>", parameter, re.escape(path).replace("\\<", "<").replace("\\>", ">"))
+
+    def add(self, path, handler, methods=("GET",), mutating=None):
+        """
+        Anything but a GET changes state, `mutating` marks the GETs that do too, like `/timer/stop`
+        """
+        self.paths.setdefault(handler, path)
+
+        if mutating or (mutating is None and any(method != "GET" for method in methods)):
+            self.mutating.add(handler)
+
+        if "<" not in path:
+            handlers = self._static.setdefault(path, {})
+        else:
+            for (existing, _, handlers) in self._dynamic:
+                if existing == path:
+                    break
+            else:
+                handlers = {}
+                self._dynamic.append((path, re.findall("<([a-z_]+)>", path), handlers))
+
+            self._pattern = None
+
+        for method in methods:
+            handlers[method] = handler
+
+    def routes(self):
+        """
+        (path, method, handler) of every route, parameterized ones in the order they're tried
+        """
+        for (path, handlers) in self._static.items():
+            for (method, handler) in handlers.items():
+                yield (path, method, handler)
+
+        for (path, _, handlers) in self._dynamic:
+            for (method, handler) in handlers.items():
+                yield (path, method, handler)
+
+    def compile(self):
+        alternatives = ["(?P<r{0}>{1})".format(index, self._compile_path(index, path)) for (index, (path, _, _)) in enumerate(self._dynamic)]
+        self._pattern = re.compile("(?:{0})$".format("|".join(alternatives)))
+
+        return self._pattern
+
+    def match(self, method, path):
+        """
+        Returns (handler, params, allowed methods), handler is None when nothing matches the path or the method
+        """
+        handlers = self._static.get(path)
+        params = {}
+
+        if handlers is None and self._dynamic:
+            match = (self._pattern or self.compile()).match(path)
+
+            if match:
+                # the alternative's own group closes last, its name holds the index of the route
+                route = match.lastgroup
+                (_, names, handlers) = self._dynamic[int(route[1:])]
+                params = dict((name, match.group(route + "_" + name)) for name in names)
+
+        if handlers is None:
+            return (None, params, ())
+
+        return (handlers.get(method), params, tuple(sorted(handlers)))
+
+# index page
+INDEX_PAGE = r"""
+<html>
+    <header>
+        <title>MPD Auto Stop</title>
+        <style>
+            body {
+                font-family: sans-serif, verdana;
+            }
+
+            pre {
+                margin-bottom: -10px;
+            }
+        </style>
+    </header>
+    <body>
+        <div>
+            <pre>,-.-.,---.,--.     ,---..   .--.--,---.    ,---.--.--,---.,---.</pre>
+            <pre>| | ||---'|   |    |---||   |  |  |   |    `---.  |  |   ||---'</pre>
+            <pre>| | ||    |   |    |   ||   |  |  |   |        |  |  |   ||    </pre>
+            <pre>` ' '`    `--'     `   '`---'  `  `---'    `---'  `  `---'`    </pre>
+        </div>
+        <br/>
+        <div>
+            <div>The following actions are available,</div>
+            <ul>
+                <li>
+                    Status - /timer
+                </li>
+                <li>
+                    Start Timer - /timer/<time>/start. Ex: /timer/3600s/start, /timer/1h/start, /timer/60m/start
+                </li>
+                <li>
+                    Stop Timer - /timer/stop
+                </li>
+                <li>
+                    Reset Timer - /timer/reset
+                </li>
+                <li>
+                    Extend Timer - /timer/<time>/extend. Ex: /timer/1800s/extend, /timer/0.5h/extend, /timer/30m/extend
+                </li>
+            </ul>
+        </div>
+    </body>
+</html>
+"""
+
+class TimerRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body go out in separate writes, with nagle on a kept alive connection stalls on the delayed ack
+    disable_nagle_algorithm = True
+    # built once below the class, shared by every request
+    router = Router()
+    # seconds a keep-alive connection keeps its worker after a request, waiting for the next one, see _idle
+    linger = 0.002
+    # bytes of request body read into memory, at most
+    max_body = 65536
+
+    def setup(self):
+        # keep-alive only pays off when other connections don't wait behind this one, see PooledHTTPServer
+        self.keep_alive = getattr(self.server, "keep_alive", False)
+        self.timeout = getattr(self.server, "keep_alive_timeout", None)
+        self.keep_alive_requests = getattr(self.server, "keep_alive_requests", 1)
+        self.requests_served = 0
+        # there's no nagle to disable on a unix socket, setting TCP_NODELAY fails
+        self.disable_nagle_algorithm = getattr(self.server, "address_family", None) != UnixServerMixin.address_family
+
+        BaseHTTPRequestHandler.setup(self)
+        # waiting for its next request in the server's selector rather than on a worker, see PooledHTTPServer.park
+        self.parked = False
+
+    def handle(self):
+        # BaseHTTPRequestHandler.handle, until the connection goes idle
+        self.close_connection = True
+        self.handle_one_request()
+
+        while not self.close_connection:
+            if getattr(self.server, "on_park", None) and self._idle():
+                self.parked = True
+
+                return
+
+            self.handle_one_request()
+
+    def finish(self):
+        if not self.parked:
+            BaseHTTPRequestHandler.finish(self)
+
+            return
+
+        try:
+            self.wfile.flush()
+        except socket.error:
+            # noticed on its next read, once it's back
+            pass
+
+    def resume(self):
+        """
+        Serves the requests of a parked connection, once its next one came in
+        """
+        self.parked = False
+        self.handle()
+        self.finish()
+
+    def _buffered(self):
+        """
+        Whether the client sent more than the request just served, it's read already and its socket can't tell
+        """
+        # python 2
+        rbuf = getattr(self.rfile, "_rbuf", None)
+
+        if rbuf is not None:
+            return rbuf.tell() > 0
+
+        # python 3, peek returns what's buffered, reading the socket only while it's empty and never blocking on it
+        self.connection.settimeout(0)
+
+        try:
+            return bool(self.rfile.peek(1))
+        except socket.error:
+            return False
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def _idle(self):
+        """
+        Whether nothing came from the client for `linger` seconds after the request just served
+        """
+        if self._buffered():
+            return False
+
+        # a client sending requests back to back has its next one in about now, parking it would cost a trip
+        # through the serving loop, unless others are waiting for the worker
+        self.connection.settimeout(0 if self.server.pool.queued else self.linger)
+
+        try:
+            # the request, or an empty string for a client that's gone, either one is up to handle_one_request
+            self.connection.recv(1, socket.MSG_PEEK)
+
+            return False
+        except socket.timeout:
+            return True
+        except socket.error as exp:
+            return exp.errno in (errno.EAGAIN, errno.EWOULDBLOCK)
+        finally:
+            self.connection.settimeout(self.timeout)
+
+    def log_message(self, format, *args):
+        # the default writes every request to stderr right here, under load that's a blocking write per request
+        Log.info(format % args, client=self._client())
+
+    def _client(self):
+        return self.client_address[0]
+
+    def _rate_limit(self, handler):
+        """
+        0 when the client may go ahead, otherwise the seconds it should wait
+        """
+        # unix socket clients all share one address, and so one bucket
+        return (write_limiter if handler in self.router.mutating else read_limiter).acquire(self._client())
+
+    def _should_close(self):
+        if not self.keep_alive or self.requests_served >= self.keep_alive_requests:
+            return True
+
+        connection = xstr(self.headers.get("Connection")).lower()
+
+        if self.request_version == "HTTP/1.0":
+            return connection != "keep-alive"
+
+        return connection == "close"
+
+    def _send(self, status, headers, body):
+        if not isinstance(body, bytes):
+            body = body.encode("utf8")
+
+        self.requests_served += 1
+        # a handler may close the connection itself, like a rejected event stream whose client reconnects anyway
+        self.close_connection = headers.pop("Connection", None) == "close" or self._should_close()
+
+        self.send_response(status)
+
+        for header in headers.items():
+            self.send_header(header[0], header[1])
+
+        # a 304 has no body, and a Content-Length there would have to be the one of the full response
+        if status != 304:
+            self.send_header("Content-Length", str(len(body)))
+
+        if self.close_connection:
+            self.send_header("Connection", "close")
+        elif self.request_version == "HTTP/1.0":
+            self.send_header("Connection", "keep-alive")
+
+        self.end_headers()
+
+        if status != 304:
+            self.wfile.write(body)
+
+    def _cached(self, status, headers, body, etag):
+        """
+        The response with its `etag`, or a 304 without the body when the client's copy still matches
+        """
+        headers["ETag"] = etag
+
+        if status == 200 and etag_matches(self.headers.get("If-None-Match"), etag):
+            headers = dict((name, value) for (name, value) in headers.items() if name in ("ETag", "Cache-Control", "Vary"))
+
+            return (304, headers, b"")
+
+        return (status, headers, body)
+
+    def _dispatch(self, method):
+        # both are a flag check while diagnostics are off
+        if profiler.active:
+            profiler.run(self._handle, method)
+        else:
+            self._handle(method)
+
+    def _handle(self, method):
+        started = monotonic()
+        trace = tracer.start("{0} {1}".format(method, self.path))
+
+        with tracer.span("route"):
+            url = urlparse.urlparse(self.path)
+            path = url.path
+            self.query = dict((key, values[-1]) for (key, values) in urlparse.parse_qs(url.query).items())
+            (handler, params, allowed) = self.router.match(method, path)
+            retry_after = self._rate_limit(handler)
+
+        with tracer.span("handler"):
+            if retry_after:
+                response = self._rate_limited(handler, retry_after)
+            elif handler is None:
+                response = self._not_allowed(allowed) if allowed else self._match_all(params)
+            else:
+                response = handler(self, params)
+
+        route = self.router.paths.get(handler, "unmatched")
+
+        # streaming handlers write their own response, how long they stayed open says nothing about latency
+        if response is None:
+            self._observe(route, method, 200)
+
+            if trace:
+                tracer.finish(trace, route=route, status=200)
+
+            return
+
+        (status, headers, result) = response
+
+        with tracer.span("write"):
+            self._send(status, headers, result)
+
+        self._observe(route, method, status, monotonic() - started)
+
+        if trace:
+            tracer.finish(trace, route=route, status=status)
+
+    def _observe(self, route, method, status, seconds=None):
+        requests_total.inc((route, method, str(status)))
+
+        if seconds is not None:
+            request_seconds.observe(seconds, (route, method))
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+    
+    def _index(self, params):
+        (body, etag, encoding) = index_page.select(self.headers.get("Accept-Encoding"))
+        headers = {
+            "Content-Type": index_page.content_type,
+            "Cache-Control": index_page.cache_control,
+            "Vary": "Accept-Encoding"
+        }
+
+        if encoding:
+            headers["Content-Encoding"] = encoding
+
+        return self._cached(200, headers, body, etag)
+
+    def _timer_status(self, params):
+        headers = {
+            "Content-Type": "application/json",
+            # may be kept, as long as it's revalidated, the ETag only changes with the timer
+            "Cache-Control": "no-cache"
+        }
+        
+        try:
+            with tracer.span("json"):
+                (body, etag) = timer.get_status_with_etag()
+
+            return self._cached(200, headers, body, etag)
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _timer_jitter(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        return (200, headers, dump_json(fire_jitter.snapshot()))
+
+    def _metrics(self, params):
+        headers = {
+            "Content-Type": registry.content_type
+        }
+
+        return (200, headers, registry.render())
+
+    def _timer_start(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        try:
+            duration = params["duration"]
+            result = timer.start(duration, self.query.get("fade"), self.query.get("target"))
+
+            return (200, headers, dump_json(result))
+        except ValueError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except InvalidTimerStateError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _timer_stop(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+        
+        try:
+            result = timer.stop()
+
+            return (200, headers, dump_json(result))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _timer_restart(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+        
+        try:
+            result = timer.restart()
+
+            return (200, headers, dump_json(result))
+        except InvalidTimerStateError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _timer_extend(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        try:
+            duration = params["duration"]
+            result = timer.extend(duration)
+
+            return (200, headers, dump_json(result))
+        except ValueError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except InvalidTimerStateError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _write_event(self, type, data):
+        self.wfile.write("event: {0}\ndata: {1}\n\n".format(type, json.dumps(data)).encode("utf8"))
+
+    def _timer_events(self, params):
+        # a stream holds its thread for as long as the client listens
+        if not getattr(self.server, "concurrent", False):
+            headers = {
+                "Content-Type": "application/json"
+            }
+
+            result = {
+                "error": "Event streams need the server running with --workers"
+            }
+
+            return (503, headers, dump_json(result))
+
+        # at least one worker is always left for everything else
+        if not self.server.streams.acquire(False):
+            headers = {
+                "Content-Type": "application/json",
+                "Retry-After": "1",
+                "Connection": "close"
+            }
+
+            result = {
+                "error": "Too many event streams, at most {0} with {1} workers".format(self.server.max_streams, self.server.pool.workers)
+            }
+
+            return (503, headers, dump_json(result))
+
+        try:
+            self._stream_events()
+        finally:
+            self.server.streams.release()
+
+    def _stream_events(self):
+        subscription = default_bus.subscribe()
+        heartbeat = getattr(self.server, "events_heartbeat", 0) or None
+        dropped = 0
+
+        self.close_connection = True
+
+        try:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            self._write_event("status", timer.get_status())
+
+            while True:
+                event = subscription.get(heartbeat)
+
+                if subscription.closed:
+                    break
+
+                if subscription.dropped != dropped:
+                    self._write_event("dropped", {"count": subscription.dropped - dropped})
+                    dropped = subscription.dropped
+
+                if event is None:
+                    self.wfile.write(b": heartbeat\n\n")
+                else:
+                    self._write_event(event.type, event.data)
+        except socket.error:
+            # the client went away, noticed on the next write
+            pass
+        finally:
+            subscription.close()
+
+    def _named_timer_call(self, function, *args):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        try:
+            result = function(*args)
+
+            return (200, headers, dump_json(result))
+        except (ValueError, InvalidTimerStateError) as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _named_timer_statuses(self, params):
+        return self._named_timer_call(timers.get_statuses)
+
+    def _named_timer_status(self, params):
+        headers = {
+            "Content-Type": "application/json",
+            "Cache-Control": "no-cache"
+        }
+
+        try:
+            with tracer.span("json"):
+                (body, etag) = timers.get_status_with_etag(params["name"])
+
+            return self._cached(200, headers, body, etag)
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _named_timer_start(self, params):
+        return self._named_timer_call(timers.start, params["name"], params["duration"], self.query.get("fade"), None, None, self.query.get("target"))
+
+    def _named_timer_stop(self, params):
+        return self._named_timer_call(timers.stop, params["name"])
+
+    def _named_timer_restart(self, params):
+        return self._named_timer_call(timers.restart, params["name"])
+
+    def _named_timer_extend(self, params):
+        return self._named_timer_call(timers.extend, params["name"], params["duration"])
+
+    def _read_json(self, limit=None):
+        limit = limit or self.max_body
+        length = xint(self.headers.get("Content-Length"), -1)
+
+        if length < 0 or length > limit:
+            # the body is left unread, what follows on the connection can't be trusted
+            self.keep_alive = False
+
+            raise ValueError("Expected a JSON body of at most {0} bytes".format(limit))
+
+        return json.loads(self.rfile.read(length).decode("utf8"))
+
+    def _timer_batch(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        try:
+            operations = self._read_json()
+
+            if not isinstance(operations, list):
+                raise ValueError("Expected a JSON array of operations")
+        except ValueError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+
+        return (200, headers, dump_json(timers.apply(operations, timer)))
+
+    def _schedule_call(self, function, *args):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        try:
+            result = function(*args)
+
+            return (200, headers, dump_json(result))
+        except ScheduleNotFoundError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (404, headers, dump_json(result))
+        except ValueError as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (400, headers, dump_json(result))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _schedules_list(self, params):
+        return self._schedule_call(schedules.list)
+
+    def _schedules_create(self, params):
+        return self._schedule_call(lambda: schedules.put(self._read_json()))
+
+    def _schedule_get(self, params):
+        return self._schedule_call(schedules.get, params["id"])
+
+    def _schedule_replace(self, params):
+        return self._schedule_call(lambda: schedules.put(self._read_json(), params["id"]))
+
+    def _schedule_delete(self, params):
+        return self._schedule_call(schedules.remove, params["id"])
+
+    def _targets(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        return (200, headers, dump_json(fleet.to_dict()))
+
+    def _target_pause(self, params):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        result = timers.apply([{"op": "pause", "target": params["target"]}])[0]
+
+        return (result.pop("status"), headers, dump_json(result))
+
+    def _debug_call(self, function):
+        headers = {
+            "Content-Type": "application/json"
+        }
+
+        # opt in, profiles write files and traces show every request's path
+        if not diagnostics_enabled:
+            return (404, headers, dump_json({"error": "Diagnostics are off, start with --diagnostics"}))
+
+        try:
+            return (200, headers, dump_json(function()))
+        except Exception as exp:
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (500, headers, dump_json(result))
+
+    def _debug_traces(self, params):
+        return self._debug_call(lambda: {
+            "enabled": tracer.enabled,
+            "traces": tracer.traces()
+        })
+
+    def _set_tracing(self, enabled):
+        tracer.enabled = enabled
+
+        return {
+            "enabled": enabled
+        }
+
+    def _debug_traces_start(self, params):
+        return self._debug_call(lambda: self._set_tracing(True))
+
+    def _debug_traces_stop(self, params):
+        return self._debug_call(lambda: self._set_tracing(False))
+
+    def _debug_traces_clear(self, params):
+        return self._debug_call(lambda: tracer.clear() or {})
+
+    def _debug_profile(self, params):
+        return self._debug_call(lambda: {
+            "active": profiler.active,
+            "path": profiler.path,
+            "sample": profiler.sample
+        })
+
+    def _debug_profile_start(self, params):
+        return self._debug_call(lambda: {
+            "active": profiler.start() or profiler.active
+        })
+
+    def _debug_profile_stop(self, params):
+        return self._debug_call(lambda: profiler.stop() or {"active": False})
+
+    def _rate_limited(self, handler, retry_after):
+        budget = "write" if handler in self.router.mutating else "read"
+        rate_limited.inc((budget,))
+        headers = {
+            "Content-Type": "application/json",
+            "Retry-After": str(int(math.ceil(retry_after)))
+        }
+
+        result = {
+            "error": "Too many {0} requests, retry in {1:.1f}s".format(budget, retry_after)
+        }
+
+        return (429, headers, dump_json(result))
+
+    def _not_allowed(self, allowed):
+        headers = {
+            "Content-Type": "text/plain",
+            "Allow": ", ".join(allowed)
+        }
+
+        return (405, headers, "Method not allowed")
+
+    def _match_all(self, params):
+        headers = {
+            "Content-Type": "text/plain"
+        }
+
+        return (404, headers, "Not found")
+
+TimerRequestHandler.router.add("/", TimerRequestHandler._index)
+TimerRequestHandler.router.add("", TimerRequestHandler._index)
+TimerRequestHandler.router.add("/metrics", TimerRequestHandler._metrics)
+TimerRequestHandler.router.add("/debug/traces", TimerRequestHandler._debug_traces)
+TimerRequestHandler.router.add("/debug/traces", TimerRequestHandler._debug_traces_clear, ("DELETE",))
+TimerRequestHandler.router.add("/debug/traces/start", TimerRequestHandler._debug_traces_start, ("POST",))
+TimerRequestHandler.router.add("/debug/traces/stop", TimerRequestHandler._debug_traces_stop, ("POST",))
+TimerRequestHandler.router.add("/debug/profile", TimerRequestHandler._debug_profile)
+TimerRequestHandler.router.add("/debug/profile/start", TimerRequestHandler._debug_profile_start, ("POST",))
+TimerRequestHandler.router.add("/debug/profile/stop", TimerRequestHandler._debug_profile_stop, ("POST",))
+TimerRequestHandler.router.add("/timer", TimerRequestHandler._timer_status)
+TimerRequestHandler.router.add("/timer/events", TimerRequestHandler._timer_events)
+TimerRequestHandler.router.add("/timer/jitter", TimerRequestHandler._timer_jitter)
+TimerRequestHandler.router.add("/timer/batch", TimerRequestHandler._timer_batch, ("POST",))
+TimerRequestHandler.router.add("/timer/stop", TimerRequestHandler._timer_stop, mutating=True)
+TimerRequestHandler.router.add("/timer/restart", TimerRequestHandler._timer_restart, mutating=True)
+TimerRequestHandler.router.add("/timers", TimerRequestHandler._named_timer_statuses)
+TimerRequestHandler.router.add("/targets", TimerRequestHandler._targets)
+TimerRequestHandler.router.add("/targets/<target>/pause", TimerRequestHandler._target_pause, ("POST",))
+TimerRequestHandler.router.add("/schedules", TimerRequestHandler._schedules_list)
+TimerRequestHandler.router.add("/schedules", TimerRequestHandler._schedules_create, ("POST",))
+TimerRequestHandler.router.add("/schedules/<id>", TimerRequestHandler._schedule_get)
+TimerRequestHandler.router.add("/schedules/<id>", TimerRequestHandler._schedule_replace, ("PUT",))
+TimerRequestHandler.router.add("/schedules/<id>", TimerRequestHandler._schedule_delete, ("DELETE",))
+TimerRequestHandler.router.add("/timer/<duration>/start", TimerRequestHandler._timer_start, mutating=True)
+TimerRequestHandler.router.add("/timer/<duration>/extend", TimerRequestHandler._timer_extend, mutating=True)
+TimerRequestHandler.router.add("/timer/<name>", TimerRequestHandler._named_timer_status)
+TimerRequestHandler.router.add("/timer/<name>/<duration>/start", TimerRequestHandler._named_timer_start, mutating=True)
+TimerRequestHandler.router.add("/timer/<name>/stop", TimerRequestHandler._named_timer_stop, mutating=True)
+TimerRequestHandler.router.add("/timer/<name>/restart", TimerRequestHandler._named_timer_restart, mutating=True)
+TimerRequestHandler.router.add("/timer/<name>/<duration>/extend", TimerRequestHandler._named_timer_extend, mutating=True)
+TimerRequestHandler.router.compile()
+
+class ForwardedRequestHandler(TimerRequestHandler):
+    """
+    Serves what worker processes forward to the main process. They've logged the request already and count it in the
+    metrics they publish, the rate limits are applied here, for all of them, to the client they forwarded it for.
+    """
+    def log_message(self, format, *args):
+        Log.debug(format % args, client=self._client())
+
+    def _client(self):
+        # a bad request is logged before there are headers
+        headers = getattr(self, "headers", None)
+
+        return (headers and headers.get("X-Forwarded-For")) or self.client_address[0]
+
+    def _observe(self, route, method, status, seconds=None):
+        # the worker it came through counts it, see MetricsMirror
+        pass
+
+class WorkerRequestHandler(TimerRequestHandler):
+    """
+    Serves a worker process with --processes. /timer comes from the state the main process mirrors and the index page
+    is the same everywhere, everything else is forwarded to the main process, the only one with timers.
+    """
+    # built below the class, see build_worker_router
+    router = None
+    # answered right here, by name, the rest of TimerRequestHandler's routes are forwarded
+    local = ("_index", "_timer_status")
+    # streams are relayed as they come, on a connection of their own
+    streams = ("_timer_events",)
+    hop_by_hop = frozenset(["connection", "keep-alive", "proxy-connection", "te", "trailer", "transfer-encoding", "upgrade", "content-length"])
+    # set by the worker, the main process rate limits by it, one sent by the client in any case mustn't get through
+    forwarded = frozenset(["x-forwarded-for"])
+    # send_response writes our own
+    generated = frozenset(["date", "server"])
+
+    def _timer_status(self, params):
+        headers = {
+            "Content-Type": "application/json",
+            "Cache-Control": "no-cache"
+        }
+
+        with tracer.span("json"):
+            (state, player_state) = state_mirror.read()
+            # the deadline is on the scheduler's monotonic clock, the same in every process
+            body = state.to_json(default_scheduler.time(), player_state)
+
+        return self._cached(200, headers, body, state.etag(player_state))
+
+    def _forward(self, stream=False):
+        length = xint(self.headers.get("Content-Length"))
+
+        if length > self.max_body:
+            # the body is left unread, what follows on the connection can't be trusted
+            self.keep_alive = False
+
+            result = {
+                "error": "Expected a body of at most {0} bytes".format(self.max_body)
+            }
+
+            return (413, {"Content-Type": "application/json"}, dump_json(result))
+
+        body = self.rfile.read(length) if length > 0 else None
+        headers = dict((name, value) for (name, value) in self.headers.items() if name.lower() not in self.hop_by_hop | self.forwarded)
+        headers["X-Forwarded-For"] = self.client_address[0]
+
+        try:
+            with tracer.span("forward"):
+                if stream:
+                    response = forwarder.open(self.command, self.path, body, headers)
+                else:
+                    response = forwarder.request(self.command, self.path, body, headers)
+        except ForwardingError as exp:
+            Log.error("Can't reach the main process", error=exp)
+
+            result = {
+                "error": xstr(exp)
+            }
+
+            return (502, {"Content-Type": "application/json"}, dump_json(result))
+
+        headers = dict((name, value) for (name, value) in response.getheaders() if name.lower() not in self.hop_by_hop | self.generated)
+
+        if stream and response.getheader("Content-Length") is None:
+            return self._relay(response, headers)
+
+        body = response.read()
+
+        if stream:
+            response.close()
+
+        return (response.status, headers, body)
+
+    def _relay(self, response, headers):
+        self.close_connection = True
+
+        try:
+            self.send_response(response.status)
+
+            for header in headers.items():
+                self.send_header(header[0], header[1])
+
+            self.send_header("Connection", "close")
+            self.end_headers()
+
+            # server-sent events are lines, each goes out as soon as it's in
+            while True:
+                line = response.fp.readline()
+
+                if not line:
+                    break
+
+                self.wfile.write(line)
+        except socket.error:
+            # the client went away, or the main process did
+            pass
+        finally:
+            response.close()
+
+def forwarding(name):
+    def forward(self, params):
+        return self._forward(name in WorkerRequestHandler.streams)
+
+    forward.__name__ = name
+
+    return forward
+
+def build_worker_router(local=WorkerRequestHandler.local):
+    """
+    The workers' routes, those of handlers named in `local` answered right there and the rest forwarded
+    """
+    router = Router()
+    forwards = {}
+
+    for (path, method, handler) in TimerRequestHandler.router.routes():
+        name = handler.__name__
+
+        if name in local:
+            function = getattr(WorkerRequestHandler, name)
+        else:
+            # one function per forwarded handler, its metrics label and budget stay its own
+            function = forwards.setdefault(name, forwarding(name))
+
+        router.add(path, function, (method,), handler in TimerRequestHandler.router.mutating)
+
+    router.compile()
+    WorkerRequestHandler.router = router
+
+build_worker_router()
+
+class PooledHTTPServer(HTTPServer):
+    """
+    Hands accepted connections to a bounded worker pool, a saturated pool answers 503 straight from the accept loop.
+    With `on_park` set a keep-alive connection gives its worker back once it's idle, it's in `parked` for the serving
+    loop to watch, and handed to a worker again with `resume` when its next request comes in.
+    """
+    overloaded_response = (
+        "HTTP/1.0 503 Service Unavailable\r\n"
+        "Content-Type: application/json\r\n"
+        "Content-Length: 28\r\n"
+        "Retry-After: 1\r\n"
+        "Connection: close\r\n"
+        "\r\n"
+        '{"error": "Server too busy"}'
+    ).encode("ascii")
+
+    concurrent = True
+    keep_alive = True
+
+    def __init__(self, server_address, handler_class, workers, queue_size, keep_alive_timeout=5.0, keep_alive_requests=100, events_heartbeat=15.0, bind_and_activate=True, pool=None, streams=None):
+        HTTPServer.__init__(self, server_address, handler_class, bind_and_activate)
+        # servers listening on several sockets share one, and the event streams' slots in it
+        self.pool = pool or WorkerPool(workers, queue_size)
+        self.max_streams = max(0, self.pool.workers - 1)
+        self.streams = streams or threading.BoundedSemaphore(self.max_streams)
+        self.keep_alive_timeout = keep_alive_timeout
+        self.keep_alive_requests = keep_alive_requests
+        self.events_heartbeat = events_heartbeat
+        # accepted and not closed yet, queued and parked ones too
+        self.connections = 0
+        self._connections_lock = threading.Lock()
+        self.parked = collections.deque()
+        self.on_park = None
+
+    def _count_connection(self, delta):
+        with self._connections_lock:
+            self.connections += delta
+
+    def finish_request(self, request, client_address):
+        # the handler, to park its connection
+        return self.RequestHandlerClass(request, client_address, self)
+
+    def _process_request_worker(self, request, client_address, handler=None):
+        parked = False
+
+        try:
+            if handler is None:
+                handler = self.finish_request(request, client_address)
+            else:
+                handler.resume()
+
+            parked = getattr(handler, "parked", False)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            if parked:
+                self.park(handler)
+            else:
+                self.shutdown_request(request)
+                self._count_connection(-1)
+
+    def _submit(self, request, client_address, handler=None):
+        try:
+            self.pool.submit(self._process_request_worker, request, client_address, handler)
+        except PoolFullError:
+            Log.warning("Rejecting request, all workers are busy", client=client_address[0])
+
+            try:
+                request.settimeout(1)
+                request.sendall(self.overloaded_response)
+            except socket.error:
+                pass
+
+            if handler is not None:
+                handler.parked = False
+                handler.finish()
+
+            self.shutdown_request(request)
+            self._count_connection(-1)
+
+    def process_request(self, request, client_address):
+        self._count_connection(1)
+        self._submit(request, client_address)
+
+    def park(self, handler):
+        self.parked.append(handler)
+        self.on_park()
+
+    def resume(self, handler):
+        self._submit(handler.request, handler.client_address, handler)
+
+    def close_parked(self, handler):
+        handler.parked = False
+        handler.finish()
+        self.shutdown_request(handler.request)
+        self._count_connection(-1)
+
+    def server_close(self):
+        HTTPServer.server_close(self)
+
+        # lets event streams return their workers
+        default_bus.close_all()
+
+        # parked once the serving loop was done with them
+        while self.parked:
+            self.close_parked(self.parked.popleft())
+
+        # not there yet when binding failed
+        if getattr(self, "pool", None):
+            self.pool.shutdown(wait=False)
+
+class UnixServerMixin:
+    """
+    Listens on a unix domain socket, at the path in `server_address`. Old-style like socketserver's own mixins, on
+    python 2 HTTPServer is one and an object mixin would leave the servers with object.__init__.
+    """
+    address_family = getattr(socket, "AF_UNIX", None)
+
+    def server_bind(self):
+        remove_stale_socket(self.server_address)
+
+        # HTTPServer.server_bind expects a host and port
+        socketserver.TCPServer.server_bind(self)
+
+        self.server_name = self.server_address
+        self.server_port = 0
+        self.bound_path = self.server_address
+
+    def get_request(self):
+        (request, _) = self.socket.accept()
+
+        # unix clients have no address, handlers and logs expect a host
+        return (request, ("unix", 0))
+
+    def server_close(self):
+        # no super for old-style classes
+        HTTPServer.server_close(self)
+        self._remove_socket()
+
+    def _remove_socket(self):
+        # only the one we made, a socket systemd passed is systemd's to remove
+        path = getattr(self, "bound_path", None)
+
+        if path and os.path.exists(path):
+            os.unlink(path)
+
+def remove_stale_socket(path):
+    if not os.path.exists(path) or not stat.S_ISSOCK(os.stat(path).st_mode):
+        return
+
+    probe = socket.socket(UnixServerMixin.address_family, socket.SOCK_STREAM)
+
+    try:
+        probe.connect(path)
+    except socket.error:
+        # left behind by a run that didn't get to clean up
+        os.unlink(path)
+
+        return
+    finally:
+        probe.close()
+
+    raise socket.error(errno.EADDRINUSE, "Another server is listening on {0}".format(path))
+
+def bind_unix_socket(path, mode=0o660, group=None, backlog=socketserver.TCPServer.request_queue_size):
+    """
+    A unix domain socket listening at `path`, bound with `mode` permissions so there's no moment anyone else could
+    connect, and `group` as its group
+    """
+    if UnixServerMixin.address_family is None:
+        raise ValueError("Unix domain sockets aren't supported on this platform")
+
+    remove_stale_socket(path)
+    sock = socket.socket(UnixServerMixin.address_family, socket.SOCK_STREAM)
+    umask = os.umask(0o777 & ~mode)
+
+    try:
+        sock.bind(path)
+    except Exception:
+        sock.close()
+        raise
+    finally:
+        os.umask(umask)
+
+    try:
+        if group:
+            os.chown(path, -1, grp.getgrnam(group).gr_gid)
+
+        sock.listen(backlog)
+    except Exception:
+        sock.close()
+        os.unlink(path)
+        raise
+
+    return sock
+
+class UnixHTTPServer(UnixServerMixin, HTTPServer): pass
+
+class PooledUnixHTTPServer(UnixServerMixin, PooledHTTPServer):
+    def server_close(self):
+        PooledHTTPServer.server_close(self)
+        self._remove_socket()
+
+# app
+class App(object):
+    """
+    Serves `host`:`port`, or the already listening `sockets` instead, like those systemd passes with socket
+    activation. With an `idle_timeout` the server stops after that many seconds without requests, while no timer
+    or schedule is pending.
+
+    A `unix_socket` path is served too, with `unix_socket_mode` permissions and `unix_socket_group` as its group,
+    `tcp` False leaves it the only listener. All listeners go through the same loop and, with `workers`, the same
+    pool, and requests on them are served by `handler_class`.
+    """
+    def __init__(self, host, port, workers=0, queue_size=32, keep_alive_timeout=5.0, keep_alive_requests=100, events_heartbeat=15.0, idle_timeout=0, sockets=None, unix_socket=None, unix_socket_mode=0o660, unix_socket_group=None, tcp=True, handler_class=TimerRequestHandler):
+        self.host = host
+        self.port = port
+        self.workers = workers
+        self.queue_size = queue_size
+        self.keep_alive_timeout = keep_alive_timeout
+        self.keep_alive_requests = keep_alive_requests
+        self.events_heartbeat = events_heartbeat
+        self.idle_timeout = idle_timeout
+        self.sockets = sockets or []
+        self.unix_socket = unix_socket
+        self.unix_socket_mode = unix_socket_mode
+        self.unix_socket_group = unix_socket_group
+        self.tcp = tcp
+        self.handler_class = handler_class
+        self.servers = []
+        self.stopped = 0
+        self._wakeup = None
+        self._last_active = None
+        self._toggle_profiler = False
+        # idle keep-alive connections in the selector, with the time they're closed at, oldest first
+        self._parked = collections.deque()
+
+    def _create_server(self, sock=None, path=None, shared=None):
+        unix = path is not None or (sock is not None and sock.family == UnixServerMixin.address_family)
+        address = path if path is not None else (self.host, self.port)
+
+        if self.workers > 0:
+            server_class = PooledUnixHTTPServer if unix else PooledHTTPServer
+            server = server_class(address, self.handler_class, self.workers, self.queue_size, self.keep_alive_timeout, self.keep_alive_requests, self.events_heartbeat, sock is None, getattr(shared, "pool", None), getattr(shared, "streams", None))
+        else:
+            server = (UnixHTTPServer if unix else HTTPServer)(address, self.handler_class, sock is None)
+
+        if sock is not None:
+            # already bound and listening, and skipping server_bind skips its reverse lookup of our own name too
+            server.socket.close()
+            server.socket = sock
+            server.server_address = sock.getsockname()
+            server.server_name = sock.getsockname() if unix else self.host
+            server.server_port = 0 if unix else self.port
+
+        return server
+
+    def _create_unix_server(self, shared=None):
+        sock = bind_unix_socket(self.unix_socket, self.unix_socket_mode, self.unix_socket_group)
+
+        try:
+            server = self._create_server(sock, shared=shared)
+        except Exception:
+            sock.close()
+            os.unlink(self.unix_socket)
+            raise
+
+        # ours to remove when it's closed, unlike one systemd passed
+        server.bound_path = self.unix_socket
+
+        return server
+
+    def _create_servers(self):
+        servers = []
+
+        if self.sockets:
+            for sock in self.sockets:
+                servers.append(self._create_server(sock, shared=self._shared(servers)))
+        elif self.tcp:
+            servers = [self._create_server()]
+
+        if self.unix_socket:
+            try:
+                servers.append(self._create_unix_server(self._shared(servers)))
+            except Exception:
+                for server in servers:
+                    server.server_close()
+
+                raise
+
+        if not servers:
+            raise ValueError("Nothing to listen on, TCP is off and there's no unix socket")
+
+        return servers
+
+    def _shared(self, servers):
+        """
+        The server whose pool and stream slots the next one shares, None for the first
+        """
+        return servers[0] if servers else None
+
+    def _signal_handler(self, signal_number, frame):
+        Log.info("Received signal, stopping server...", signal=signal_number)
+        self.stopped = 1
+
+    def _profile_signal_handler(self, signal_number, frame):
+        # stopping waits for profiled requests, which may be this very thread's, the serving loop does it instead
+        self._toggle_profiler = True
+
+    def _register_signals(self):
+        # signals can only be handled on the main thread, embedders running us elsewhere use stop()
+        if threading.current_thread().name != "MainThread":
+            return
+
+        signal.signal(signal.SIGTERM, self._signal_handler)
+        signal.signal(signal.SIGINT, self._signal_handler)
+
+        if diagnostics_enabled and hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, self._profile_signal_handler)
+
+        # a signal arriving while we're blocked in select writes a byte to the socket pair and wakes us up
+        signal.set_wakeup_fd(self._wakeup[1].fileno())
+
+    def _unregister_signals(self):
+        if threading.current_thread().name != "MainThread":
+            return
+
+        signal.set_wakeup_fd(-1)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+
+        if diagnostics_enabled and hasattr(signal, "SIGUSR2"):
+            signal.signal(signal.SIGUSR2, signal.SIG_DFL)
+
+    def _drain_wakeup(self):
+        try:
+            while self._wakeup[0].recv(512):
+                pass
+        except socket.error as exp:
+            if exp.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                raise
+
+    def _wake(self):
+        wakeup = self._wakeup
+
+        if wakeup:
+            try:
+                wakeup[1].send(b"\0")
+            except socket.error:
+                # the loop stopped and closed it already, or it's full and the loop wakes up anyway
+                pass
+
+    def stop(self):
+        self.stopped = 1
+        self._wake()
+
+    def _is_busy(self):
+        if timer.status == TimerStatus.started() or len(timers) or len(schedules):
+            return True
+
+        # the watcher arms and cancels timers on its own, it needs us around
+        if player_watcher:
+            return True
+
+        # keep-alive connections, parked or not, and event streams
+        return any(getattr(server, "connections", 0) for server in self.servers)
+
+    def _idle_wait(self):
+        """
+        Seconds select may block before it's time to check for idleness, None for as long as it takes
+        """
+        if not self.idle_timeout:
+            return None
+
+        return max(self._last_active + self.idle_timeout - monotonic(), 0)
+
+    def _check_idle(self):
+        if not self.idle_timeout or monotonic() - self._last_active < self.idle_timeout:
+            return
+
+        if self._is_busy():
+            # look again a whole timeout later, rather than spinning until the timers are done
+            self._last_active = monotonic()
+
+            return
+
+        Log.info("Idle, stopping server...", idle_timeout=self.idle_timeout)
+        self.stopped = 1
+
+    def _wait(self):
+        wait = self._idle_wait()
+
+        if self._parked:
+            expires = max(self._parked[0][0] - monotonic(), 0)
+            wait = expires if wait is None else min(wait, expires)
+
+        return wait
+
+    def _park(self, selector):
+        for server in self.servers:
+            parked = getattr(server, "parked", None)
+
+            while parked:
+                handler = parked.popleft()
+                handler.parked_until = monotonic() + server.keep_alive_timeout
+                selector.register(handler.connection, selectors.EVENT_READ, handler)
+                self._parked.append((handler.parked_until, handler))
+
+    def _resume(self, selector, handler):
+        selector.unregister(handler.connection)
+        handler.parked_until = None
+        handler.server.resume(handler)
+
+    def _expire_parked(self, selector):
+        now = monotonic()
+
+        while self._parked and self._parked[0][0] <= now:
+            (parked_until, handler) = self._parked.popleft()
+
+            # resumed since, and maybe parked again until later
+            if handler.parked_until != parked_until:
+                continue
+
+            selector.unregister(handler.connection)
+            handler.parked_until = None
+            handler.server.close_parked(handler)
+
+    def _serve(self, selector):
+        self._last_active = monotonic()
+
+        while not self.stopped:
+            for (key, _) in selector.select(self._wait()):
+                if key.data is None:
+                    self._drain_wakeup()
+                elif isinstance(key.data, BaseHTTPRequestHandler):
+                    self._last_active = monotonic()
+                    self._resume(selector, key.data)
+                else:
+                    self._last_active = monotonic()
+                    key.data._handle_request_noblock()
+
+            self._park(selector)
+            self._expire_parked(selector)
+            self._check_idle()
+
+            if self._toggle_profiler:
+                self._toggle_profiler = False
+                thread = threading.Thread(target=toggle_profiler, name="mpd-auto-stop-profiler")
+                thread.daemon = True
+                thread.start()
+
+    def start(self):
+        self.servers = self._create_servers()
+        self.server = self.servers[0]
+
+        # a socket pair rather than os.pipe, so select and set_wakeup_fd work on windows too
+        self._wakeup = socket.socketpair()
+
+        for sock in self._wakeup:
+            sock.setblocking(False)
+
+        self._register_signals()
+
+        selector = selectors.DefaultSelector()
+        selector.register(self._wakeup[0], selectors.EVENT_READ, None)
+
+        for server in self.servers:
+            selector.register(server, selectors.EVENT_READ, server)
+
+            if isinstance(server, PooledHTTPServer):
+                server.on_park = self._wake
+
+        if self.sockets:
+            Log.info("Starting server on already listening sockets, use <Ctrl-C> to stop", addresses=",".join(xstr(server.server_address) for server in self.servers))
+        elif self.tcp:
+            Log.info("Starting server @ {0}:{1}, use <Ctrl-C> to stop", self.host, self.port)
+
+        if self.unix_socket:
+            Log.info("Listening on unix socket {0}", self.unix_socket, mode=oct(self.unix_socket_mode), group=self.unix_socket_group)
+
+        try:
+            self._serve(selector)
+        finally:
+            self._unregister_signals()
+            selector.close()
+
+            while self._parked:
+                (parked_until, handler) = self._parked.popleft()
+
+                if handler.parked_until == parked_until:
+                    handler.server.close_parked(handler)
+
+            for server in self.servers:
+                server.server_close()
+
+            for sock in self._wakeup:
+                sock.close()
+
+            self._wakeup = None
+
+            Log.info("Stopped...")
+
+            # whatever is still queued goes out before the process does
+            logger.flush()
+
+# arguments
+def parse_mode(text):
+    try:
+        mode = int(text, 8)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid octal mode: {0}".format(text))
+
+    if not 0 <= mode <= 0o777:
+        raise argparse.ArgumentTypeError("invalid octal mode: {0}".format(text))
+
+    return mode
+
+def parse_args(args):
+    parser = argparse.ArgumentParser(description="MPD Auto Stop - auto stopping Music Player Daemon, by setting up timers")
+    parser.add_argument("-a", "--host", help="Host to run the server on [default: 0.0.0.0]", default="0.0.0.0")
+    parser.add_argument("-p", "--port", help="Port to the server should listen on [default: 9090]", default=9090, type=int)
+    parser.add_argument("-mh", "--mpd-host", help="Host where mpd runs [default: localhost]", default="localhost")
+    parser.add_argument("-mp", "--mpd-port", help="Port where mpd listens on [default: 6600]", default=6600, type=int)
+    parser.add_argument("-t", "--target", help="A named mpd timers can target, as name=host[:port], repeat for a fleet [default: none]", action="append", default=[])
+    parser.add_argument("-g", "--group", help="A group of targets, as group=name,name, repeat for more groups [default: none]", action="append", default=[])
+    parser.add_argument("--fleet-file", help="Read targets and their groups from this JSON file [default: none]", default=None)
+    parser.add_argument("--timer-workers", help="Threads firing timers, schedules and fade steps, so a slow mpd only holds up its own timer [default: 8]", default=8, type=int)
+    parser.add_argument("--fleet-workers", help="Threads sending commands to several targets at once [default: 8]", default=8, type=int)
+    parser.add_argument("-w", "--workers", help="Threads serving requests concurrently, 0 serves one request at a time [default: 0]", default=0, type=int)
+    parser.add_argument("--processes", help="Worker processes accepting connections on --host and --port through SO_REUSEPORT, timers stay in the main process [default: 0, serve from one process]", default=0, type=int)
+    parser.add_argument("-q", "--queue-size", help="Requests waiting for a worker before new ones get a 503 [default: 32]", default=32, type=int)
+    parser.add_argument("--keep-alive-timeout", help="Seconds an idle keep-alive connection is held open, needs --workers [default: 5]", default=5.0, type=float)
+    parser.add_argument("--keep-alive-requests", help="Requests served over one keep-alive connection before it's closed [default: 100]", default=100, type=int)
+    parser.add_argument("--state-file", help="Journal pending timers to this file and re-arm them on startup [default: none]", default=None)
+    parser.add_argument("--state-sync-interval", help="Seconds between fsyncs of the state file [default: 1]", default=1.0, type=float)
+    parser.add_argument("--schedules-file", help="Keep schedules in this file, loaded on startup [default: none, kept in memory]", default=None)
+    parser.add_argument("--watch-player", help="Follow the player state over an mpd idle connection, shown in /timer", action="store_true")
+    parser.add_argument("--auto-cancel", help="Cancel timers when playback is paused or stopped, implies --watch-player", action="store_true")
+    parser.add_argument("--auto-arm", help="Start a timer of this duration when playback starts, implies --watch-player [default: none]", default=None)
+    parser.add_argument("--log-level", help="Least important log records written [default: info]", default="info", choices=[name.lower() for (_, name) in sorted(LEVEL_NAMES.items())])
+    parser.add_argument("--events-heartbeat", help="Seconds between heartbeats on /timer/events streams, 0 disables them [default: 15]", default=15.0, type=float)
+    parser.add_argument("--unix-socket", help="Also listen on a unix domain socket at this path [default: none]", default=None)
+    parser.add_argument("--unix-socket-mode", help="Permissions of the unix socket, in octal [default: 660]", default=0o660, type=parse_mode)
+    parser.add_argument("--unix-socket-group", help="Group owning the unix socket [default: the user's]", default=None)
+    parser.add_argument("--no-tcp", help="Only listen on the unix socket, not on --host and --port", action="store_true")
+    parser.add_argument("--diagnostics", help="Trace requests, kept at /debug/traces, and allow profiling them with /debug/profile or SIGUSR2", action="store_true")
+    parser.add_argument("--trace-buffer", help="Most recent request traces kept, with --diagnostics [default: 256]", default=256, type=int)
+    parser.add_argument("--profile-file", help="Where profiling stats are written, for pstats or snakeviz [default: mpd-auto-stop.prof in the temp directory]", default=None)
+    parser.add_argument("--profile-sample", help="Profile one in this many requests [default: 1, every one]", default=1, type=int)
+    parser.add_argument("--rate-limit-read", help="Read requests a second each client may make, 0 doesn't limit them [default: 0]", default=0.0, type=float)
+    parser.add_argument("--rate-limit-read-burst", help="Read requests a client may make at once before --rate-limit-read applies [default: 20]", default=20, type=int)
+    parser.add_argument("--rate-limit-write", help="Requests a second that start, stop or change timers each client may make, 0 doesn't limit them [default: 0]", default=0.0, type=float)
+    parser.add_argument("--rate-limit-write-burst", help="Requests changing timers a client may make at once before --rate-limit-write applies [default: 5]", default=5, type=int)
+    parser.add_argument("--rate-limit-clients", help="Clients whose request rate is tracked, the least recently seen is forgotten first [default: 1024]", default=1024, type=int)
+    parser.add_argument("--idle-exit", help="Exit after this many minutes without requests while no timer or schedule is pending, meant for systemd socket activation [default: 0, never]", default=0.0, type=float)
+
+    args = parser.parse_args(args)
+
+    if args.no_tcp and not args.unix_socket:
+        parser.error("--no-tcp needs --unix-socket")
+
+    if args.processes < 0:
+        parser.error("--processes can't be negative")
+
+    if args.timer_workers < 0:
+        parser.error("--timer-workers can't be negative")
+
+    if args.processes and args.idle_exit:
+        parser.error("--idle-exit can't be used with --processes")
+
+    return args
+
+# recovery
+def recover(journal):
+    """
+    Opens the journal and re-arms the timers it has pending, before any request can touch them
+    """
+    started = time.time()
+    pending = journal.open()
+
+    timer.journal = timers.journal = journal
+
+    for (name, record) in pending.items():
+        remaining_time = record["deadline"] - time.time()
+
+        try:
+            if name is None:
+                timer.resume(remaining_time, record["duration"], record.get("fade", 0), record.get("target"))
+            else:
+                timers.resume(name, remaining_time, record["duration"], record.get("fade", 0), record.get("target"))
+        except ValueError as exp:
+            # its target was taken out of the fleet since
+            Log.warning("Can't recover timer", timer=name, error=exp)
+
+    Log.info("Recovered timers", count=len(pending), path=journal.path, seconds=round(time.time() - started, 3))
+
+def toggle_profiler():
+    result = profiler.toggle()
+
+    if result is None:
+        Log.info("Profiling requests", sample=profiler.sample)
+    else:
+        Log.info("Stopped profiling, stats written", path=result["path"], requests=result["requests"])
+
+def configure_fleet(args):
+    fleet.workers = args.fleet_workers
+
+    if args.fleet_file:
+        fleet.load(args.fleet_file)
+
+    for text in args.target:
+        fleet.add(parse_target(text))
+
+    for text in args.group:
+        fleet.group(*parse_group(text))
+
+    if len(fleet):
+        Log.info("Managing mpd targets", count=len(fleet))
+
+def configure_rate_limits(args):
+    for (limiter, rate, burst) in ((read_limiter, args.rate_limit_read, args.rate_limit_read_burst), (write_limiter, args.rate_limit_write, args.rate_limit_write_burst)):
+        limiter.rate = max(rate, 0.0)
+        limiter.burst = max(burst, 1)
+        limiter.max_clients = max(args.rate_limit_clients, 1)
+
+    if read_limiter.rate or write_limiter.rate:
+        Log.info("Rate limiting requests", read=read_limiter.rate, write=write_limiter.rate, clients=args.rate_limit_clients)
+
+# worker processes
+def serve_worker(args, index, path, sockets, parent_fd):
+    """
+    What worker process `index` forked by start_processes runs, until it's stopped or the main process is gone
+    """
+    global forwarder
+
+    logger.after_fork()
+
+    # the main process limits requests, for all the workers at once, a read limit needs /timer to go by it too
+    if args.rate_limit_read > 0:
+        build_worker_router(local=())
+
+    forwarder = Forwarder(path)
+    app = App(args.host, args.port, args.workers, args.queue_size, args.keep_alive_timeout, args.keep_alive_requests, args.events_heartbeat, sockets=sockets, handler_class=WorkerRequestHandler)
+    watch_parent(parent_fd, app.stop)
+
+    stopped = threading.Event()
+    publisher = threading.Thread(target=metrics_mirror.publish, args=(index, stopped), name="mpd-auto-stop-metrics")
+    publisher.daemon = True
+    publisher.start()
+
+    Log.info("Worker process started", pid=os.getpid())
+
+    try:
+        app.start()
+    finally:
+        # what this worker served last still makes it to /metrics
+        stopped.set()
+        publisher.join(5)
+
+def start_processes(args, sockets):
+    """
+    Forks the --processes workers, before anything starts a thread. They share the sockets systemd passed and
+    the unix socket, and each gets a SO_REUSEPORT socket of its own on --host and --port otherwise. Returns them
+    and the socket they forward to, ours to serve.
+    """
+    global state_mirror, metrics_mirror
+
+    directory = tempfile.mkdtemp(prefix="mpd-auto-stop-")
+    path = os.path.join(directory, "main.sock")
+    internal = bind_unix_socket(path, 0o600, backlog=128)
+    shared = list(sockets)
+    own = []
+
+    if args.unix_socket:
+        shared.append(bind_unix_socket(args.unix_socket, args.unix_socket_mode, args.unix_socket_group))
+
+    if not sockets and not args.no_tcp:
+        own = [reuseport_socket(args.host, args.port) for _ in range(args.processes)]
+
+    state_mirror = timer.mirror = StateMirror(SharedRecord())
+    metrics_mirror = MetricsMirror([SharedRecord(1 << 18) for _ in range(args.processes)])
+    registry.add_source(metrics_mirror.collect)
+
+    def worker(index, parent_fd):
+        internal.close()
+
+        # a socket left open here would keep another worker's connections queued after that worker is gone
+        for (other, sock) in enumerate(own):
+            if other != index:
+                sock.close()
+
+        return serve_worker(args, index, path, shared + own[index:index + 1], parent_fd)
+
+    def exited(index, pid, status):
+        Log.warning("Worker process exited", worker=index, pid=pid, status=status, remaining=len(processes))
+
+    processes = WorkerProcesses(args.processes, worker, exited)
+    processes.remove_on_stop = [directory] + ([args.unix_socket] if args.unix_socket else [])
+    processes.start()
+
+    for sock in shared + own:
+        sock.close()
+
+    Log.info("Started worker processes", count=args.processes, pids=",".join(str(pid) for pid in sorted(processes.pids)))
+
+    return (processes, internal)
+
+# main
+def main():
+    args = parse_args(sys.argv[1:])
+
+    logger.level = dict((name.lower(), level) for (level, name) in LEVEL_NAMES.items())[args.log_level]
+
+    timer.mpd_host = timers.mpd_host = args.mpd_host
+    timer.mpd_port = timers.mpd_port = args.mpd_port
+    default_scheduler.workers = args.timer_workers
+
+    # with socket activation systemd listens for us, --host and --port are left to the .socket unit
+    sockets = listen_sockets()
+    processes = None
+
+    if args.processes:
+        (processes, internal) = start_processes(args, sockets)
+
+    configure_rate_limits(args)
+    configure_fleet(args)
+
+    global player_watcher, diagnostics_enabled
+
+    if args.diagnostics:
+        diagnostics_enabled = tracer.enabled = True
+        tracer.resize(args.trace_buffer)
+        profiler.sample = max(args.profile_sample, 1)
+
+        if args.profile_file:
+            profiler.path = args.profile_file
+
+    if args.watch_player or args.auto_cancel or args.auto_arm:
+        player_watcher = PlayerWatcher(args.mpd_host, args.mpd_port)
+        player_watcher.add_listener(PlayerPolicy(args.auto_cancel, args.auto_arm))
+
+        if state_mirror:
+            player_watcher.add_listener(state_mirror.player_changed)
+
+        player_watcher.start()
+
+    journal = None
+
+    if args.state_file:
+        journal = Journal(args.state_file, args.state_sync_interval)
+        recover(journal)
+
+    if args.schedules_file:
+        schedules.path = args.schedules_file
+        schedules.load()
+
+    if processes:
+        # the workers took the listeners, only they talk to us
+        app = App(args.host, args.port, args.workers, args.queue_size, args.keep_alive_timeout, args.keep_alive_requests, args.events_heartbeat, sockets=[internal], handler_class=ForwardedRequestHandler)
+    else:
+        app = App(args.host, args.port, args.workers, args.queue_size, args.keep_alive_timeout, args.keep_alive_requests, args.events_heartbeat, args.idle_exit * 60, sockets, args.unix_socket, args.unix_socket_mode, args.unix_socket_group, not args.no_tcp)
+
+    try:
+        app.start()
+    finally:
+        if processes:
+            processes.stop()
+
+        if player_watcher:
+            player_watcher.stop()
+
+        if journal:
+            journal.close()
+
+        fleet.shutdown()
+
+fire_jitter = registry.histogram("mpd_auto_stop_fire_jitter_seconds", "How late timers paused mpd compared to their deadline", Histogram())
+requests_total = registry.counter("mpd_auto_stop_http_requests_total", "Requests served, by route, method and status", ("route", "method", "status"))
+request_seconds = registry.histograms("mpd_auto_stop_http_request_seconds", "Time from parsed request to sent response, by route and method", ("route", "method"))
+timer_operations = registry.counter("mpd_auto_stop_timer_operations_total", "Timer state changes, by operation", ("operation",))
+pause_seconds = registry.histogram("mpd_auto_stop_pause_seconds", "Time taken to pause mpd when a timer fires, including the mpc fallback")
+rate_limited = registry.counter("mpd_auto_stop_http_rate_limited_total", "Requests refused with a 429, by budget", ("budget",))
+pause_failures = registry.counter("mpd_auto_stop_pause_failures_total", "Failed attempts to pause mpd, by backend", ("backend",))
+player_watcher = None
+# --diagnostics, /debug routes answer 404 without it
+diagnostics_enabled = False
+# with --processes, what the main process publishes, where its workers forward to and what they publish
+state_mirror = None
+forwarder = None
+metrics_mirror = None
+# off until configured, see configure_rate_limits
+read_limiter = RateLimiter()
+write_limiter = RateLimiter()
 timer = Timer()
+timers = TimerRegistry()
+schedules = ScheduleBook(default_scheduler, fire_schedule)
+index_page = StaticAsset(INDEX_PAGE, "text/html; charset=utf-8")
+registry.register("mpd_auto_stop_log_dropped_total", "counter", "Log records dropped because the log queue was full", Gauge(lambda: sum(logger.dropped.values())))
+registry.gauge("mpd_auto_stop_active_timers", "Timers currently started, the default one and named ones", lambda: len(timers) + (timer.status == TimerStatus.started()))
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import hashlib
+import zlib
+
+def gzip_compress(data):
+    # wbits 31 writes the gzip header and trailer, with no timestamp so the same data always compresses the same
+    compressor = zlib.compressobj(9, zlib.DEFLATED, 31)
+
+    return compressor.compress(data) + compressor.flush()
+
+def accepts_gzip(header):
+    """
+    Whether an Accept-Encoding header allows gzip, `gzip;q=0` or `*;q=0` rule it out
+    """
+    accepted = {}
+
+    for item in (header or "").split(","):
+        (coding, _, parameters) = item.strip().partition(";")
+        quality = 1.0
+
+        for parameter in parameters.split(";"):
+            (name, _, value) = parameter.strip().partition("=")
+
+            if name.strip().lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+
+        accepted[coding.strip().lower()] = quality
+
+    return accepted.get("gzip", accepted.get("x-gzip", accepted.get("*", 0.0))) > 0
+
+def etag_matches(header, etag):
+    """
+    Whether an If-None-Match header lists `etag`, compared weakly like RFC 7232 asks for If-None-Match
+    """
+    if not header:
+        return False
+
+    if header.strip() == "*":
+        return True
+
+    def opaque(tag):
+        tag = tag.strip()
+
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return opaque(etag) in [opaque(tag) for tag in header.split(",")]
+
+class StaticAsset(object):
+    """
+    A response that never changes while we run, encoded and gzipped once up front rather than on every request.
+    Each encoding gets its own strong ETag, they're different bytes.
+    """
+    def __init__(self, content, content_type, cache_control="public, max-age=86400"):
+        self.body = content.encode("utf8") if not isinstance(content, bytes) else content
+        self.content_type = content_type
+        self.cache_control = cache_control
+        digest = hashlib.sha1(self.body).hexdigest()[:16]
+        self.etag = "\"{0}\"".format(digest)
+        gzipped = gzip_compress(self.body)
+
+        # tiny bodies can come out bigger
+        if len(gzipped) < len(self.body):
+            self.gzipped = gzipped
+            self.gzip_etag = "\"{0}-gzip\"".format(digest)
+        else:
+            self.gzipped = None
+            self.gzip_etag = None
+
+    def select(self, accept_encoding):
+        """
+        (body, etag, content encoding or None) for a request's Accept-Encoding
+        """
+        if self.gzipped is not None and accepts_gzip(accept_encoding):
+            return (self.gzipped, self.gzip_etag, "gzip")
+
+        return (self.body, self.etag, None)
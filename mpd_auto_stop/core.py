@@ -0,0 +1,153 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import itertools
+import json
+import uuid
+
+# exceptions
+class InvalidTimerStateError(Exception): pass
+
+# timer
+class TimerStatus(object):
+    @staticmethod
+    def started():
+        return "started"
+
+    @staticmethod
+    def stopped():
+        return "stopped"
+
+# every state gets a version no other state of this run has, the epoch tells runs apart as versions start over
+state_versions = itertools.count(1)
+state_epoch = uuid.uuid4().hex[:8]
+
+class TimerState(object):
+    """
+    What a timer is doing, never changed once built. Every change swaps in a new one, so a reader takes a single
+    reference and sees a consistent state without the timer's lock.
+
+    The transitions below are the whole timer, minus the waiting: they take the clock's reading and give back the
+    next state, scheduling its deadline and pausing mpd is up to whoever drives them, Timer on its scheduler thread
+    or AsyncTimer on an event loop.
+    """
+    __slots__ = ("status", "deadline", "duration", "fade", "target", "targets", "version", "_json")
+    fields = ("status", "deadline", "duration", "fade", "target", "targets")
+
+    def __init__(self, status=TimerStatus.stopped(), deadline=None, duration=0, fade=0, target=None, targets=None, version=0):
+        self.status = status
+        # monotonic, from the driving clock, so wall clock corrections don't move it
+        self.deadline = deadline
+        self.duration = duration
+        self.fade = fade
+        # a fleet target or group, None for mpd_host and mpd_port
+        self.target = target
+        self.targets = targets
+        # unique among states, 0 for any timer that never changed
+        self.version = version
+        # (player state, serialized status without remaining_time), filled by the first to_json
+        self._json = None
+
+    @property
+    def started(self):
+        return self.status == TimerStatus.started()
+
+    def replace(self, **changes):
+        values = dict((name, getattr(self, name)) for name in self.fields)
+        values.update(changes)
+
+        return TimerState(version=next(state_versions), **values)
+
+    # transitions
+    def start(self, now, duration, fade=0, target=None, targets=None):
+        """
+        Started with `duration` seconds to go, the last `fade` of them fading, both already parsed
+        """
+        if self.started:
+            raise InvalidTimerStateError("Timer is already started")
+
+        fade = min(fade, duration) if fade else 0
+
+        return self.replace(status=TimerStatus.started(), deadline=now + duration, duration=duration, fade=fade, target=target, targets=targets)
+
+    def resume(self, now, remaining_time, duration, fade=0, target=None, targets=None):
+        """
+        Started again from the journal, a deadline that passed while we were down is due right away
+        """
+        return self.replace(status=TimerStatus.started(), deadline=now + max(remaining_time, 0), duration=duration, fade=fade, target=target, targets=targets)
+
+    def restart(self, now):
+        if not self.started:
+            raise InvalidTimerStateError("Can't restart a stopped timer")
+
+        return self.replace(deadline=now + self.duration)
+
+    def extend(self, seconds):
+        if not self.started:
+            raise InvalidTimerStateError("Can't extend a stopped timer")
+
+        # moving the absolute deadline keeps status and later restarts consistent
+        return self.replace(deadline=self.deadline + seconds)
+
+    def stop(self):
+        if not self.started:
+            return self
+
+        return self.replace(status=TimerStatus.stopped(), deadline=None, duration=0, fade=0, target=None, targets=None)
+
+    def due(self, deadline):
+        """
+        Whether firing for `deadline` still applies, a restart or extend since it was scheduled moved it
+        """
+        return self.started and (deadline is None or deadline == self.deadline)
+
+    def expired(self, now):
+        # still started past the deadline, the pause is under way or got lost
+        return self.started and self.deadline - now < 0
+
+    def remaining(self, now):
+        """
+        What start, restart and extend answer with
+        """
+        return {
+            "remaining_time": "{0} seconds".format(self.deadline - now)
+        }
+
+    def etag(self, player_state=None):
+        """
+        Weak, remaining_time goes down between changes but the deadline it comes from stays put
+        """
+        return "W/\"{0}-{1}{2}\"".format(state_epoch, self.version, "-" + player_state if player_state else "")
+
+    def to_dict(self, now, player_state=None):
+        result = {
+            "status": self.status
+        }
+
+        if self.started:
+            result["remaining_time"] = "{0} seconds".format(self.deadline - now)
+
+            if self.target:
+                result["target"] = self.target
+
+        if player_state:
+            result["player_state"] = player_state
+
+        return result
+
+    def to_json(self, now, player_state=None):
+        """
+        to_dict serialized, only remaining_time is formatted per call, the rest once per state and player state
+        """
+        cached = self._json
+
+        if cached is None or cached[0] != player_state:
+            result = self.to_dict(now, player_state)
+            result.pop("remaining_time", None)
+            # a racing reader may serialize it too, they'd store the same thing
+            cached = self._json = (player_state, json.dumps(result))
+
+        if not self.started:
+            return cached[1]
+
+        return "{{\"remaining_time\": \"{0} seconds\", {1}".format(self.deadline - now, cached[1][1:])
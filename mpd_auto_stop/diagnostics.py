@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import collections
+import cProfile
+import itertools
+import os
+import pstats
+import sys
+import tempfile
+import threading
+import time
+from .metrics import monotonic
+
+class NullSpan(object):
+    """
+    What spans are while tracing is off, entering and leaving it is all they cost
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+null_span = NullSpan()
+
+class Span(object):
+    __slots__ = ("_trace", "_name", "_started")
+
+    def __init__(self, trace, name):
+        self._trace = trace
+        self._name = name
+
+    def __enter__(self):
+        self._started = monotonic()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        ended = monotonic()
+        self._trace.spans.append((self._name, self._started, ended))
+
+        return False
+
+class Trace(object):
+    """
+    The spans of one request, from the thread handling it
+    """
+    def __init__(self, name):
+        self.name = name
+        self.created = time.time()
+        self.started = monotonic()
+        self.spans = []
+        self.fields = {}
+
+    def to_dict(self):
+        result = dict(self.fields)
+        result.update({
+            "name": self.name,
+            "time": round(self.created, 3),
+            "duration_ms": round((monotonic() - self.started) * 1000, 3),
+            # offsets from the start of the request, in the order they ended, so a span inside another comes first
+            "spans": [{
+                "name": name,
+                "start_ms": round((started - self.started) * 1000, 3),
+                "duration_ms": round((ended - started) * 1000, 3)
+            } for (name, started, ended) in self.spans]
+        })
+
+        return result
+
+class Tracer(object):
+    """
+    Keeps the last `capacity` request traces. Off unless `enabled`, and then span() only checks a flag.
+    """
+    def __init__(self, capacity=256):
+        self.enabled = False
+        self._traces = collections.deque(maxlen=capacity)
+        self._local = threading.local()
+
+    def start(self, name):
+        """
+        Starts a trace for the current thread's request, None while tracing is off
+        """
+        if not self.enabled:
+            return None
+
+        trace = self._local.trace = Trace(name)
+
+        return trace
+
+    def span(self, name):
+        if not self.enabled:
+            return null_span
+
+        trace = getattr(self._local, "trace", None)
+
+        return Span(trace, name) if trace is not None else null_span
+
+    def finish(self, trace, **fields):
+        self._local.trace = None
+        trace.fields.update(fields)
+        # deque appends are atomic, a full one drops the oldest
+        self._traces.append(trace.to_dict())
+
+    def traces(self):
+        return list(self._traces)
+
+    def resize(self, capacity):
+        self._traces = collections.deque(self._traces, maxlen=capacity)
+
+    def clear(self):
+        self._traces.clear()
+
+class TracedLock(object):
+    """
+    A lock whose waits show up as a span in the current request's trace
+    """
+    def __init__(self, lock, tracer, name="lock_wait"):
+        self._lock = lock
+        self._tracer = tracer
+        self._name = name
+
+    def acquire(self, *args):
+        if not self._tracer.enabled:
+            return self._lock.acquire(*args)
+
+        with self._tracer.span(self._name):
+            return self._lock.acquire(*args)
+
+    def release(self):
+        self._lock.release()
+
+    def __enter__(self):
+        self.acquire()
+
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+
+        return False
+
+class Profiler(object):
+    """
+    cProfile over requests, one in `sample` of them while active. A profile only sees the thread that enabled it,
+    so every thread gets its own and they're merged when the session stops and its stats are dumped to `path`.
+
+    From python 3.12 on cProfile goes through sys.monitoring, which has room for one profile in the whole process,
+    a request sampled while another one is profiled runs without.
+    """
+    exclusive = sys.version_info >= (3, 12)
+
+    def __init__(self, path=None, sample=1):
+        self.path = path or os.path.join(tempfile.gettempdir(), "mpd-auto-stop.prof")
+        self.sample = sample
+        self.active = False
+        self._profiles = []
+        self._local = threading.local()
+        self._counter = itertools.count()
+        self._profiled = 0
+        self._running = 0
+        self._condition = threading.Condition(threading.Lock())
+        self._session = 0
+
+    def start(self):
+        with self._condition:
+            if self.active:
+                return False
+
+            self._profiles = []
+            self._counter = itertools.count()
+            self._profiled = 0
+            # profiles of an earlier session aren't reused
+            self._session += 1
+            self.active = True
+
+        return True
+
+    def _profile(self):
+        profile = getattr(self._local, "profile", None)
+
+        if profile is None or self._local.session != self._session:
+            profile = self._local.profile = cProfile.Profile()
+            self._local.session = self._session
+            self._profiles.append(profile)
+
+        return profile
+
+    def run(self, function, *args):
+        if not self.active or next(self._counter) % self.sample:
+            return function(*args)
+
+        with self._condition:
+            profile = None
+
+            # enabled under the lock, so stop can't read a profile about to run, nor two take the only slot
+            if self.active and not (self.exclusive and self._running):
+                profile = self._profile()
+
+                try:
+                    profile.enable()
+                except ValueError:
+                    # another tool is profiling the process, a debugger or coverage, pstats can't merge an empty one
+                    self._profiles.remove(profile)
+                    self._local.profile = profile = None
+                else:
+                    self._profiled += 1
+                    self._running += 1
+
+        if profile is None:
+            return function(*args)
+
+        self._local.running = True
+
+        try:
+            return function(*args)
+        finally:
+            profile.disable()
+            self._local.running = False
+
+            with self._condition:
+                self._running -= 1
+                self._condition.notify_all()
+
+    def stop(self, limit=10, timeout=5.0):
+        """
+        Ends the session and dumps its stats, returns where to with the `limit` functions taking the most time
+        """
+        deadline = monotonic() + timeout
+        # stopped from a profiled request, which won't finish while we wait for it
+        own = 1 if getattr(self._local, "running", False) else 0
+
+        if own:
+            self._local.profile.disable()
+
+        with self._condition:
+            if not self.active:
+                return None
+
+            self.active = False
+
+            # a profile still running can't be read
+            while self._running > own and monotonic() < deadline:
+                self._condition.wait(deadline - monotonic())
+
+            profiles = list(self._profiles)
+            profiled = self._profiled
+
+        result = {
+            "path": self.path,
+            "requests": profiled,
+            "top": []
+        }
+
+        if not profiles:
+            return result
+
+        stats = pstats.Stats(profiles[0])
+
+        for profile in profiles[1:]:
+            stats.add(profile)
+
+        stats.dump_stats(self.path)
+
+        # pstats keys are (file, line, function) to (primitive calls, calls, own time, cumulative time, callers)
+        rows = sorted(stats.stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+        result["top"] = [{
+            "function": "{0}:{1}({2})".format(os.path.basename(key[0]), key[1], key[2]),
+            "calls": value[1],
+            "own_seconds": round(value[2], 6),
+            "cumulative_seconds": round(value[3], 6)
+        } for (key, value) in rows]
+
+        return result
+
+    def toggle(self):
+        if self.active:
+            return self.stop()
+
+        self.start()
+
+        return None
+
+tracer = Tracer()
+profiler = Profiler()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import collections
+import threading
+import time
+
+class Event(object):
+    __slots__ = ("type", "data", "time")
+
+    def __init__(self, type, data):
+        self.type = type
+        self.data = data
+        self.time = time.time()
+
+class Subscription(object):
+    """
+    A bounded buffer of events for one consumer, when it's full the oldest event is dropped so publishers never wait
+    """
+    def __init__(self, bus, max_pending):
+        self._bus = bus
+        self._events = collections.deque()
+        self._max_pending = max_pending
+        self._condition = threading.Condition(threading.Lock())
+        self._closed = False
+        self.dropped = 0
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def push(self, event):
+        with self._condition:
+            if self._closed:
+                return
+
+            if len(self._events) >= self._max_pending:
+                self._events.popleft()
+                self.dropped += 1
+
+            self._events.append(event)
+            self._condition.notify()
+
+    def get(self, timeout=None):
+        """
+        Returns the next event, None on timeout or once the subscription is closed
+        """
+        with self._condition:
+            if not self._events and not self._closed:
+                self._condition.wait(timeout)
+
+            if self._events:
+                return self._events.popleft()
+
+            return None
+
+    def close(self):
+        self._bus.unsubscribe(self)
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+class EventBus(object):
+    """
+    Fans events out to any number of subscriptions, publishing costs one non-blocking push per subscriber
+    """
+    def __init__(self, max_pending=64):
+        self._max_pending = max_pending
+        # replaced rather than mutated, so publish can iterate without taking the lock
+        self._subscriptions = ()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._subscriptions)
+
+    def subscribe(self, max_pending=None):
+        subscription = Subscription(self, max_pending or self._max_pending)
+
+        with self._lock:
+            self._subscriptions = self._subscriptions + (subscription,)
+
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscriptions = tuple(item for item in self._subscriptions if item is not subscription)
+
+    def publish(self, type, **data):
+        subscriptions = self._subscriptions
+
+        if not subscriptions:
+            return
+
+        event = Event(type, data)
+
+        for subscription in subscriptions:
+            subscription.push(event)
+
+    def close_all(self):
+        for subscription in self._subscriptions:
+            subscription.close()
+
+bus = EventBus()
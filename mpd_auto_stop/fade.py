@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import math
+import threading
+from .mpd import MPDError, pool as mpd_pool
+from .logger import logger
+
+class Fader(object):
+    """
+    Lowers the mpd volume in steps from `start` until `end`, where the timer pauses and restores it.
+
+    Steps sit on an absolute grid from `start`, each one is scheduled after the previous one is done,
+    so a slow mpd makes us skip steps rather than drift or queue them up. With an `executor` the scheduler only
+    hands steps to it, instead of running them on its own thread.
+
+    Stopping never waits on mpd: finish() only marks the fade done, restore() puts the volume back once a step
+    that's under way is through.
+    """
+    def __init__(self, scheduler, host, port, start, end, min_step=0.5, pool=None, executor=None):
+        self._scheduler = scheduler
+        self._host = host
+        self._port = port
+        self._start = start
+        self._end = end
+        self._min_step = min_step
+        self._pool = pool or mpd_pool
+        self._executor = executor
+        self._original_volume = None
+        self._steps = 0
+        self._interval = 0
+        self._call = None
+        self._done = False
+        self._lock = threading.Lock()
+        # held across every setvol, so a restore can't be overtaken by a step that was already on its way
+        self._io_lock = threading.Lock()
+
+    @property
+    def original_volume(self):
+        return self._original_volume
+
+    def start(self):
+        with self._lock:
+            # finished before it got going
+            if self._done:
+                return self
+
+            self._call = self._scheduler.call_at(self._start, self._run, self._begin)
+
+        return self
+
+    def _run(self, function, *args):
+        if self._executor:
+            self._executor(function, *args)
+        else:
+            function(*args)
+
+    def _begin(self):
+        try:
+            status = self._pool.command(self._host, self._port, "status")
+        except MPDError as exp:
+            logger.warning("Can't read the volume to fade", host=self._host, port=self._port, error=exp)
+
+            return
+
+        volume = int(status.get("volume", -1))
+
+        # -1 means mpd has no mixer to control
+        if volume <= 0:
+            return
+
+        with self._lock:
+            if self._done:
+                return
+
+            self._original_volume = volume
+            self._steps = max(1, min(volume, int(round((self._end - self._start) / self._min_step))))
+            self._interval = (self._end - self._start) / float(self._steps)
+
+        self._schedule_next()
+
+    def _schedule_next(self):
+        with self._lock:
+            if self._done:
+                return
+
+            # the next grid point from now, anything we were too slow for is skipped
+            index = int(math.floor((self._scheduler.time() - self._start) / self._interval)) + 1
+
+            if index >= self._steps:
+                return
+
+            self._call = self._scheduler.call_at(self._start + index * self._interval, self._run, self._step, index)
+
+    def _step(self, index):
+        volume = int(round(self._original_volume * (self._steps - index) / float(self._steps)))
+
+        with self._io_lock:
+            if self._done:
+                return
+
+            try:
+                self._pool.command_list(self._host, self._port, [("setvol", volume)])
+            except MPDError as exp:
+                logger.warning("Error fading volume", host=self._host, port=self._port, error=exp)
+
+        self._schedule_next()
+
+    def finish(self, wait=True):
+        """
+        Stops stepping, returns the volume to restore along with the pause, None when nothing was faded. Unless
+        `wait` is off it returns once a step under way is through, so the pause isn't overtaken by it.
+        """
+        with self._lock:
+            self._done = True
+
+            if self._call:
+                self._call.cancel()
+
+            volume = self._original_volume
+
+        if wait:
+            with self._io_lock:
+                pass
+
+        return volume
+
+    def restore(self):
+        """
+        Puts the volume back after finish(), nothing when nothing was faded
+        """
+        volume = self.finish(wait=False)
+
+        if volume is None:
+            return
+
+        with self._io_lock:
+            try:
+                self._pool.command(self._host, self._port, "setvol", volume)
+            except MPDError as exp:
+                logger.error("Error restoring volume", host=self._host, port=self._port, error=exp)
+
+    def cancel(self):
+        """
+        Stops stepping and puts the volume back
+        """
+        self.restore()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+"""
+A stand-in for Music Player Daemon, for tests and benchmarks. It speaks enough of the protocol for what
+mpd-auto-stop sends: the greeting, `status`, `pause`, `play`, `setvol`, `ping`, `idle`/`noidle` and command lists.
+
+Every reply can be delayed by `latency` seconds, commands in `fail` always answer with an ACK and any other
+command does so with probability `error_rate`.
+"""
+
+from __future__ import print_function
+import random
+import select
+import threading
+import time
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+monotonic = getattr(time, "monotonic", time.time)
+
+class FakeMPDHandler(socketserver.StreamRequestHandler):
+    # unbuffered, a noidle that came in with its idle would sit in the buffer where _idle's select can't see it
+    rbufsize = 0
+
+    def _ack(self, command):
+        self.wfile.write("ACK [5@0] {{{0}}} unknown command \"{0}\"\n".format(command).encode("utf8"))
+
+    def _run(self, command, args):
+        server = self.server
+
+        if command == "status":
+            self.wfile.write("volume: {0}\nstate: {1}\n".format(server.volume, server.state).encode("utf8"))
+        elif command == "pause":
+            server.set_state("pause" if args != ['"0"'] else "play")
+        elif command == "play":
+            server.set_state("play")
+        elif command == "setvol" and args:
+            server.volume = int(args[0].strip('"'))
+            server.notify("mixer")
+
+    def _idle(self, subsystems):
+        seen = self.seen
+
+        while True:
+            if select.select([self.connection], [], [], 0.01)[0]:
+                line = self.rfile.readline().decode("utf8").rstrip("\n")
+                self.server.received.append(line)
+                self.wfile.write(b"OK\n")
+
+                return
+
+            changed = set(self.server.changes[seen:])
+
+            if subsystems:
+                changed &= set(subsystems)
+
+            self.seen = len(self.server.changes)
+
+            if changed:
+                for subsystem in sorted(changed):
+                    self.wfile.write("changed: {0}\n".format(subsystem).encode("utf8"))
+
+                self.wfile.write(b"OK\n")
+
+                return
+
+    def handle(self):
+        server = self.server
+        server.connections += 1
+        # like mpd, idle reports whatever changed since the connection's previous idle
+        self.seen = len(server.changes)
+        self.wfile.write(b"OK MPD 0.21.0\n")
+        in_list = False
+        failed = False
+
+        for line in self.rfile:
+            line = line.decode("utf8").rstrip("\n")
+            server.received.append(line)
+
+            if line == "command_list_ok_begin":
+                in_list = True
+                failed = False
+                continue
+
+            if line == "command_list_end":
+                in_list = False
+
+                if not failed:
+                    if server.latency:
+                        time.sleep(server.latency)
+
+                    self.wfile.write(b"OK\n")
+
+                continue
+
+            # after an ACK mpd ignores the rest of the list
+            if failed:
+                continue
+
+            parts = line.split(" ")
+            command = parts[0]
+
+            if command == "idle":
+                self._idle([part.strip('"') for part in parts[1:]])
+                continue
+
+            # only means something while idle, mpd doesn't answer it otherwise
+            if command == "noidle":
+                continue
+
+            if command == "pause":
+                server.paused_at.append(monotonic())
+
+            if not in_list and server.latency:
+                time.sleep(server.latency)
+
+            if command in server.fail or (server.error_rate and random.random() < server.error_rate):
+                self._ack(command)
+                failed = in_list
+                continue
+
+            self._run(command, parts[1:])
+            self.wfile.write(b"list_OK\n" if in_list else b"OK\n")
+
+class FakeMPD(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0, error_rate=0.0):
+        socketserver.ThreadingTCPServer.__init__(self, (host, port), FakeMPDHandler)
+        self.latency = latency
+        self.error_rate = error_rate
+        self.fail = set()
+        self.connections = 0
+        self.received = []
+        # monotonic time every pause arrived, failed ones too, to measure how late timers fire
+        self.paused_at = []
+        self.changes = []
+        self.state = "play"
+        self.volume = 50
+        self.thread = threading.Thread(target=self.serve_forever, args=(0.05,), name="fake-mpd")
+        self.thread.daemon = True
+        self.thread.start()
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def notify(self, subsystem):
+        self.changes.append(subsystem)
+
+    def set_state(self, state):
+        self.state = state
+        self.notify("player")
+
+    def close(self):
+        self.shutdown()
+        self.server_close()
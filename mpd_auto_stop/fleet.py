@@ -0,0 +1,190 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import io
+import json
+import re
+import threading
+from .pool import WorkerPool, PoolFullError
+
+class Target(object):
+    """
+    One mpd, by the name timers and requests refer to it with
+    """
+    __slots__ = ("name", "host", "port", "groups")
+
+    def __init__(self, name, host, port=6600, groups=()):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.groups = tuple(groups)
+
+    def to_dict(self):
+        return {
+            "host": self.host,
+            "port": self.port,
+            "groups": list(self.groups)
+        }
+
+def parse_target(text):
+    """
+    `name=host[:port]` from the command line, a unix socket path or `password@host` work as the host
+    """
+    (name, _, address) = str(text or "").partition("=")
+    match = re.match("^(.+?)(?::([0-9]+))?$", address)
+
+    if not name or not match:
+        raise ValueError("Invalid target, expected name=host[:port]: {0}".format(text))
+
+    return Target(name, match.group(1), int(match.group(2) or 6600))
+
+def parse_group(text):
+    """
+    (group, [target names]) of `group=name,name` from the command line
+    """
+    (name, _, members) = str(text or "").partition("=")
+
+    if not name or not members:
+        raise ValueError("Invalid group, expected group=target,target: {0}".format(text))
+
+    return (name, [member.strip() for member in members.split(",") if member.strip()])
+
+class Fleet(object):
+    """
+    Named mpd targets and groups of them. Commands for several targets are fanned out over a bounded pool of
+    threads, created on first use, so pausing ten speakers takes about as long as the slowest one.
+    """
+    all = "all"
+
+    def __init__(self, workers=8, queue_size=64):
+        self._targets = {}
+        self._groups = {}
+        # read when the pool is first needed, so it can be set from the command line after import
+        self.workers = workers
+        self._queue_size = queue_size
+        self._pool = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._targets)
+
+    def add(self, target):
+        with self._lock:
+            self._targets[target.name] = target
+
+            for group in target.groups:
+                self._groups.setdefault(group, [])
+
+                if target.name not in self._groups[group]:
+                    self._groups[group].append(target.name)
+
+        return target
+
+    def group(self, name, members):
+        with self._lock:
+            unknown = [member for member in members if member not in self._targets]
+
+            if unknown:
+                raise ValueError("Unknown targets in group {0}: {1}".format(name, ", ".join(unknown)))
+
+            for member in members:
+                target = self._targets[member]
+
+                if name not in target.groups:
+                    target.groups = target.groups + (name,)
+
+                self._groups.setdefault(name, [])
+
+                if member not in self._groups[name]:
+                    self._groups[name].append(member)
+
+    def load(self, path):
+        """
+        Reads `{"targets": {"kitchen": {"host": "...", "port": 6600, "groups": ["downstairs"]}}}`
+        """
+        with io.open(path, "r", encoding="utf8") as fd:
+            config = json.load(fd)
+
+        for (name, target) in sorted(config.get("targets", {}).items()):
+            self.add(Target(name, target["host"], int(target.get("port", 6600)), target.get("groups", ())))
+
+    def resolve(self, selector):
+        """
+        The targets `selector` names, a target, a group or `all`
+        """
+        with self._lock:
+            if selector in self._targets:
+                return [self._targets[selector]]
+
+            if selector in self._groups:
+                return [self._targets[name] for name in self._groups[selector]]
+
+            if selector == self.all and self._targets:
+                return [self._targets[name] for name in sorted(self._targets)]
+
+        raise ValueError("Unknown target or group: {0}".format(selector))
+
+    def to_dict(self):
+        with self._lock:
+            return dict((name, target.to_dict()) for (name, target) in self._targets.items())
+
+    def _get_pool(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = WorkerPool(self.workers, self._queue_size, "mpd-auto-stop-fleet")
+
+            return self._pool
+
+    def submit(self, function, *args):
+        """
+        Runs `function` on the fleet's pool, inline when the pool is saturated rather than dropping it
+        """
+        try:
+            self._get_pool().submit(function, *args)
+        except PoolFullError:
+            function(*args)
+
+    def run(self, targets, function, *args):
+        """
+        Calls `function(target, *args)` for every target concurrently and waits for all of them. Returns a dict
+        of target name to what it returned, or to `{"status": "failed", "error": ...}` when it raised.
+        """
+        results = {}
+        done = threading.Condition(threading.Lock())
+
+        def call(target):
+            try:
+                result = function(target, *args)
+            except Exception as exp:
+                result = {
+                    "status": "failed",
+                    "error": str(exp)
+                }
+
+            with done:
+                results[target.name] = result
+                done.notify()
+
+        # one target, nothing to wait in parallel with
+        if len(targets) == 1:
+            call(targets[0])
+
+            return results
+
+        for target in targets:
+            self.submit(call, target)
+
+        with done:
+            while len(results) < len(targets):
+                done.wait()
+
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            pool, self._pool = self._pool, None
+
+        if pool:
+            pool.shutdown(wait=False)
+
+fleet = Fleet()
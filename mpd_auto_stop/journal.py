@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import io
+import json
+import os
+import threading
+import time
+
+class Journal(object):
+    """
+    An append-only file of timer starts, extends, restarts and stops, so pending timers survive a restart.
+
+    Every record is flushed to the OS right away, fsync runs at most once per `sync_interval` from a background
+    thread. After `compact_after` records the file is rewritten with just the live timers, so replaying it on
+    startup costs the same however long the service has been running.
+    """
+    def __init__(self, path, sync_interval=1.0, compact_after=1000):
+        self._path = path
+        self._sync_interval = sync_interval
+        self._compact_after = compact_after
+        self._live = {}
+        self._records = 0
+        self._file = None
+        self._dirty = False
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+
+    @property
+    def path(self):
+        return self._path
+
+    def _replay(self):
+        live = {}
+
+        if not os.path.exists(self._path):
+            return live
+
+        with io.open(self._path, "r", encoding="utf8") as fd:
+            for line in fd:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # a torn last line from a crash mid write
+                    continue
+
+                if record.get("op") == "stop":
+                    live.pop(record.get("timer"), None)
+                else:
+                    live[record.get("timer")] = record
+
+        return live
+
+    def open(self):
+        """
+        Replays the journal, compacts it and opens it for appending. Returns the timers pending when it was
+        last written, a dict of timer name (None for the default timer) to a record with the wall clock
+        `deadline` and the `duration` to restart with.
+        """
+        with self._lock:
+            self._live = self._replay()
+            self._compact()
+
+        self._thread = threading.Thread(target=self._sync_loop, name="mpd-auto-stop-journal")
+        self._thread.daemon = True
+        self._thread.start()
+
+        return dict(self._live)
+
+    def _compact(self):
+        temp_path = self._path + ".tmp"
+
+        with io.open(temp_path, "w", encoding="utf8") as fd:
+            for record in self._live.values():
+                fd.write(json.dumps(record) + u"\n")
+
+            fd.flush()
+            os.fsync(fd.fileno())
+
+        if self._file:
+            self._file.close()
+
+        os.rename(temp_path, self._path)
+
+        self._file = io.open(self._path, "a", encoding="utf8")
+        self._records = len(self._live)
+        self._dirty = False
+
+    def record(self, op, timer, deadline=None, duration=None, fade=0, target=None):
+        """
+        Appends one record, `deadline` is wall clock seconds since the epoch
+        """
+        record = {
+            "op": op,
+            "timer": timer
+        }
+
+        if op != "stop":
+            record["deadline"] = deadline
+            record["duration"] = duration
+            record["fade"] = fade
+
+            if target:
+                record["target"] = target
+
+        with self._lock:
+            if self._file is None:
+                return
+
+            if op == "stop":
+                self._live.pop(timer, None)
+            else:
+                self._live[timer] = record
+
+            self._file.write(json.dumps(record) + u"\n")
+            self._file.flush()
+            self._records += 1
+            self._dirty = True
+
+            if self._records >= self._compact_after + len(self._live):
+                self._compact()
+
+    def sync(self):
+        with self._lock:
+            if self._file is None or not self._dirty:
+                return
+
+            self._file.flush()
+            self._dirty = False
+            # a copy, compacting or closing may close the file meanwhile
+            fd = os.dup(self._file.fileno())
+
+        # outside the lock, record() is called under the timer's lock and mustn't wait for the disk
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _sync_loop(self):
+        while not self._closed.wait(self._sync_interval):
+            self.sync()
+
+    def close(self):
+        self._closed.set()
+        self.sync()
+
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+def wall_clock(deadline, clock):
+    """
+    Turns a deadline on `clock` (monotonic) into wall clock time for the journal
+    """
+    return time.time() + (deadline - clock())
@@ -0,0 +1,172 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import collections
+import sys
+import threading
+import time
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+# above every level, logs nothing
+OFF = 100
+
+LEVEL_NAMES = {
+    DEBUG: "DEBUG",
+    INFO: "INFO",
+    WARNING: "WARNING",
+    ERROR: "ERROR"
+}
+
+def _format_field(value):
+    value = str(value)
+
+    if not value or " " in value or "=" in value or "\"" in value:
+        return "\"{0}\"".format(value.replace("\\", "\\\\").replace("\"", "\\\""))
+
+    return value
+
+class Logger(object):
+    """
+    Logging that never blocks the caller on the output. Records go into a bounded queue and a background thread
+    writes them out in batches, when the queue is full new records are dropped and counted per level.
+
+    Records are formatted on the writer thread, `time LEVEL message key=value ...`, one per line.
+    """
+    def __init__(self, stream=None, level=INFO, max_pending=1024, batch_size=64):
+        # None is whatever sys.stdout is when writing, so redirecting it later still works
+        self._stream = stream
+        self.level = level
+        self._max_pending = max_pending
+        self._batch_size = batch_size
+        self._records = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._writing = False
+        self._thread = None
+        self._closed = False
+        self.dropped = dict((level, 0) for level in LEVEL_NAMES)
+
+    @property
+    def pending(self):
+        return len(self._records)
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name="mpd-auto-stop-logger")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def after_fork(self):
+        """
+        For a forked child, the writer thread stayed in the parent and may have held the lock when it forked
+        """
+        self._records = collections.deque()
+        self._condition = threading.Condition(threading.Lock())
+        self._writing = False
+        self._thread = None
+
+    def log(self, level, message, *args, **fields):
+        if level < self.level:
+            return
+
+        with self._condition:
+            if len(self._records) >= self._max_pending:
+                self.dropped[level] = self.dropped.get(level, 0) + 1
+
+                return
+
+            self._records.append((time.time(), level, message, args, fields))
+
+            if self._thread is None:
+                self._start()
+
+            # flush() waits on the same condition, notify() could wake it instead of the writer
+            self._condition.notify_all()
+
+    def debug(self, message, *args, **fields):
+        self.log(DEBUG, message, *args, **fields)
+
+    def info(self, message, *args, **fields):
+        self.log(INFO, message, *args, **fields)
+
+    def warning(self, message, *args, **fields):
+        self.log(WARNING, message, *args, **fields)
+
+    def error(self, message, *args, **fields):
+        self.log(ERROR, message, *args, **fields)
+
+    def _format(self, record):
+        (created, level, message, args, fields) = record
+
+        try:
+            text = str(message).format(*args) if args else str(message)
+        except (IndexError, KeyError, ValueError) as exp:
+            text = "{0} (bad log format: {1})".format(message, exp)
+
+        parts = [time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(created)), LEVEL_NAMES.get(level, str(level)), text]
+        parts.extend("{0}={1}".format(key, _format_field(value)) for (key, value) in sorted(fields.items()) if value is not None)
+
+        return " ".join(parts)
+
+    def _format_safely(self, record):
+        try:
+            return self._format(record)
+        except Exception:
+            # a field whose str() raises, unicode on python 2 among them, costs its own line only
+            return repr(record)
+
+    def _write(self, records):
+        stream = self._stream or sys.stdout
+
+        try:
+            stream.write("".join(self._format_safely(record) + "\n" for record in records))
+            stream.flush()
+        except Exception:
+            # nowhere left to report it
+            pass
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._records and not self._closed:
+                    self._condition.wait()
+
+                if not self._records:
+                    return
+
+                count = min(len(self._records), self._batch_size)
+                records = [self._records.popleft() for _ in range(count)]
+                self._writing = True
+
+            self._write(records)
+
+            with self._condition:
+                self._writing = False
+                self._condition.notify_all()
+
+    def flush(self, timeout=5.0):
+        """
+        Waits until everything queued so far is written, True when it was within `timeout`
+        """
+        deadline = time.time() + timeout
+
+        with self._condition:
+            while self._records or self._writing:
+                remaining = deadline - time.time()
+
+                if remaining <= 0 or self._thread is None:
+                    return False
+
+                self._condition.wait(remaining)
+
+        return True
+
+    def close(self, timeout=5.0):
+        self.flush(timeout)
+
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+logger = Logger()
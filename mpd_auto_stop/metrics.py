@@ -0,0 +1,292 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import bisect
+import collections
+import threading
+import time
+
+monotonic = getattr(time, "monotonic", time.time)
+
+# seconds, from a millisecond up to a few seconds late
+LATENCY_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+class Histogram(object):
+    """
+    Counts observations into fixed buckets, recording is a bisect and a few additions under a lock
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self._buckets = tuple(sorted(buckets))
+        # one extra slot for everything above the last bucket
+        self._counts = [0] * (len(self._buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._min = None
+        self._max = None
+        self._lock = threading.Lock()
+
+    @property
+    def buckets(self):
+        return self._buckets
+
+    def observe(self, value):
+        index = bisect.bisect_left(self._buckets, value)
+
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+            if self._min is None or value < self._min:
+                self._min = value
+
+            if self._max is None or value > self._max:
+                self._max = value
+
+    def snapshot(self):
+        """
+        Returns the cumulative count for every upper bound, like prometheus buckets, plus count, sum, min and max
+        """
+        with self._lock:
+            counts = list(self._counts)
+            result = {
+                "count": self._count,
+                "sum": self._sum,
+                "min": self._min,
+                "max": self._max
+            }
+
+        cumulative = 0
+        buckets = []
+
+        for (bound, count) in zip(self._buckets + ("+Inf",), counts):
+            cumulative += count
+            buckets.append([bound, cumulative])
+
+        result["buckets"] = buckets
+
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._counts = [0] * (len(self._buckets) + 1)
+            self._sum = 0.0
+            self._count = 0
+            self._min = None
+            self._max = None
+
+class Counter(object):
+    """
+    Counts per set of label values, the values are passed positionally in the order the labels were declared
+    """
+    def __init__(self, labels=()):
+        self._labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    @property
+    def labels(self):
+        return self._labels
+
+    def inc(self, values=(), amount=1):
+        with self._lock:
+            self._values[values] = self._values.get(values, 0) + amount
+
+    def value(self, values=()):
+        return self._values.get(values, 0)
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._values.items())
+
+class Histograms(object):
+    """
+    One Histogram per set of label values, created on first use
+    """
+    def __init__(self, labels=(), buckets=LATENCY_BUCKETS):
+        self._labels = tuple(labels)
+        self._buckets = buckets
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    @property
+    def labels(self):
+        return self._labels
+
+    def get(self, values=()):
+        histogram = self._histograms.get(values)
+
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(values, Histogram(self._buckets))
+
+        return histogram
+
+    def observe(self, value, values=()):
+        self.get(values).observe(value)
+
+    def samples(self):
+        with self._lock:
+            return sorted(self._histograms.items())
+
+class Gauge(object):
+    """
+    A value read from `function` when the metrics are collected, nothing to keep up to date on the hot path
+    """
+    def __init__(self, function):
+        self._function = function
+
+    @property
+    def labels(self):
+        return ()
+
+    def samples(self):
+        return [((), self._function())]
+
+def merge_snapshots(snapshots):
+    """
+    One Histogram snapshot out of several with the same buckets, as if they had all been observed by one
+    """
+    result = {
+        "count": sum(snapshot["count"] for snapshot in snapshots),
+        "sum": sum(snapshot["sum"] for snapshot in snapshots)
+    }
+
+    for (name, pick) in (("min", min), ("max", max)):
+        values = [snapshot[name] for snapshot in snapshots if snapshot[name] is not None]
+        result[name] = pick(values) if values else None
+
+    result["buckets"] = [[bucket[0][0], sum(item[1] for item in bucket)] for bucket in zip(*[snapshot["buckets"] for snapshot in snapshots])]
+
+    return result
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+
+    if not pairs:
+        return ""
+
+    return "{" + ",".join('{0}="{1}"'.format(name, _escape(value)) for (name, value) in pairs) + "}"
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Registry(object):
+    """
+    Named metrics rendered in the prometheus text exposition format
+    """
+    content_type = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = []
+        # functions returning what export returned elsewhere, see add_source
+        self._sources = []
+        self._lock = threading.Lock()
+
+    def register(self, name, type, help, metric):
+        with self._lock:
+            self._metrics.append((name, type, help, metric))
+
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.register(name, "counter", help, Counter(labels))
+
+    def histograms(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        return self.register(name, "histogram", help, Histograms(labels, buckets))
+
+    def histogram(self, name, help, histogram=None):
+        """
+        Registers a single unlabeled Histogram, an existing one can be passed in
+        """
+        return self.register(name, "histogram", help, histogram or Histogram())
+
+    def gauge(self, name, help, function):
+        return self.register(name, "gauge", help, Gauge(function))
+
+    def add_source(self, function):
+        """
+        Rendered along with our own samples, added to them: `function` returns a list of what export returned in other
+        processes, like the workers of --processes
+        """
+        with self._lock:
+            self._sources.append(function)
+
+    def export(self, names):
+        """
+        The samples of the counters and histograms named, as JSON friendly lists, for another process's add_source
+        """
+        with self._lock:
+            metrics = [(name, metric) for (name, _, _, metric) in self._metrics if name in names]
+
+        result = {}
+
+        for (name, metric) in metrics:
+            result[name] = [[list(values), value.snapshot() if isinstance(value, Histogram) else value] for (values, value) in metric.samples()]
+
+        return result
+
+    def _samples(self, name, metric, exported):
+        samples = metric.samples()
+
+        if not exported:
+            return samples
+
+        merged = collections.OrderedDict(samples)
+
+        for item in exported:
+            for (values, value) in item.get(name, ()):
+                values = tuple(values)
+
+                if values not in merged:
+                    merged[values] = value
+                elif isinstance(value, dict):
+                    # our own are Histograms, exported ones snapshots
+                    ours = merged[values]
+                    merged[values] = merge_snapshots([ours.snapshot() if isinstance(ours, Histogram) else ours, value])
+                else:
+                    merged[values] += value
+
+        return sorted(merged.items())
+
+    def _render_histogram(self, lines, name, names, values, snapshot):
+        for (bound, count) in snapshot["buckets"]:
+            lines.append("{0}_bucket{1} {2}".format(name, _format_labels(names, values, [("le", _format_value(bound))]), count))
+
+        lines.append("{0}_sum{1} {2}".format(name, _format_labels(names, values), _format_value(snapshot["sum"])))
+        lines.append("{0}_count{1} {2}".format(name, _format_labels(names, values), snapshot["count"]))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+            sources = list(self._sources)
+
+        exported = [item for function in sources for item in function()]
+        lines = []
+
+        for (name, type, help, metric) in metrics:
+            lines.append("# HELP {0} {1}".format(name, help))
+            lines.append("# TYPE {0} {1}".format(name, type))
+
+            if isinstance(metric, Histogram):
+                self._render_histogram(lines, name, (), (), metric.snapshot())
+
+                continue
+
+            for (values, value) in self._samples(name, metric, exported):
+                if isinstance(value, Histogram):
+                    self._render_histogram(lines, name, metric.labels, values, value.snapshot())
+                elif isinstance(value, dict):
+                    self._render_histogram(lines, name, metric.labels, values, value)
+                else:
+                    lines.append("{0}{1} {2}".format(name, _format_labels(metric.labels, values), _format_value(value)))
+
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
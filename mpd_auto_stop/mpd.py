@@ -0,0 +1,417 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import socket
+import threading
+import time
+from .metrics import registry, monotonic
+
+HELLO_PREFIX = "OK MPD "
+ERROR_PREFIX = "ACK "
+SUCCESS = "OK"
+NEXT = "list_OK"
+
+# exceptions
+class MPDError(Exception): pass
+
+class MPDConnectionError(MPDError): pass
+
+class MPDProtocolError(MPDError): pass
+
+class MPDCommandError(MPDError):
+    """
+    Raised when mpd answers with an `ACK [error@command_listNum] {command} message` line
+    """
+    def __init__(self, line):
+        self.line = line
+        self.code = 0
+        self.index = 0
+        self.command = ""
+        self.message = line
+
+        try:
+            # ACK [50@0] {play} song doesn't exist: "10240"
+            head, rest = line[len(ERROR_PREFIX):].split("] ", 1)
+            code, index = head.lstrip("[").split("@", 1)
+            command, message = rest.split("} ", 1)
+
+            self.code = int(code)
+            self.index = int(index)
+            self.command = command.lstrip("{")
+            self.message = message
+        except ValueError:
+            pass
+
+        super(MPDCommandError, self).__init__(self.message)
+
+def _quote(arg):
+    arg = str(arg)
+
+    return '"{0}"'.format(arg.replace("\\", "\\\\").replace('"', '\\"'))
+
+def format_command(command, args):
+    return " ".join([command] + [_quote(arg) for arg in args]) + "\n"
+
+def format_command_list(commands):
+    """
+    (command, args...) tuples as one command list, each answered with its own list_OK
+    """
+    lines = ["command_list_ok_begin\n"]
+    lines.extend(format_command(command[0], command[1:]) for command in commands)
+    lines.append("command_list_end\n")
+
+    return "".join(lines)
+
+def parse_line(line, terminators):
+    """
+    The `key: value` pair on a line of a response, None when it's one of `terminators`. Raises MPDCommandError for
+    an ACK, and MPDProtocolError for anything else, after which the connection is out of step and should be closed.
+    Shared by MPDClient and AsyncMPDClient, which differ only in how they read lines.
+    """
+    if line in terminators:
+        return None
+
+    if line.startswith(ERROR_PREFIX):
+        raise MPDCommandError(line)
+
+    if ": " not in line:
+        raise MPDProtocolError("Unexpected line from mpd: {0}".format(line))
+
+    return tuple(line.split(": ", 1))
+
+def _split_host(host):
+    """
+    Splits mpc style `password@host` into its parts, abstract sockets start with `@` and carry no password
+    """
+    if host and not host.startswith("@") and "@" in host:
+        password, host = host.split("@", 1)
+
+        return (password, host)
+
+    return (None, host)
+
+class MPDClient(object):
+    """
+    A minimal, blocking client for the mpd protocol, talks either TCP or a unix socket (host starting with `/` or `@`)
+    """
+    def __init__(self, host="localhost", port=6600, timeout=5.0):
+        self._password, self._host = _split_host(host)
+        self._port = port
+        self._timeout = timeout
+        self._sock = None
+        self._rfile = None
+        self._version = None
+        self.last_used = 0.0
+        self.pool_key = (host, port)
+
+    @property
+    def host(self):
+        return self._host
+
+    @property
+    def port(self):
+        return self._port
+
+    @property
+    def version(self):
+        return self._version
+
+    @property
+    def connected(self):
+        return self._sock is not None
+
+    def _create_socket(self):
+        if self._host.startswith("/") or self._host.startswith("@"):
+            address = self._host
+
+            if address.startswith("@"):
+                address = "\0" + address[1:]
+
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            sock.settimeout(self._timeout)
+            sock.connect(address)
+        else:
+            sock = socket.create_connection((self._host, self._port), self._timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            # idle connections can sit quiet for hours, let the kernel notice a dead peer
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+
+        return sock
+
+    def connect(self):
+        if self.connected:
+            return
+
+        try:
+            self._sock = self._create_socket()
+            self._rfile = self._sock.makefile("rb")
+
+            hello = self._read_line()
+        except (socket.error, IOError) as exp:
+            self.close()
+
+            raise MPDConnectionError("Can't connect to mpd @ {0}:{1}: {2}".format(self._host, self._port, exp))
+
+        if not hello.startswith(HELLO_PREFIX):
+            self.close()
+
+            raise MPDProtocolError("Unexpected greeting from mpd: {0}".format(hello))
+
+        self._version = hello[len(HELLO_PREFIX):]
+        self.last_used = time.time()
+
+        if self._password:
+            self.command("password", self._password)
+
+    def close(self):
+        for resource in (self._rfile, self._sock):
+            try:
+                if resource:
+                    resource.close()
+            except (socket.error, IOError):
+                pass
+
+        self._rfile = None
+        self._sock = None
+
+    def _write(self, text):
+        try:
+            self._sock.sendall(text.encode("utf8"))
+        except (socket.error, IOError) as exp:
+            self.close()
+
+            raise MPDConnectionError("Error writing to mpd: {0}".format(exp))
+
+    def _read_line(self):
+        line = self._rfile.readline()
+
+        if not line:
+            raise MPDConnectionError("Connection to mpd lost")
+
+        return line.decode("utf8").rstrip("\n")
+
+    def _read_response(self, terminators=(SUCCESS,)):
+        """
+        Reads `key: value` pairs until one of the terminators, returns (pairs, terminator)
+        """
+        pairs = []
+
+        while True:
+            try:
+                line = self._read_line()
+            except (socket.error, IOError) as exp:
+                self.close()
+
+                raise MPDConnectionError("Error reading from mpd: {0}".format(exp))
+
+            try:
+                pair = parse_line(line, terminators)
+            except MPDProtocolError:
+                self.close()
+
+                raise
+
+            if pair is None:
+                return (pairs, line)
+
+            pairs.append(pair)
+
+    def _format(self, command, args):
+        return format_command(command, args)
+
+    def command(self, command, *args):
+        """
+        Sends a single command, returns the response as a dict
+        """
+        self.connect()
+        self._write(self._format(command, args))
+        (pairs, _) = self._read_response()
+        self.last_used = time.time()
+
+        return dict(pairs)
+
+    def command_list(self, commands):
+        """
+        Sends all the commands in one round trip, `commands` is a list of (command, args...) tuples,
+        returns one dict per command
+        """
+        self.connect()
+        self._write(format_command_list(commands))
+
+        results = []
+
+        while True:
+            (pairs, terminator) = self._read_response((SUCCESS, NEXT))
+
+            if terminator == SUCCESS:
+                break
+
+            results.append(dict(pairs))
+
+        self.last_used = time.time()
+
+        return results
+
+    def ping(self):
+        self.command("ping")
+
+    def send_idle(self, *subsystems):
+        self.connect()
+        self._write(self._format("idle", subsystems))
+
+    def fetch_idle(self):
+        (pairs, _) = self._read_response()
+        self.last_used = time.time()
+
+        return [value for (key, value) in pairs if key == "changed"]
+
+    def idle(self, *subsystems):
+        """
+        Blocks until one of the subsystems changes, returns the changed ones, [] when interrupted by noidle()
+        """
+        self.send_idle(*subsystems)
+
+        return self.fetch_idle()
+
+    def noidle(self):
+        """
+        Interrupts a pending idle() from another thread
+        """
+        if self.connected:
+            self._write("noidle\n")
+
+    def __enter__(self):
+        self.connect()
+
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+class MPDConnectionPool(object):
+    """
+    Keeps a few idle connections per (mpd_host, mpd_port), so commands skip the connect and greeting.
+    Connections idle for longer than `check_interval` are pinged before they're handed out.
+    """
+    def __init__(self, max_idle=2, timeout=5.0, check_interval=10.0):
+        self._max_idle = max_idle
+        self._timeout = timeout
+        self._check_interval = check_interval
+        self._idle = {}
+        self._lock = threading.Lock()
+
+    def _healthy(self, client):
+        if time.time() - client.last_used < self._check_interval:
+            return True
+
+        try:
+            client.ping()
+
+            return True
+        except MPDError:
+            client.close()
+
+            return False
+
+    def acquire(self, host, port):
+        key = (host, port)
+
+        while True:
+            with self._lock:
+                idle = self._idle.get(key)
+                client = idle.pop() if idle else None
+
+            if client is None:
+                client = MPDClient(host, port, self._timeout)
+                client.connect()
+
+                return client
+
+            if self._healthy(client):
+                return client
+
+    def release(self, client, discard=False):
+        if discard or not client.connected:
+            client.close()
+
+            return
+
+        with self._lock:
+            idle = self._idle.setdefault(client.pool_key, [])
+
+            if len(idle) < self._max_idle:
+                idle.append(client)
+                client = None
+
+        if client:
+            client.close()
+
+    def connection(self, host, port):
+        return _PooledConnection(self, host, port)
+
+    def _retry(self, host, port, callback):
+        # an idle connection may have been dropped by mpd since its last check, retry once on a fresh one
+        for attempt in (0, 1):
+            try:
+                with self.connection(host, port) as client:
+                    return callback(client)
+            except MPDConnectionError:
+                if attempt:
+                    raise
+
+                self.discard(host, port)
+
+    def _run(self, host, port, name, callback):
+        started = monotonic()
+
+        try:
+            return self._retry(host, port, callback)
+        except MPDError:
+            command_errors.inc((name,))
+
+            raise
+        finally:
+            command_seconds.observe(monotonic() - started, (name,))
+
+    def command(self, host, port, command, *args):
+        return self._run(host, port, command, lambda client: client.command(command, *args))
+
+    def command_list(self, host, port, commands):
+        # one label for them all, the commands in them would make a new one for every combination
+        return self._run(host, port, "command_list", lambda client: client.command_list(commands))
+
+    def discard(self, host, port):
+        with self._lock:
+            idle = self._idle.pop((host, port), [])
+
+        for client in idle:
+            client.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, {}
+
+        for clients in idle.values():
+            for client in clients:
+                client.close()
+
+class _PooledConnection(object):
+    def __init__(self, pool, host, port):
+        self._pool = pool
+        self._host = host
+        self._port = port
+        self._client = None
+
+    def __enter__(self):
+        self._client = self._pool.acquire(self._host, self._port)
+
+        return self._client
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # a failed command can leave unread lines on the socket, don't hand it out again
+        self._pool.release(self._client, discard=exc_type is not None and not isinstance(exc_value, MPDCommandError))
+
+command_seconds = registry.histograms("mpd_auto_stop_mpd_command_seconds", "Time taken by commands sent to mpd through the pool, including connecting", ("command",))
+command_errors = registry.counter("mpd_auto_stop_mpd_command_errors_total", "Commands sent to mpd through the pool that failed", ("command",))
+
+pool = MPDConnectionPool()
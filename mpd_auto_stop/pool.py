@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import threading
+try:
+    # python 2
+    import Queue as queue
+except ImportError:
+    # python 3
+    import queue
+from .logger import logger
+
+# exceptions
+class PoolFullError(Exception): pass
+
+class WorkerPool(object):
+    """
+    A fixed number of worker threads fed from a bounded queue, submitting to a full queue fails right away
+    instead of piling up work
+    """
+    def __init__(self, workers, queue_size, name="mpd-auto-stop-worker"):
+        self._workers = workers
+        self._queue = queue.Queue(queue_size)
+        self._name = name
+        self._threads = []
+        self._lock = threading.Lock()
+        self._start()
+
+    @property
+    def workers(self):
+        return self._workers
+
+    @property
+    def queued(self):
+        return self._queue.qsize()
+
+    def _start(self):
+        with self._lock:
+            if self._threads:
+                return
+
+            for index in range(self._workers):
+                thread = threading.Thread(target=self._run, name="{0}-{1}".format(self._name, index))
+                thread.daemon = True
+                thread.start()
+
+                self._threads.append(thread)
+
+    def _run(self):
+        while True:
+            task = self._queue.get()
+
+            if task is None:
+                return
+
+            (function, args) = task
+
+            try:
+                function(*args)
+            except Exception as exp:
+                logger.error("Error running pooled task", pool=self._name, error=exp)
+
+    def submit(self, function, *args):
+        try:
+            self._queue.put_nowait((function, args))
+        except queue.Full:
+            raise PoolFullError("All {0} workers are busy and {1} tasks are queued".format(self._workers, self._queue.maxsize))
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            threads, self._threads = self._threads, []
+
+        # sentinels go in after the queued work, so everything already accepted still runs
+        for _ in threads:
+            self._queue.put(None)
+
+        if wait:
+            for thread in threads:
+                thread.join()
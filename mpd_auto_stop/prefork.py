@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import errno
+import mmap
+import os
+import shutil
+import signal
+import socket
+import struct
+import threading
+import time
+import traceback
+import zlib
+try:
+    import httplib
+except ImportError:
+    import http.client as httplib
+from .metrics import monotonic
+
+class ForwardingError(Exception): pass
+
+class SharedRecord(object):
+    """
+    Up to `size` bytes in an anonymous shared mapping, written by one process and read by the processes it forks.
+    Readers don't lock: a write makes the sequence odd while it's under way and even again once it's done, and
+    carries a checksum, so a reader that saw a write in progress or only part of one reads again.
+    """
+    header = struct.Struct("=QII")
+
+    def __init__(self, size=4096):
+        # anonymous mappings are shared, children forked after this see our writes
+        self._map = mmap.mmap(-1, size)
+        self.capacity = size - self.header.size
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def write(self, data):
+        if len(data) > self.capacity:
+            raise ValueError("{0} bytes don't fit in a {1} byte record".format(len(data), self.capacity))
+
+        with self._lock:
+            self.header.pack_into(self._map, 0, self._sequence + 1, 0, 0)
+            self._map[self.header.size:self.header.size + len(data)] = data
+            self._sequence += 2
+            self.header.pack_into(self._map, 0, self._sequence, len(data), zlib.crc32(data) & 0xffffffff)
+
+    def read(self, since=None):
+        """
+        (sequence, data) of the last complete write, data is None while the sequence is still `since` or nothing
+        was written yet, so a reader that kept what it decoded doesn't copy it again
+        """
+        while True:
+            (sequence, length, checksum) = self.header.unpack_from(self._map, 0)
+
+            if sequence == since or sequence == 0:
+                return (sequence, None)
+
+            if not sequence & 1:
+                data = self._map[self.header.size:self.header.size + length]
+
+                if zlib.crc32(data) & 0xffffffff == checksum and self.header.unpack_from(self._map, 0)[0] == sequence:
+                    return (sequence, data)
+
+            # the writer is a few bytes away from done, let it run
+            time.sleep(0)
+
+    def close(self):
+        self._map.close()
+
+def reuseport_socket(host, port, backlog=128):
+    """
+    A listening TCP socket other processes can bind to the same address too, the kernel spreads connections over them
+    """
+    if not hasattr(socket, "SO_REUSEPORT"):
+        raise ValueError("SO_REUSEPORT isn't supported on this platform")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+    try:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+    except Exception:
+        sock.close()
+        raise
+
+    return sock
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+        self.unix_path = path
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+
+        try:
+            sock.connect(self.unix_path)
+        except Exception:
+            sock.close()
+            raise
+
+        self.sock = sock
+
+class Forwarder(object):
+    """
+    Sends requests on to the server listening on the unix socket at `path`, over one keep-alive connection per thread
+    """
+    def __init__(self, path, timeout=30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _closed_by_server(self, exp):
+        # RemoteDisconnected is a BadStatusLine too, python 2 raises that for an empty status line
+        return isinstance(exp, httplib.BadStatusLine) or getattr(exp, "errno", None) in (errno.EPIPE, errno.ECONNRESET)
+
+    def request(self, method, url, body=None, headers=None):
+        """
+        The response, read it before this thread's next request. A kept alive connection the server closed while it
+        was idle never got the request, it's sent again on a new one.
+        """
+        connection = getattr(self._local, "connection", None)
+
+        if connection is None:
+            connection = self._local.connection = UnixHTTPConnection(self.path, self.timeout)
+
+        reused = connection.sock is not None
+
+        try:
+            connection.request(method, url, body, headers or {})
+
+            return connection.getresponse()
+        except (socket.error, httplib.HTTPException) as exp:
+            self.discard()
+
+            if reused and self._closed_by_server(exp):
+                return self.request(method, url, body, headers)
+
+            raise ForwardingError("Can't forward to {0}: {1}".format(self.path, exp))
+
+    def open(self, method, url, body=None, headers=None):
+        """
+        The response on a connection of its own without a timeout, for streams, close it when done
+        """
+        connection = UnixHTTPConnection(self.path)
+
+        try:
+            connection.request(method, url, body, headers or {})
+
+            return connection.getresponse()
+        except (socket.error, httplib.HTTPException) as exp:
+            connection.close()
+
+            raise ForwardingError("Can't forward to {0}: {1}".format(self.path, exp))
+
+    def discard(self):
+        connection = getattr(self._local, "connection", None)
+        self._local.connection = None
+
+        if connection is not None:
+            connection.close()
+
+def watch_parent(fd, callback):
+    """
+    Calls `callback` once the process holding the write end of the pipe `fd` reads from is gone
+    """
+    def wait():
+        try:
+            while os.read(fd, 1):
+                pass
+        except OSError:
+            pass
+
+        callback()
+
+    thread = threading.Thread(target=wait, name="mpd-auto-stop-parent-watch")
+    thread.daemon = True
+    thread.start()
+
+    return thread
+
+class WorkerProcesses(object):
+    """
+    Forks `count` processes, each running `target(index, parent_fd)` and exiting with what it returns. `parent_fd` is
+    the read end of a pipe only we write to, see watch_parent, so they go away with us even when we're killed.
+
+    A worker that dies isn't replaced, forking again from a process running threads isn't safe. Once they're all
+    stopped `remove_on_stop` paths are removed, like sockets the workers were listening on.
+    """
+    def __init__(self, count, target, on_exit=None):
+        self.count = count
+        self._target = target
+        self._on_exit = on_exit
+        self.pids = {}
+        self.remove_on_stop = []
+        self._pipe = None
+        self._waiters = []
+        self._stopping = False
+
+    def __len__(self):
+        return len(self.pids)
+
+    def _run_child(self, index, read_fd, write_fd):
+        code = 1
+
+        try:
+            os.close(write_fd)
+            code = self._target(index, read_fd) or 0
+        except SystemExit as exp:
+            code = exp.code if isinstance(exp.code, int) else 1
+        except BaseException:
+            traceback.print_exc()
+        finally:
+            # the parent's atexit handlers and buffers aren't ours to run
+            os._exit(code)
+
+    def _wait(self, pid, index):
+        (_, status) = os.waitpid(pid, 0)
+        self.pids.pop(pid, None)
+
+        if self._on_exit and not self._stopping:
+            self._on_exit(index, pid, status)
+
+    def start(self):
+        if not hasattr(os, "fork"):
+            raise ValueError("Worker processes need os.fork, it isn't there on this platform")
+
+        (read_fd, write_fd) = os.pipe()
+
+        for index in range(self.count):
+            pid = os.fork()
+
+            if pid == 0:
+                self._run_child(index, read_fd, write_fd)
+
+            self.pids[pid] = index
+
+        os.close(read_fd)
+        self._pipe = write_fd
+
+        for (pid, index) in list(self.pids.items()):
+            waiter = threading.Thread(target=self._wait, args=(pid, index), name="mpd-auto-stop-worker-{0}".format(index))
+            waiter.daemon = True
+            waiter.start()
+            self._waiters.append(waiter)
+
+    def stop(self, timeout=5.0):
+        """
+        SIGTERMs the workers, SIGKILLs the ones still there after `timeout`
+        """
+        self._stopping = True
+        deadline = monotonic() + timeout
+
+        for sig in (signal.SIGTERM, signal.SIGKILL):
+            for pid in list(self.pids):
+                try:
+                    os.kill(pid, sig)
+                except OSError:
+                    pass
+
+            for waiter in self._waiters:
+                waiter.join(max(deadline - monotonic(), 0))
+
+            if not self.pids:
+                break
+
+            deadline = monotonic() + 1.0
+
+        if self._pipe is not None:
+            os.close(self._pipe)
+            self._pipe = None
+
+        for path in self.remove_on_stop:
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            elif os.path.exists(path):
+                os.unlink(path)
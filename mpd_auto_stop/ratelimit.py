@@ -0,0 +1,74 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import collections
+import threading
+from .metrics import monotonic
+
+class TokenBucket(object):
+    """
+    Holds up to `burst` tokens, refilled at `rate` a second, every request takes one
+    """
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, tokens, updated):
+        self.tokens = tokens
+        self.updated = updated
+
+    def take(self, rate, burst, now):
+        """
+        0 when a token was taken, otherwise the seconds until there's one
+        """
+        self.tokens = min(burst, self.tokens + (now - self.updated) * rate)
+        self.updated = now
+
+        if self.tokens >= 1:
+            self.tokens -= 1
+
+            return 0
+
+        return (1 - self.tokens) / rate
+
+class RateLimiter(object):
+    """
+    A token bucket per client, `rate` requests a second with bursts of up to `burst`, 0 lets everything through.
+    Only the `max_clients` most recently seen clients keep a bucket, the least recently seen one goes first, so a
+    flood of addresses costs bounded memory. An evicted client comes back with a full bucket.
+    """
+    def __init__(self, rate=0.0, burst=1, max_clients=1024, clock=monotonic):
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_clients = max_clients
+        self._clock = clock
+        self._buckets = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def acquire(self, client):
+        """
+        0 when `client` may go ahead, otherwise the seconds it should wait
+        """
+        if not self.rate:
+            return 0
+
+        now = self._clock()
+
+        with self._lock:
+            # popped and put back, it's the most recently used now, move_to_end isn't there on python 2
+            bucket = self._buckets.pop(client, None)
+
+            if bucket is None:
+                bucket = TokenBucket(self.burst, now)
+
+                while len(self._buckets) >= self.max_clients:
+                    self._buckets.popitem(last=False)
+
+            self._buckets[client] = bucket
+
+            return bucket.take(self.rate, self.burst, now)
+
+    def clear(self):
+        with self._lock:
+            self._buckets.clear()
@@ -0,0 +1,154 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import heapq
+import itertools
+import threading
+import time
+from .logger import logger
+from .pool import WorkerPool, PoolFullError
+
+monotonic = getattr(time, "monotonic", time.time)
+
+class ScheduledCall(object):
+    """
+    A handle for a callback sitting in the scheduler's heap, cancelling only marks it, the dispatcher skips it later
+    """
+    __slots__ = ("deadline", "callback", "args", "cancelled", "_scheduler")
+
+    def __init__(self, scheduler, deadline, callback, args):
+        self.deadline = deadline
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._scheduler = scheduler
+
+    def cancel(self):
+        if not self.cancelled:
+            self.cancelled = True
+            self._scheduler._cancelled()
+
+class Scheduler(object):
+    """
+    Runs any number of timed callbacks off a min-heap of deadlines with a single dispatcher thread.
+    Scheduling is O(log n), cancelling is O(1), the heap is rebuilt once most of it is cancelled entries.
+
+    With `workers` the dispatcher only hands due callbacks to a pool of that many threads, so one that blocks, like a
+    pause waiting on an unreachable mpd, doesn't hold up the others. Without, callbacks run on the dispatcher in
+    deadline order.
+    """
+    def __init__(self, clock=monotonic, workers=0, queue_size=256):
+        self._clock = clock
+        self.workers = workers
+        self._queue_size = queue_size
+        self._pool = None
+        self._heap = []
+        self._counter = itertools.count()
+        self._cancelled_count = 0
+        self._condition = threading.Condition(threading.Lock())
+        self._thread = None
+        self._stopped = False
+
+    @property
+    def pending(self):
+        return len(self._heap) - self._cancelled_count
+
+    def time(self):
+        return self._clock()
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name="mpd-auto-stop-scheduler")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def call_at(self, deadline, callback, *args):
+        call = ScheduledCall(self, deadline, callback, args)
+
+        with self._condition:
+            heapq.heappush(self._heap, (deadline, next(self._counter), call))
+            self._ensure_thread()
+
+            # only the earliest deadline changes how long the dispatcher sleeps
+            if self._heap[0][2] is call:
+                self._condition.notify()
+
+        return call
+
+    def call_later(self, delay, callback, *args):
+        return self.call_at(self._clock() + delay, callback, *args)
+
+    def _cancelled(self):
+        with self._condition:
+            self._cancelled_count += 1
+
+            if self._cancelled_count > 64 and self._cancelled_count * 2 > len(self._heap):
+                self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+                heapq.heapify(self._heap)
+                self._cancelled_count = 0
+
+    def _next_due(self):
+        """
+        Blocks until a callback is due, returns None once the scheduler is stopped
+        """
+        with self._condition:
+            while not self._stopped:
+                while self._heap and self._heap[0][2].cancelled:
+                    heapq.heappop(self._heap)
+                    self._cancelled_count -= 1
+
+                if not self._heap:
+                    self._condition.wait()
+                    continue
+
+                delay = self._heap[0][0] - self._clock()
+
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+
+                (_, _, call) = heapq.heappop(self._heap)
+                # marked so a late cancel() doesn't count an entry that's already out of the heap
+                call.cancelled = True
+
+                return call
+
+    def _call(self, call):
+        try:
+            call.callback(*call.args)
+        except Exception as exp:
+            logger.error("Error running scheduled call", error=exp)
+
+    def _dispatch(self, call):
+        if not self.workers:
+            return self._call(call)
+
+        if self._pool is None:
+            self._pool = WorkerPool(self.workers, self._queue_size, "mpd-auto-stop-scheduled")
+
+        try:
+            self._pool.submit(self._call, call)
+        except PoolFullError:
+            # late rather than lost
+            self._call(call)
+
+    def _run(self):
+        while True:
+            call = self._next_due()
+
+            if call is None:
+                return
+
+            self._dispatch(call)
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+        if self._pool is not None:
+            self._pool.shutdown(wait=False)
+            self._pool = None
+
+scheduler = Scheduler(workers=8)
@@ -0,0 +1,378 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import datetime
+import io
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from .logger import logger
+
+# time parsing
+DURATION_PATTERN = re.compile("^(?:([0-9]*\\.?[0-9]+)h)?(?:([0-9]*\\.?[0-9]+)m)?(?:([0-9]*\\.?[0-9]+)s)?$")
+
+def parse_duration(duration):
+    """
+    Seconds in a duration like `30m`, `1.5h` or a compound one like `1h30m` or `2m30s`, units in that order
+    """
+    duration = str(duration or "").strip().lower()
+    match = DURATION_PATTERN.match(duration)
+
+    if not duration or not match:
+        raise ValueError("Invalid duration: " + duration)
+
+    (hours, minutes, seconds) = (float(group or 0) for group in match.groups())
+
+    return hours * 60 * 60 + minutes * 60 + seconds
+
+def parse_clock(text):
+    """
+    (hour, minute) of `HH:MM`
+    """
+    match = re.match("^([0-9]{1,2}):([0-9]{2})$", str(text or "").strip())
+
+    if not match or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ValueError("Invalid time of day: {0}".format(text))
+
+    return (int(match.group(1)), int(match.group(2)))
+
+# cron
+DAY_NAMES = ("sun", "mon", "tue", "wed", "thu", "fri", "sat")
+MONTH_NAMES = ("jan", "feb", "mar", "apr", "may", "jun", "jul", "aug", "sep", "oct", "nov", "dec")
+
+class CronRule(object):
+    """
+    A `minute hour day-of-month month day-of-week` rule with `*`, lists, ranges, steps and day and month names.
+    Like cron, a rule restricting both days of month and of week matches a day when either matches.
+    """
+    fields = (
+        ("minute", 0, 59, ()),
+        ("hour", 0, 23, ()),
+        ("day of month", 1, 31, ()),
+        ("month", 1, 12, MONTH_NAMES),
+        ("day of week", 0, 7, DAY_NAMES)
+    )
+
+    def __init__(self, expression):
+        parts = str(expression or "").split()
+
+        if len(parts) != 5:
+            raise ValueError("Invalid cron rule, expected 5 fields: {0}".format(expression))
+
+        self.expression = " ".join(parts)
+        (self.minutes, self.hours, self.days, self.months, self.weekdays) = [self._parse_field(part, *field) for (part, field) in zip(parts, self.fields)]
+        # 7 is sunday too
+        self.weekdays = set(day % 7 for day in self.weekdays)
+        self.any_day = parts[2] == "*"
+        self.any_weekday = parts[4] == "*"
+        self._sorted_minutes = sorted(self.minutes)
+        self._sorted_hours = sorted(self.hours)
+
+    def _parse_value(self, text, name, low, high, names):
+        text = text.lower()
+
+        if text in names:
+            return names.index(text) + (1 if names is MONTH_NAMES else 0)
+
+        if not text.isdigit() or not low <= int(text) <= high:
+            raise ValueError("Invalid {0} in cron rule: {1}".format(name, text))
+
+        return int(text)
+
+    def _parse_field(self, text, name, low, high, names):
+        values = set()
+
+        for item in text.split(","):
+            (span, _, step) = item.partition("/")
+
+            if step and (not step.isdigit() or int(step) == 0):
+                raise ValueError("Invalid step in cron rule: {0}".format(item))
+
+            if span == "*":
+                (start, end) = (low, high)
+            elif "-" in span:
+                (start, end) = [self._parse_value(value, name, low, high, names) for value in span.split("-", 1)]
+            else:
+                start = self._parse_value(span, name, low, high, names)
+                end = high if step else start
+
+            if start > end:
+                raise ValueError("Invalid range in cron rule: {0}".format(item))
+
+            values.update(range(start, end + 1, int(step or 1)))
+
+        return values
+
+    def _matches_day(self, day):
+        if day.month not in self.months:
+            return False
+
+        # isoweekday is 1 for monday to 7 for sunday
+        in_days = day.day in self.days
+        in_weekdays = day.isoweekday() % 7 in self.weekdays
+
+        if self.any_day or self.any_weekday:
+            return in_days and in_weekdays
+
+        return in_days or in_weekdays
+
+    def next_after(self, moment):
+        """
+        The first matching minute strictly after `moment`, a naive local datetime, None if there's none in 8 years
+        """
+        start = moment.replace(second=0, microsecond=0) + datetime.timedelta(minutes=1)
+        day = start.date()
+
+        # 8 years covers any rule that only matches on a 29th of february
+        for _ in range(366 * 8):
+            if self._matches_day(day):
+                for hour in self._sorted_hours:
+                    if day == start.date() and hour < start.hour:
+                        continue
+
+                    for minute in self._sorted_minutes:
+                        candidate = datetime.datetime(day.year, day.month, day.day, hour, minute)
+
+                        if candidate >= start:
+                            return candidate
+
+            day = day + datetime.timedelta(days=1)
+
+        return None
+
+# schedules
+class ScheduleNotFoundError(Exception): pass
+
+class Schedule(object):
+    """
+    Pauses mpd, or a fleet `target`, at an absolute time (`at`) or on every match of a cron rule (`cron`), fading
+    out over `fade` before.
+    A one off `at` may be just `HH:MM`, meaning its next occurrence, `at` with `days` is a shorthand for a cron rule.
+    """
+    id_pattern = re.compile("^[-_0-9a-zA-Z]{1,64}$")
+
+    def __init__(self, id, cron=None, at=None, fade=None, target=None):
+        self.id = id
+        self.target = target
+        self.rule = CronRule(cron) if cron else None
+        self.at = at
+        self.fade = fade
+        self.fade_seconds = parse_duration(fade) if fade else 0
+        self.next_fire = None
+        self.call = None
+
+    @property
+    def timer_name(self):
+        return "schedule-{0}".format(self.id)
+
+    @classmethod
+    def from_dict(cls, data, id=None, now=None):
+        if not isinstance(data, dict):
+            raise ValueError("Expected a JSON object")
+
+        id = id or data.get("id") or uuid.uuid4().hex[:8]
+
+        if not cls.id_pattern.match(str(id)):
+            raise ValueError("Invalid schedule id: {0}".format(id))
+
+        cron = data.get("cron")
+        at = data.get("at")
+        days = data.get("days")
+
+        if bool(cron) == bool(at):
+            raise ValueError("A schedule needs exactly one of cron or at")
+
+        if at and days:
+            (hour, minute) = parse_clock(at)
+            cron = "{0} {1} * * {2}".format(minute, hour, days)
+            at = None
+        elif at:
+            at = cls._parse_at(at, now or datetime.datetime.now()).strftime("%Y-%m-%dT%H:%M:%S")
+
+        return cls(id, cron=cron, at=at, fade=data.get("fade"), target=data.get("target"))
+
+    @staticmethod
+    def _parse_at(text, now):
+        try:
+            (hour, minute) = parse_clock(text)
+        except ValueError:
+            for format in ("%Y-%m-%dT%H:%M:%S", "%Y-%m-%dT%H:%M", "%Y-%m-%d %H:%M"):
+                try:
+                    return datetime.datetime.strptime(text, format)
+                except (TypeError, ValueError):
+                    pass
+
+            raise ValueError("Invalid at, expected HH:MM or YYYY-MM-DDTHH:MM[:SS]: {0}".format(text))
+
+        moment = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+
+        # "at 01:00" late in the evening means tonight
+        return moment if moment > now else moment + datetime.timedelta(days=1)
+
+    def next_after(self, moment):
+        if self.rule:
+            return self.rule.next_after(moment)
+
+        at = datetime.datetime.strptime(self.at, "%Y-%m-%dT%H:%M:%S")
+
+        return at if at > moment else None
+
+    def to_dict(self):
+        result = {
+            "id": self.id,
+            "fade": self.fade,
+            "target": self.target,
+            "next_fire": self.next_fire.strftime("%Y-%m-%dT%H:%M:%S") if self.next_fire else None
+        }
+
+        if self.rule:
+            result["cron"] = self.rule.expression
+        else:
+            result["at"] = self.at
+
+        return result
+
+def timestamp(moment):
+    return time.mktime(moment.timetuple())
+
+class ScheduleBook(object):
+    """
+    Keeps schedules and their next fire in the scheduler, one entry per schedule, so firing costs a heap push
+    however many there are. `on_fire(schedule, at)` is called `fade` seconds ahead of `at`, a wall clock timestamp.
+
+    With a `path` every change is written to it as a JSON array, replaced atomically.
+    """
+    def __init__(self, scheduler, on_fire, path=None):
+        self._scheduler = scheduler
+        self._on_fire = on_fire
+        self._schedules = {}
+        self._lock = threading.RLock()
+        self.path = path
+
+    def __len__(self):
+        return len(self._schedules)
+
+    def load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+
+        with io.open(self.path, "r", encoding="utf8") as fd:
+            items = json.load(fd)
+
+        with self._lock:
+            for item in items:
+                schedule = Schedule(item["id"], item.get("cron"), item.get("at"), item.get("fade"), item.get("target"))
+
+                # a one off missed while we were down is dropped, not fired hours late
+                if self._arm(schedule):
+                    self._schedules[schedule.id] = schedule
+                else:
+                    logger.info("Schedule has no fire time left, dropping it", schedule=schedule.id)
+
+            self._save()
+
+    def _save(self):
+        if not self.path:
+            return
+
+        temp_path = self.path + ".tmp"
+        items = [self._schedules[id].to_dict() for id in sorted(self._schedules)]
+
+        with io.open(temp_path, "w", encoding="utf8") as fd:
+            fd.write(u"" + json.dumps(items, indent=2))
+            fd.flush()
+            os.fsync(fd.fileno())
+
+        os.rename(temp_path, self.path)
+
+    def _arm(self, schedule, after=None):
+        if schedule.call:
+            schedule.call.cancel()
+            schedule.call = None
+
+        now = datetime.datetime.now()
+        # fire late enough that the fade still fits before the next match
+        schedule.next_fire = schedule.next_after(max(after or now, now + datetime.timedelta(seconds=schedule.fade_seconds)))
+
+        if schedule.next_fire is None:
+            return False
+
+        # from wall clock to the scheduler's monotonic clock, re-done on every fire so clock changes catch up
+        delay = timestamp(schedule.next_fire) - schedule.fade_seconds - time.time()
+        schedule.call = self._scheduler.call_at(self._scheduler.time() + max(delay, 0), self._fire, schedule)
+
+        return True
+
+    def _fire(self, schedule):
+        at = schedule.next_fire
+
+        with self._lock:
+            if self._schedules.get(schedule.id) is not schedule:
+                return
+
+            if not self._arm(schedule, at):
+                del self._schedules[schedule.id]
+                self._save()
+
+        try:
+            self._on_fire(schedule, timestamp(at))
+        except Exception as exp:
+            logger.error("Error firing schedule", schedule=schedule.id, error=exp)
+
+    def list(self):
+        with self._lock:
+            return [self._schedules[id].to_dict() for id in sorted(self._schedules)]
+
+    def get(self, id):
+        with self._lock:
+            schedule = self._schedules.get(id)
+
+            if schedule is None:
+                raise ScheduleNotFoundError("No schedule {0}".format(id))
+
+            return schedule.to_dict()
+
+    def put(self, data, id=None):
+        """
+        Adds a schedule or replaces the one with the same id, returns it
+        """
+        schedule = Schedule.from_dict(data, id)
+
+        with self._lock:
+            if not self._arm(schedule):
+                raise ValueError("Schedule never fires")
+
+            previous = self._schedules.get(schedule.id)
+
+            if previous and previous.call:
+                previous.call.cancel()
+
+            self._schedules[schedule.id] = schedule
+            self._save()
+
+            return schedule.to_dict()
+
+    def remove(self, id):
+        with self._lock:
+            schedule = self._schedules.pop(id, None)
+
+            if schedule is None:
+                raise ScheduleNotFoundError("No schedule {0}".format(id))
+
+            if schedule.call:
+                schedule.call.cancel()
+
+            self._save()
+
+        return {}
+
+    def clear(self):
+        with self._lock:
+            for schedule in self._schedules.values():
+                if schedule.call:
+                    schedule.call.cancel()
+
+            self._schedules = {}
@@ -0,0 +1,57 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import os
+import socket
+try:
+    import fcntl
+except ImportError:
+    # windows, never socket activated
+    fcntl = None
+
+# the first file descriptor systemd passes, after stdin, stdout and stderr
+LISTEN_FDS_START = 3
+
+def listen_fds(unset_environment=True):
+    """
+    File descriptors systemd passed us with socket activation, like sd_listen_fds, empty when there are none or they
+    were meant for another process. The variables are unset so commands we run don't think they're activated too.
+    """
+    try:
+        pid = int(os.environ.get("LISTEN_PID", ""))
+        count = int(os.environ.get("LISTEN_FDS", ""))
+    except ValueError:
+        return []
+    finally:
+        if unset_environment:
+            for name in ("LISTEN_PID", "LISTEN_FDS", "LISTEN_FDNAMES"):
+                os.environ.pop(name, None)
+
+    if pid != os.getpid() or count <= 0:
+        return []
+
+    fds = list(range(LISTEN_FDS_START, LISTEN_FDS_START + count))
+
+    for fd in fds:
+        # they're ours alone, mpc shouldn't inherit them
+        if fcntl:
+            fcntl.fcntl(fd, fcntl.F_SETFD, fcntl.fcntl(fd, fcntl.F_GETFD) | fcntl.FD_CLOEXEC)
+
+    return fds
+
+def listen_sockets(unset_environment=True):
+    """
+    listen_fds as listening socket objects
+    """
+    sockets = []
+
+    for fd in listen_fds(unset_environment):
+        try:
+            # python 3 finds out the family and type itself, and takes the descriptor over instead of duplicating it
+            sockets.append(socket.socket(fileno=fd))
+        except TypeError:
+            # python 2 duplicates it, the family only matters for the address format
+            sockets.append(socket.fromfd(fd, socket.AF_INET, socket.SOCK_STREAM))
+            os.close(fd)
+
+    return sockets
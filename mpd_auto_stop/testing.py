@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+
+"""
+Helpers shared by the tests and the benchmarks.
+"""
+
+import socket
+
+def free_port():
+    """
+    A TCP port nothing listens on right now, on localhost
+    """
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+
+    return port
+
+def percentile(values, fraction):
+    """
+    The value `fraction` of the way through the sorted values, None without any
+    """
+    if not values:
+        return None
+
+    values = sorted(values)
+
+    return values[min(len(values) - 1, int(len(values) * fraction))]
@@ -5,7 +5,33 @@ import threading
 import datetime
 import unittest
 import time
+import json
+import socket
+import shutil
+import tempfile
+import os
+import zlib
+import cProfile
+import signal
+import subprocess
+import sys
+try:
+  import httplib
+except ImportError:
+  import http.client as httplib
+try:
+  # python 2, takes native str, io.StringIO only unicode
+  from StringIO import StringIO
+except ImportError:
+  from io import StringIO
+try:
+  import asyncio
+except ImportError:
+  # python 2
+  asyncio = None
 import mpd_auto_stop as mas
+from mpd_auto_stop.fakempd import FakeMPD
+from mpd_auto_stop.testing import free_port
 
 class ArgparseTest(unittest.TestCase):
   def test_with_valid_host(self):
@@ -118,6 +144,24 @@ class ArgparseTest(unittest.TestCase):
     with self.assertRaises(SystemExit):
       args = mas.parse_args(args)
 
+  def test_with_unix_socket_mode(self):
+    args = mas.parse_args(["--unix-socket", "/run/mpd-auto-stop.sock", "--unix-socket-mode", "600"])
+
+    self.assertEqual(args.unix_socket_mode, 0o600)
+
+    with self.assertRaises(SystemExit):
+      mas.parse_args(["--unix-socket-mode", "u+rw"])
+
+  def test_with_no_tcp_and_no_unix_socket(self):
+    with self.assertRaises(SystemExit):
+      mas.parse_args(["--no-tcp"])
+
+  def test_timer_workers(self):
+    self.assertEqual(mas.parse_args([]).timer_workers, 8)
+
+    with self.assertRaises(SystemExit):
+      mas.parse_args(["--timer-workers", "-1"])
+
 class UtilsTest(unittest.TestCase):
   def test_xstr_with_empty_text(self):
     self.assertEqual(mas.xstr(""), "")
@@ -194,6 +238,13 @@ class TestTimer(unittest.TestCase):
     with self.assertRaises(ValueError):
       self.timer._parse_duration(duration)
 
+  def test_parse_duration_with_compound_duration(self):
+    self.assertEqual(self.timer._parse_duration("1h30m"), 5400.0)
+    self.assertEqual(self.timer._parse_duration("2m30s"), 150.0)
+
+    with self.assertRaises(ValueError):
+      self.timer._parse_duration("30m1h")
+
   def test_stop_timer_with_non_empty_timer(self):
     self.timer._stop_timer()
     
@@ -259,5 +310,2331 @@ class TestTimer(unittest.TestCase):
     with self.assertRaises(mas.InvalidTimerStateError):
       self.timer.extend("100s")
 
+class TestMPDClient(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.client = mas.MPDClient("127.0.0.1", self.mpd.port)
+
+  def tearDown(self):
+    self.client.close()
+    self.mpd.close()
+
+  def test_parse_line(self):
+    self.assertEqual(mas.mpd.parse_line("volume: 50", ("OK",)), ("volume", "50"))
+    self.assertEqual(mas.mpd.parse_line("title: a: b", ("OK",)), ("title", "a: b"))
+    self.assertIsNone(mas.mpd.parse_line("list_OK", ("OK", "list_OK")))
+
+    with self.assertRaises(mas.MPDCommandError):
+      mas.mpd.parse_line("ACK [50@0] {play} song doesn't exist", ("OK",))
+
+    with self.assertRaises(mas.MPDProtocolError):
+      mas.mpd.parse_line("garbage", ("OK",))
+
+  def test_connect_reads_greeting(self):
+    self.client.connect()
+
+    self.assertEqual(self.client.version, "0.21.0")
+
+  def test_command_with_response(self):
+    result = self.client.command("status")
+
+    self.assertEqual(result, {"volume": "50", "state": "play"})
+
+  def test_command_quotes_arguments(self):
+    self.client.command("pause", 1)
+
+    self.assertEqual(self.mpd.received[-1], 'pause "1"')
+
+  def test_command_with_ack(self):
+    self.mpd.fail.add("pause")
+
+    with self.assertRaises(mas.MPDCommandError) as context:
+      self.client.command("pause", 1)
+
+    self.assertEqual(context.exception.code, 5)
+    self.assertEqual(context.exception.command, "pause")
+    self.assertEqual(context.exception.message, 'unknown command "pause"')
+
+  def test_command_list(self):
+    results = self.client.command_list([("status",), ("setvol", 10)])
+
+    self.assertEqual(results, [{"volume": "50", "state": "play"}, {}])
+    self.assertEqual(self.mpd.received[-4:], ["command_list_ok_begin", "status", 'setvol "10"', "command_list_end"])
+
+  def test_connect_with_no_server(self):
+    self.mpd.close()
+
+    with self.assertRaises(mas.MPDConnectionError):
+      mas.MPDClient("127.0.0.1", self.mpd.port, timeout=1).connect()
+
+class TestMPDConnectionPool(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.pool = mas.MPDConnectionPool()
+
+  def tearDown(self):
+    self.pool.clear()
+    self.mpd.close()
+
+  def test_connection_is_reused(self):
+    self.pool.command("127.0.0.1", self.mpd.port, "ping")
+    self.pool.command("127.0.0.1", self.mpd.port, "ping")
+
+    self.assertEqual(self.mpd.connections, 1)
+
+  def test_connection_is_reused_after_ack(self):
+    self.mpd.fail.add("pause")
+
+    with self.assertRaises(mas.MPDCommandError):
+      self.pool.command("127.0.0.1", self.mpd.port, "pause", 1)
+
+    self.pool.command("127.0.0.1", self.mpd.port, "ping")
+
+    self.assertEqual(self.mpd.connections, 1)
+
+  def test_stale_connection_is_replaced(self):
+    with self.pool.connection("127.0.0.1", self.mpd.port) as client:
+      client.ping()
+
+    # simulate mpd dropping the idle connection
+    client._sock.shutdown(socket.SHUT_RDWR)
+
+    self.pool.command("127.0.0.1", self.mpd.port, "ping")
+
+    self.assertEqual(self.mpd.connections, 2)
+
+  def test_command_list_metric_label(self):
+    self.pool.command_list("127.0.0.1", self.mpd.port, [("setvol", 10), ("pause", 1)])
+    labels = [values for (values, _) in mas.mpd.command_seconds.samples()]
+
+    self.assertIn(("command_list",), labels)
+    self.assertNotIn(("setvol,pause",), labels)
+
+class TestTimerPause(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.timer = mas.Timer()
+    self.timer.mpd_host = "127.0.0.1"
+    self.timer.mpd_port = self.mpd.port
+
+  def tearDown(self):
+    self.mpd.close()
+
+  def test_worker_pauses_over_protocol(self):
+    self.timer.start("100s")
+    self.timer._worker()
+
+    self.assertIn('pause "1"', self.mpd.received)
+    self.assertEqual(self.timer.status, "stopped")
+
+  def test_worker_skips_pause_when_not_playing(self):
+    watcher = mas.PlayerWatcher("127.0.0.1", self.mpd.port)
+    watcher.state = {"state": "pause", "volume": 50}
+    mas.app.player_watcher = watcher
+
+    try:
+      self.timer.start("100s")
+      self.assertEqual(self.timer.get_status()["player_state"], "pause")
+      self.timer._worker()
+    finally:
+      mas.app.player_watcher = None
+
+    self.assertNotIn('pause "1"', self.mpd.received)
+    self.assertEqual(self.timer.status, "stopped")
+
+class TestScheduler(unittest.TestCase):
+  def setUp(self):
+    self.scheduler = mas.Scheduler()
+    self.fired = []
+    self.event = threading.Event()
+
+  def tearDown(self):
+    self.scheduler.stop()
+
+  def _callback(self, value, last=False):
+    self.fired.append(value)
+
+    if last:
+      self.event.set()
+
+  def test_calls_fire_in_deadline_order(self):
+    self.scheduler.call_later(0.2, self._callback, 3, True)
+    self.scheduler.call_later(0.1, self._callback, 2)
+    self.scheduler.call_later(0.05, self._callback, 1)
+
+    self.assertTrue(self.event.wait(2))
+    self.assertEqual(self.fired, [1, 2, 3])
+
+  def test_cancelled_call_does_not_fire(self):
+    call = self.scheduler.call_later(0.05, self._callback, 1)
+    self.scheduler.call_later(0.1, self._callback, 2, True)
+    call.cancel()
+
+    self.assertTrue(self.event.wait(2))
+    self.assertEqual(self.fired, [2])
+
+  def test_cancelled_calls_are_compacted(self):
+    calls = [self.scheduler.call_later(1000 + index, self._callback, index) for index in range(1000)]
+
+    for call in calls[:900]:
+      call.cancel()
+
+    self.assertEqual(self.scheduler.pending, 100)
+    self.assertTrue(len(self.scheduler._heap) < 1000)
+
+  def test_blocked_call_does_not_delay_others(self):
+    scheduler = mas.Scheduler(workers=2)
+    release = threading.Event()
+
+    try:
+      scheduler.call_later(0.05, release.wait, 5)
+      started = time.time()
+      scheduler.call_later(0.1, self._callback, 1, True)
+
+      self.assertTrue(self.event.wait(2))
+      self.assertTrue(time.time() - started < 1.0)
+    finally:
+      release.set()
+      scheduler.stop()
+
+class TestTimerDispatch(unittest.TestCase):
+  def setUp(self):
+    self.slow = FakeMPD(latency=1.5)
+    self.fast = FakeMPD()
+    self.scheduler = mas.Scheduler(workers=2)
+
+  def tearDown(self):
+    self.scheduler.stop()
+    self.slow.close()
+    self.fast.close()
+
+  def _timer(self, mpd):
+    timer = mas.Timer(scheduler=self.scheduler)
+    timer.mpd_host = "127.0.0.1"
+    timer.mpd_port = mpd.port
+
+    return timer
+
+  def test_slow_pause_does_not_delay_other_timers(self):
+    started = time.time()
+    self._timer(self.slow).start("0.05s")
+    self._timer(self.fast).start("0.3s")
+
+    for _ in range(200):
+      if self.fast.paused_at:
+        break
+
+      time.sleep(0.01)
+
+    self.assertTrue(self.fast.paused_at)
+    self.assertTrue(time.time() - started < 1.0, time.time() - started)
+
+class TestFade(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.timer = mas.Timer()
+    self.timer.mpd_host = "127.0.0.1"
+    self.timer.mpd_port = self.mpd.port
+
+  def tearDown(self):
+    self.timer.stop()
+    self.mpd.close()
+
+  def _wait_for(self, line, timeout=5):
+    for _ in range(int(timeout * 100)):
+      if line in self.mpd.received:
+        return True
+
+      time.sleep(0.01)
+
+    return False
+
+  def test_fade_steps_then_pauses_and_restores(self):
+    self.timer.start("1s", "1s")
+
+    self.assertTrue(self._wait_for('pause "1"'))
+
+    # the rest of the command list may still be on its way
+    for _ in range(100):
+      if self.mpd.received[-1] == "command_list_end":
+        break
+
+      time.sleep(0.01)
+
+    volumes = [int(line.split('"')[1]) for line in self.mpd.received if line.startswith("setvol")]
+
+    self.assertTrue(volumes[0] < 50, volumes)
+
+    tail = self.mpd.received[-4:]
+
+    self.assertEqual(tail, ["command_list_ok_begin", 'pause "1"', 'setvol "50"', "command_list_end"])
+
+  def test_stop_during_fade_restores_volume(self):
+    self.timer.start("10s", "10s")
+
+    for _ in range(200):
+      if any(line.startswith("setvol") for line in self.mpd.received):
+        break
+
+      time.sleep(0.01)
+
+    self.timer.stop()
+
+    self.assertEqual(self.mpd.received[-1], 'setvol "50"')
+    self.assertNotIn('pause "1"', self.mpd.received)
+
+  def test_slow_restore_does_not_hold_the_timer(self):
+    self.mpd.latency = 0.5
+    self.timer.start("10s", "10s")
+    fader = list(self.timer._faders.values())[0]
+
+    for _ in range(300):
+      if fader.original_volume:
+        break
+
+      time.sleep(0.01)
+
+    stopping = threading.Thread(target=self.timer.stop)
+    stopping.start()
+    time.sleep(0.1)
+
+    # the restore is still waiting on mpd, the timer isn't
+    started = time.time()
+    self.timer.start("100s")
+
+    self.assertTrue(time.time() - started < 0.3, time.time() - started)
+
+    stopping.join(5)
+
+    self.assertEqual(self.mpd.received[-1], 'setvol "50"')
+
+  def test_fade_is_capped_by_duration(self):
+    self.timer.start("10s", "1h")
+
+    self.assertEqual(self.timer.state.fade, 10.0)
+
+class SlowPool(object):
+  def __init__(self, latency):
+    self.latency = latency
+    self.volumes = []
+
+  def command(self, host, port, command, *args):
+    return {"volume": "50"} if command == "status" else {}
+
+  def command_list(self, host, port, commands):
+    time.sleep(self.latency)
+    self.volumes.append(commands[0][1])
+
+class TestFader(unittest.TestCase):
+  def test_slow_mpd_skips_steps(self):
+    scheduler = mas.Scheduler()
+    pool = SlowPool(0.25)
+    now = scheduler.time()
+    fader = mas.Fader(scheduler, "localhost", 6600, now, now + 1, min_step=0.05, pool=pool).start()
+
+    time.sleep(1.5)
+
+    self.assertTrue(2 <= len(pool.volumes) <= 5, pool.volumes)
+    self.assertEqual(pool.volumes, sorted(pool.volumes, reverse=True))
+    self.assertEqual(fader.finish(), 50)
+    scheduler.stop()
+
+class TestPlayerWatcher(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.changes = []
+    self.watcher = mas.PlayerWatcher("127.0.0.1", self.mpd.port)
+    self.watcher.add_listener(lambda previous, current: self.changes.append(current["state"]))
+    self.watcher.start()
+    self._wait_for(lambda: self.changes)
+
+  def tearDown(self):
+    self.watcher.stop()
+    self.mpd.close()
+
+  def _wait_for(self, condition):
+    for _ in range(500):
+      if condition():
+        return True
+
+      time.sleep(0.01)
+
+    return False
+
+  def test_reads_initial_state(self):
+    self.assertEqual(self.watcher.state, {"state": "play", "volume": 50})
+
+  def test_follows_state_changes(self):
+    self.mpd.set_state("pause")
+
+    self.assertTrue(self._wait_for(lambda: len(self.changes) == 2))
+    self.assertEqual(self.changes, ["play", "pause"])
+
+  def test_stop_interrupts_idle(self):
+    started = time.time()
+    self.watcher.stop()
+
+    self.assertTrue(time.time() - started < 1)
+    self.assertIn("noidle", self.mpd.received)
+
+class TestPlayerPolicy(unittest.TestCase):
+  def tearDown(self):
+    mas.app.timer.stop()
+
+  def test_auto_cancel_when_playback_stops(self):
+    mas.app.timer.start("100s")
+    mas.PlayerPolicy(auto_cancel=True)({"state": "play"}, {"state": "stop"})
+
+    self.assertEqual(mas.app.timer.status, "stopped")
+
+  def test_auto_arm_when_playback_starts(self):
+    mas.PlayerPolicy(auto_arm="30m")({"state": "pause"}, {"state": "play"})
+
+    self.assertEqual(mas.app.timer.status, "started")
+
+  def test_no_auto_arm_without_transition(self):
+    mas.PlayerPolicy(auto_arm="30m")({"state": "play"}, {"state": "play"})
+
+    self.assertEqual(mas.app.timer.status, "stopped")
+
+class TestTimerClock(unittest.TestCase):
+  def setUp(self):
+    self.now = [1000.0]
+    self.scheduler = mas.Scheduler(clock=lambda: self.now[0])
+    self.timer = mas.Timer(scheduler=self.scheduler)
+    self.timer._pause = lambda: None
+    self.timer.start("100s")
+
+  def tearDown(self):
+    self.timer.stop()
+    self.scheduler.stop()
+
+  def test_remaining_time_follows_clock(self):
+    self.now[0] += 40
+
+    self.assertEqual(self.timer._get_remaining_time(), 60.0)
+
+  def test_extend_moves_deadline(self):
+    self.now[0] += 40
+    self.timer.extend("100s")
+    self.now[0] += 10
+
+    self.assertEqual(self.timer._get_remaining_time(), 150.0)
+
+  def test_restart_keeps_duration_after_extend(self):
+    self.timer.extend("100s")
+    self.timer.restart()
+
+    self.assertEqual(self.timer._get_remaining_time(), 100.0)
+
+  def test_worker_ignores_stale_deadline(self):
+    deadline = self.timer.state.deadline
+    self.timer.extend("100s")
+    self.timer._worker(deadline)
+
+    self.assertEqual(self.timer.status, "started")
+
+  def test_worker_records_jitter(self):
+    count = mas.app.fire_jitter.snapshot()["count"]
+    self.now[0] = self.timer.state.deadline + 0.003
+    self.timer._worker(self.timer.state.deadline)
+
+    snapshot = mas.app.fire_jitter.snapshot()
+
+    self.assertEqual(self.timer.status, "stopped")
+    self.assertEqual(snapshot["count"], count + 1)
+
+  def test_extend_swaps_state(self):
+    state = self.timer.state
+    self.timer.extend("100s")
+
+    self.assertEqual(state.deadline, 1100.0)
+    self.assertEqual(self.timer.state.deadline, 1200.0)
+    self.assertEqual(self.timer.state.duration, 100.0)
+    self.assertGreater(self.timer.state.version, state.version)
+
+  def test_status_json_matches_status(self):
+    self.now[0] += 40
+
+    self.assertEqual(json.loads(self.timer.get_status_json()), self.timer.get_status())
+
+    self.now[0] += 10
+
+    self.assertEqual(json.loads(self.timer.get_status_json()), {"status": "started", "remaining_time": "50.0 seconds"})
+
+    self.timer.stop()
+
+    self.assertEqual(json.loads(self.timer.get_status_json()), {"status": "stopped"})
+
+class TestJournal(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "state")
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_replay_keeps_pending_timers(self):
+    journal = mas.Journal(self.path)
+    journal.open()
+    journal.record("start", None, 1000.0, 100.0)
+    journal.record("start", "kitchen", 2000.0, 100.0)
+    journal.record("extend", "kitchen", 3000.0, 100.0)
+    journal.record("start", "bedroom", 2000.0, 100.0)
+    journal.record("stop", "bedroom")
+    journal.close()
+
+    pending = mas.Journal(self.path).open()
+
+    self.assertEqual(sorted(pending.keys(), key=str), [None, "kitchen"])
+    self.assertEqual(pending["kitchen"]["deadline"], 3000.0)
+
+  def test_replay_skips_torn_line(self):
+    with open(self.path, "w") as fd:
+      fd.write('{"op": "start", "timer": "kitchen", "deadline": 1000.0, "duration": 10.0}\n{"op": "st')
+
+    pending = mas.Journal(self.path).open()
+
+    self.assertEqual(list(pending.keys()), ["kitchen"])
+
+  def test_compaction_bounds_file(self):
+    journal = mas.Journal(self.path, compact_after=10)
+    journal.open()
+
+    for index in range(100):
+      journal.record("extend", "kitchen", 1000.0 + index, 100.0)
+
+    journal.close()
+
+    with open(self.path) as fd:
+      self.assertTrue(len(fd.readlines()) <= 11)
+
+    self.assertEqual(mas.Journal(self.path).open()["kitchen"]["deadline"], 1099.0)
+
+  def test_record_does_not_wait_for_fsync(self):
+    journal = mas.Journal(self.path, sync_interval=60)
+    journal.open()
+    journal.record("start", "kitchen", 1000.0, 100.0)
+    syncing = threading.Event()
+    disk = threading.Event()
+    fsync = os.fsync
+    os.fsync = lambda fd: (syncing.set(), disk.wait(5))
+    thread = threading.Thread(target=journal.sync)
+    thread.start()
+
+    try:
+      self.assertTrue(syncing.wait(5))
+
+      started = time.time()
+      journal.record("extend", "kitchen", 2000.0, 100.0)
+
+      self.assertTrue(time.time() - started < 1)
+    finally:
+      disk.set()
+      thread.join(5)
+      os.fsync = fsync
+
+    journal.close()
+
+    self.assertEqual(mas.Journal(self.path).open()["kitchen"]["deadline"], 2000.0)
+
+  def test_timer_writes_journal(self):
+    journal = mas.Journal(self.path)
+    journal.open()
+    timer = mas.Timer("kitchen")
+    timer.journal = journal
+    timer.start("100s")
+    timer.extend("100s")
+    journal.close()
+    timer.stop()
+
+    record = mas.Journal(self.path).open()["kitchen"]
+
+    self.assertTrue(199 < record["deadline"] - time.time() < 201)
+    self.assertEqual(record["duration"], 100.0)
+
+  def test_recover_rearms_and_fires_overdue(self):
+    journal = mas.Journal(self.path)
+    journal.open()
+    journal.record("start", "kitchen", time.time() + 100, 100.0)
+    journal.record("start", "bedroom", time.time() - 100, 100.0)
+    journal.close()
+
+    fired = []
+    timers = mas.app.timers
+    original = mas.app.Timer._pause
+    mas.app.Timer._pause = lambda timer: fired.append(timer.name)
+
+    try:
+      journal = mas.Journal(self.path)
+      mas.app.recover(journal)
+
+      for _ in range(100):
+        if fired:
+          break
+
+        time.sleep(0.01)
+
+      self.assertEqual(fired, ["bedroom"])
+      self.assertEqual(timers.get_status("kitchen")["status"], "started")
+    finally:
+      mas.app.Timer._pause = original
+      timers.stop("kitchen")
+      journal.close()
+      mas.app.timer.journal = timers.journal = None
+
+class TestHistogram(unittest.TestCase):
+  def test_snapshot_is_cumulative(self):
+    histogram = mas.Histogram((0.001, 0.01, 0.1))
+
+    for value in (0.0005, 0.005, 0.005, 0.05, 5):
+      histogram.observe(value)
+
+    snapshot = histogram.snapshot()
+
+    self.assertEqual(snapshot["buckets"], [[0.001, 1], [0.01, 3], [0.1, 4], ["+Inf", 5]])
+    self.assertEqual(snapshot["count"], 5)
+    self.assertEqual(snapshot["max"], 5)
+
+class TestCronRule(unittest.TestCase):
+  def test_weeknights(self):
+    rule = mas.CronRule("30 23 * * mon-fri")
+    # a friday evening, next is friday 23:30, then monday
+    friday = datetime.datetime(2026, 10, 16, 20, 0)
+
+    self.assertEqual(rule.next_after(friday), datetime.datetime(2026, 10, 16, 23, 30))
+    self.assertEqual(rule.next_after(datetime.datetime(2026, 10, 16, 23, 30)), datetime.datetime(2026, 10, 19, 23, 30))
+
+  def test_steps_and_lists(self):
+    rule = mas.CronRule("*/20 1,13 * * *")
+
+    self.assertEqual(rule.next_after(datetime.datetime(2026, 10, 16, 1, 25)), datetime.datetime(2026, 10, 16, 1, 40))
+    self.assertEqual(rule.next_after(datetime.datetime(2026, 10, 16, 1, 40)), datetime.datetime(2026, 10, 16, 13, 0))
+
+  def test_day_of_month_or_week(self):
+    rule = mas.CronRule("0 0 1 * sun")
+
+    # thursday the 1st matches by day of month, sunday the 4th by day of week
+    self.assertEqual(rule.next_after(datetime.datetime(2026, 9, 30, 12, 0)), datetime.datetime(2026, 10, 1, 0, 0))
+    self.assertEqual(rule.next_after(datetime.datetime(2026, 10, 1, 12, 0)), datetime.datetime(2026, 10, 4, 0, 0))
+
+  def test_invalid_rules(self):
+    for expression in ("* * * *", "60 * * * *", "* * * * fun", "5-1 * * * *", "*/0 * * * *"):
+      with self.assertRaises(ValueError):
+        mas.CronRule(expression)
+
+class TestScheduleBook(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "schedules.json")
+    self.scheduler = mas.Scheduler()
+    self.fired = []
+    self.book = mas.ScheduleBook(self.scheduler, lambda schedule, at: self.fired.append((schedule.id, at)), self.path)
+
+  def tearDown(self):
+    self.book.clear()
+    self.scheduler.stop()
+    shutil.rmtree(self.directory)
+
+  def test_at_with_days_is_recurring(self):
+    schedule = self.book.put({"id": "weeknights", "at": "23:30", "days": "mon-fri", "fade": "1m"})
+
+    self.assertEqual(schedule["cron"], "30 23 * * mon-fri")
+    self.assertEqual(schedule["fade"], "1m")
+    self.assertTrue(schedule["next_fire"].endswith("T23:30:00"))
+
+  def test_at_time_of_day_is_next_occurrence(self):
+    now = datetime.datetime(2026, 10, 16, 22, 0)
+
+    self.assertEqual(mas.Schedule.from_dict({"at": "01:00"}, now=now).at, "2026-10-17T01:00:00")
+    self.assertEqual(mas.Schedule.from_dict({"at": "23:00"}, now=now).at, "2026-10-16T23:00:00")
+
+  def test_rejects_invalid_schedules(self):
+    for data in ({}, {"at": "25:00"}, {"cron": "* * * * *", "at": "01:00"}, {"id": "a b", "at": "01:00"}, {"at": "2000-01-01T00:00"}):
+      with self.assertRaises(ValueError):
+        self.book.put(data)
+
+  def test_fires_and_drops_one_off(self):
+    # at has whole seconds, somewhere between 0.5 and 1.5 seconds from now
+    at = datetime.datetime.now() + datetime.timedelta(seconds=1.5)
+    self.book.put({"id": "soon", "at": at.strftime("%Y-%m-%dT%H:%M:%S")})
+
+    for _ in range(300):
+      if self.fired:
+        break
+
+      time.sleep(0.01)
+
+    self.assertEqual(self.fired[0][0], "soon")
+    self.assertEqual(len(self.book), 0)
+
+  def test_persists_and_loads(self):
+    self.book.put({"id": "nightly", "cron": "0 1 * * *"})
+    self.book.put({"id": "gone", "cron": "0 2 * * *"})
+    self.book.remove("gone")
+
+    book = mas.ScheduleBook(self.scheduler, lambda schedule, at: None, self.path)
+    book.load()
+
+    try:
+      self.assertEqual([schedule["id"] for schedule in book.list()], ["nightly"])
+    finally:
+      book.clear()
+
+  def test_remove_unknown(self):
+    with self.assertRaises(mas.ScheduleNotFoundError):
+      self.book.remove("nothing")
+
+class TestLogger(unittest.TestCase):
+  def setUp(self):
+    self.stream = StringIO()
+    self.logger = mas.Logger(self.stream, max_pending=4)
+
+  def tearDown(self):
+    self.logger.close()
+
+  def test_writes_levels_and_fields(self):
+    self.logger.info("Timer started", timer="kitchen", duration=1800.0, target=None)
+    self.logger.warning("Lost {0}", "mpd", error="connection refused")
+    self.logger.debug("Not written")
+
+    self.assertTrue(self.logger.flush())
+
+    lines = self.stream.getvalue().splitlines()
+
+    self.assertEqual(len(lines), 2)
+    self.assertTrue(lines[0].endswith(" INFO Timer started duration=1800.0 timer=kitchen"))
+    self.assertTrue(lines[1].endswith(' WARNING Lost mpd error="connection refused"'))
+
+  def test_drops_when_full(self):
+    blocked = threading.Event()
+    write = self.logger._write
+    self.logger._write = lambda records: (blocked.wait(5), write(records))
+
+    # the first record is taken by the writer, then blocks, four more fill the queue
+    for index in range(10):
+      self.logger.error("Record {0}", index)
+
+    blocked.set()
+    self.logger.flush()
+
+    self.assertTrue(self.logger.dropped[mas.logger.ERROR] >= 5)
+    self.assertEqual(len(self.stream.getvalue().splitlines()), 10 - self.logger.dropped[mas.logger.ERROR])
+
+  def test_bad_field_keeps_the_batch(self):
+    class Unprintable(object):
+      def __str__(self):
+        raise RuntimeError("no")
+
+      def __repr__(self):
+        return "Unprintable()"
+
+    blocked = threading.Event()
+    write = self.logger._write
+    self.logger._write = lambda records: (blocked.wait(5), write(records))
+
+    # the writer takes the first one and blocks, the other three come as one batch
+    self.logger.info("First")
+    self.logger.info("Before")
+    self.logger.info("Bad", field=Unprintable())
+    self.logger.info("After")
+    blocked.set()
+
+    self.assertTrue(self.logger.flush())
+
+    lines = self.stream.getvalue().splitlines()
+
+    self.assertEqual(len(lines), 4)
+    self.assertTrue(lines[1].endswith(" INFO Before"))
+    self.assertIn("Unprintable()", lines[2])
+    self.assertTrue(lines[3].endswith(" INFO After"))
+
+  def test_log_does_not_wait_for_output(self):
+    self.logger._write = lambda records: time.sleep(1)
+    started = time.time()
+
+    for index in range(3):
+      self.logger.info("Record {0}", index)
+
+    self.assertTrue(time.time() - started < 0.5)
+
+class TestCaching(unittest.TestCase):
+  def test_accepts_gzip(self):
+    self.assertTrue(mas.accepts_gzip("gzip, deflate, br"))
+    self.assertTrue(mas.accepts_gzip("*"))
+    self.assertFalse(mas.accepts_gzip("gzip;q=0, *"))
+    self.assertFalse(mas.accepts_gzip("identity"))
+    self.assertFalse(mas.accepts_gzip(None))
+
+  def test_etag_matches(self):
+    self.assertTrue(mas.etag_matches('"a", W/"b"', 'W/"b"'))
+    self.assertTrue(mas.etag_matches('W/"a"', '"a"'))
+    self.assertTrue(mas.etag_matches("*", '"a"'))
+    self.assertFalse(mas.etag_matches('"a"', '"b"'))
+    self.assertFalse(mas.etag_matches(None, '"a"'))
+
+  def test_static_asset(self):
+    asset = mas.StaticAsset("<p>" + "hello " * 100 + "</p>", "text/html")
+    (body, etag, encoding) = asset.select("gzip")
+
+    self.assertEqual(encoding, "gzip")
+    self.assertEqual(zlib.decompress(body, 31), asset.body)
+    self.assertNotEqual(etag, asset.etag)
+    self.assertEqual(asset.select("br"), (asset.body, asset.etag, None))
+
+  def test_static_asset_too_small_to_compress(self):
+    asset = mas.StaticAsset("ok", "text/plain")
+
+    self.assertIsNone(asset.gzipped)
+    self.assertEqual(asset.select("gzip")[2], None)
+
+class TestRateLimiter(unittest.TestCase):
+  def setUp(self):
+    self.now = [0.0]
+    self.limiter = mas.RateLimiter(2.0, 3, max_clients=2, clock=lambda: self.now[0])
+
+  def test_burst_then_rate(self):
+    self.assertEqual([self.limiter.acquire("a") for _ in range(3)], [0, 0, 0])
+    self.assertAlmostEqual(self.limiter.acquire("a"), 0.5)
+
+    self.now[0] = 0.5
+
+    self.assertEqual(self.limiter.acquire("a"), 0)
+    self.assertGreater(self.limiter.acquire("a"), 0)
+
+  def test_clients_are_separate(self):
+    for _ in range(3):
+      self.limiter.acquire("a")
+
+    self.assertGreater(self.limiter.acquire("a"), 0)
+    self.assertEqual(self.limiter.acquire("b"), 0)
+
+  def test_least_recently_seen_is_evicted(self):
+    for _ in range(3):
+      self.limiter.acquire("a")
+
+    self.limiter.acquire("b")
+    self.limiter.acquire("a")
+    self.limiter.acquire("c")
+
+    self.assertEqual(len(self.limiter), 2)
+    self.assertEqual(list(self.limiter._buckets), ["a", "c"])
+    self.assertGreater(self.limiter.acquire("a"), 0)
+
+  def test_disabled(self):
+    limiter = mas.RateLimiter()
+
+    self.assertEqual([limiter.acquire("a") for _ in range(100)], [0] * 100)
+    self.assertEqual(len(limiter), 0)
+
+class TestTracer(unittest.TestCase):
+  def setUp(self):
+    self.tracer = mas.Tracer(capacity=2)
+
+  def test_disabled(self):
+    self.assertIsNone(self.tracer.start("GET /timer"))
+    self.assertIs(self.tracer.span("route"), mas.diagnostics.null_span)
+
+  def test_spans(self):
+    self.tracer.enabled = True
+    trace = self.tracer.start("GET /timer")
+
+    with self.tracer.span("route"):
+      pass
+
+    with mas.TracedLock(threading.Lock(), self.tracer):
+      pass
+
+    self.tracer.finish(trace, status=200)
+    (result,) = self.tracer.traces()
+
+    self.assertEqual(result["name"], "GET /timer")
+    self.assertEqual(result["status"], 200)
+    self.assertEqual([span["name"] for span in result["spans"]], ["route", "lock_wait"])
+
+  def test_ring_buffer(self):
+    self.tracer.enabled = True
+
+    for index in range(3):
+      self.tracer.finish(self.tracer.start(str(index)))
+
+    self.assertEqual([trace["name"] for trace in self.tracer.traces()], ["1", "2"])
+
+class TestProfiler(unittest.TestCase):
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.profiler = mas.Profiler(os.path.join(self.directory, "stats.prof"))
+
+  def tearDown(self):
+    shutil.rmtree(self.directory)
+
+  def test_session(self):
+    self.assertIsNone(self.profiler.stop())
+
+    self.profiler.start()
+    self.profiler.run(sorted, range(100))
+    result = self.profiler.stop()
+
+    self.assertEqual(result["requests"], 1)
+    self.assertTrue(os.path.exists(result["path"]))
+    self.assertTrue(result["top"])
+    self.assertFalse(self.profiler.active)
+
+  def test_sample(self):
+    self.profiler.sample = 2
+    self.profiler.start()
+
+    for _ in range(4):
+      self.profiler.run(sorted, range(10))
+
+    self.assertEqual(self.profiler.stop()["requests"], 2)
+
+  def test_stop_from_profiled_call(self):
+    self.profiler.start()
+    started = time.time()
+    result = self.profiler.run(self.profiler.stop)
+
+    self.assertEqual(result["requests"], 1)
+    self.assertTrue(time.time() - started < 1.0)
+
+  def test_concurrent_calls(self):
+    entered = []
+    release = threading.Event()
+    results = []
+
+    def request(index):
+      entered.append(index)
+      release.wait(5)
+
+      return index
+
+    def call(index):
+      results.append(self.profiler.run(request, index))
+
+    self.profiler.start()
+    threads = [threading.Thread(target=call, args=(index,)) for index in range(4)]
+
+    for thread in threads:
+      thread.start()
+
+    # all of them inside at once
+    for _ in range(250):
+      if len(entered) == len(threads):
+        break
+
+      time.sleep(0.02)
+
+    release.set()
+
+    for thread in threads:
+      thread.join(5)
+
+    self.assertEqual(sorted(results), [0, 1, 2, 3])
+    self.assertEqual(self.profiler._running, 0)
+
+    result = self.profiler.stop()
+
+    # one profile at a time where cProfile allows no more
+    self.assertEqual(result["requests"], 1 if self.profiler.exclusive else 4)
+    self.assertTrue(result["top"])
+
+  def test_exclusive_concurrent_calls(self):
+    self.profiler.exclusive = True
+    self.test_concurrent_calls()
+
+  @unittest.skipUnless(mas.Profiler.exclusive, "cProfile takes one profile per process from python 3.12 on")
+  def test_another_profiler_active(self):
+    other = cProfile.Profile()
+    other.enable()
+
+    try:
+      self.profiler.start()
+      result = self.profiler.run(sorted, [2, 1])
+    finally:
+      other.disable()
+
+    self.assertEqual(result, [1, 2])
+    self.assertEqual(self.profiler._running, 0)
+    self.assertEqual(self.profiler.stop()["requests"], 0)
+
+class TestRegistry(unittest.TestCase):
+  def setUp(self):
+    self.registry = mas.Registry()
+
+  def test_renders_counters_with_labels(self):
+    counter = self.registry.counter("requests_total", "Requests", ("route", "status"))
+    counter.inc(("/timer", "200"))
+    counter.inc(("/timer", "200"))
+    counter.inc(('/a"b', "404"))
+
+    text = self.registry.render()
+
+    self.assertIn("# TYPE requests_total counter", text)
+    self.assertIn('requests_total{route="/timer",status="200"} 2', text)
+    self.assertIn('requests_total{route="/a\\"b",status="404"} 1', text)
+
+  def test_renders_histograms(self):
+    histograms = self.registry.histograms("latency_seconds", "Latency", ("route",), (0.01, 0.1))
+    histograms.observe(0.05, ("/timer",))
+
+    text = self.registry.render()
+
+    self.assertIn('latency_seconds_bucket{route="/timer",le="0.01"} 0', text)
+    self.assertIn('latency_seconds_bucket{route="/timer",le="0.1"} 1', text)
+    self.assertIn('latency_seconds_bucket{route="/timer",le="+Inf"} 1', text)
+    self.assertIn('latency_seconds_count{route="/timer"} 1', text)
+
+  def test_gauge_reads_function(self):
+    self.registry.gauge("active", "Active", lambda: 3)
+
+    self.assertIn("active 3\n", self.registry.render())
+
+  def test_adds_exported_samples(self):
+    self.registry.counter("requests_total", "Requests", ("route",)).inc(("/timer",))
+    self.registry.histograms("latency_seconds", "Latency", ("route",), (0.01, 0.1)).observe(0.05, ("/timer",))
+
+    other = mas.Registry()
+    counter = other.counter("requests_total", "Requests", ("route",))
+    counter.inc(("/timer",), 2)
+    counter.inc(("/",))
+    other.histograms("latency_seconds", "Latency", ("route",), (0.01, 0.1)).observe(0.005, ("/timer",))
+    # through JSON, like from another process
+    exported = json.loads(json.dumps(other.export(["requests_total", "latency_seconds"])))
+    self.registry.add_source(lambda: [exported])
+
+    text = self.registry.render()
+
+    self.assertIn('requests_total{route="/timer"} 3\n', text)
+    self.assertIn('requests_total{route="/"} 1\n', text)
+    self.assertIn('latency_seconds_bucket{route="/timer",le="0.01"} 1\n', text)
+    self.assertIn('latency_seconds_bucket{route="/timer",le="0.1"} 2\n', text)
+    self.assertIn('latency_seconds_count{route="/timer"} 2\n', text)
+
+class TestTimerRegistry(unittest.TestCase):
+  def setUp(self):
+    self.timers = mas.TimerRegistry()
+
+  def tearDown(self):
+    for name in ("kitchen", "bedroom"):
+      self.timers.stop(name)
+
+  def test_start_with_many_names(self):
+    self.timers.start("kitchen", "100s")
+    self.timers.start("bedroom", "200s")
+
+    statuses = self.timers.get_statuses()
+
+    self.assertEqual(sorted(statuses.keys()), ["bedroom", "kitchen"])
+    self.assertEqual(statuses["kitchen"]["status"], "started")
+
+  def test_stop_drops_timer(self):
+    self.timers.start("kitchen", "100s")
+    self.timers.stop("kitchen")
+
+    self.assertEqual(len(self.timers), 0)
+    self.assertEqual(self.timers.get_status("kitchen"), {"status": "stopped"})
+
+  def test_extend_with_unknown_name(self):
+    with self.assertRaises(mas.InvalidTimerStateError):
+      self.timers.extend("kitchen", "100s")
+
+  def test_fired_timer_is_dropped(self):
+    self.timers.start("kitchen", "100s")
+    timer = self.timers._timers["kitchen"]
+    timer._pause = lambda: None
+    timer._worker()
+
+    self.assertEqual(len(self.timers), 0)
+
+class TestFleet(unittest.TestCase):
+  def setUp(self):
+    self.mpds = [FakeMPD(latency=0.2) for _ in range(3)]
+    self.fleet = mas.app.fleet
+
+    for (index, mpd) in enumerate(self.mpds):
+      self.fleet.add(mas.Target("speaker-{0}".format(index), "127.0.0.1", mpd.port, ["upstairs"] if index else []))
+
+    self.fleet.group("ground", ["speaker-0"])
+
+  def tearDown(self):
+    self.fleet.__init__()
+
+    for mpd in self.mpds:
+      mpd.close()
+
+  def test_parse_target(self):
+    target = mas.app.parse_target("kitchen=192.168.1.5:6601")
+
+    self.assertEqual((target.name, target.host, target.port), ("kitchen", "192.168.1.5", 6601))
+    self.assertEqual(mas.app.parse_target("bath=/run/mpd/socket").port, 6600)
+
+    with self.assertRaises(ValueError):
+      mas.app.parse_target("kitchen")
+
+  def test_resolve(self):
+    self.assertEqual([target.name for target in self.fleet.resolve("speaker-1")], ["speaker-1"])
+    self.assertEqual([target.name for target in self.fleet.resolve("upstairs")], ["speaker-1", "speaker-2"])
+    self.assertEqual([target.name for target in self.fleet.resolve("ground")], ["speaker-0"])
+    self.assertEqual(len(self.fleet.resolve("all")), 3)
+
+    with self.assertRaises(ValueError):
+      self.fleet.resolve("attic")
+
+  def test_pause_fans_out(self):
+    timer = mas.Timer()
+    timer.start("100s", target="all")
+    started = time.time()
+    results = timer._pause()
+    timer.stop()
+
+    # three mpds answering in 0.2 seconds each, paused side by side
+    self.assertTrue(time.time() - started < 0.5)
+    self.assertEqual(sorted(results), ["speaker-0", "speaker-1", "speaker-2"])
+    self.assertTrue(all(result["status"] == "paused" for result in results.values()))
+
+    for mpd in self.mpds:
+      self.assertIn('pause "1"', mpd.received)
+
+  def test_unknown_target_fails_start(self):
+    timer = mas.Timer()
+
+    with self.assertRaises(ValueError):
+      timer.start("100s", target="attic")
+
+    self.assertEqual(timer.status, "stopped")
+
+  def test_batch_reports_each_target(self):
+    self.mpds[2].fail.add("pause")
+    result = mas.TimerRegistry().apply([{"op": "pause", "target": "upstairs"}])[0]
+
+    self.assertEqual(result["status"], 502)
+    self.assertEqual(result["targets"]["speaker-1"], {"status": "ok"})
+    self.assertEqual(result["targets"]["speaker-2"]["status"], "failed")
+
+class TestTimerBatch(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.timers = mas.TimerRegistry()
+    self.timers.mpd_host = "127.0.0.1"
+    self.timers.mpd_port = self.mpd.port
+    self.default = mas.Timer()
+
+  def tearDown(self):
+    for name in ("kitchen", "bedroom"):
+      self.timers.stop(name)
+
+    self.default.stop()
+    self.mpd.close()
+
+  def test_applies_operations_in_order(self):
+    results = self.timers.apply([
+      {"op": "start", "timer": "kitchen", "duration": "100s"},
+      {"op": "start", "timer": "bedroom", "duration": "200s"},
+      {"op": "extend", "timer": "kitchen", "duration": "50s"},
+      {"op": "stop", "timer": "bedroom"},
+      {"op": "start", "timer": None, "duration": "10m"}
+    ], self.default)
+
+    self.assertEqual([result["status"] for result in results], [200] * 5)
+    self.assertEqual(list(self.timers.get_statuses().keys()), ["kitchen"])
+    self.assertEqual(self.default.status, "started")
+
+  def test_reports_errors_per_operation(self):
+    results = self.timers.apply([
+      {"op": "restart", "timer": "kitchen"},
+      {"op": "launch", "timer": "kitchen"},
+      {"op": "start", "timer": "kitchen"},
+      "start",
+      {"op": "start", "timer": "kitchen", "duration": "100s"}
+    ])
+
+    self.assertEqual([result["status"] for result in results], [400, 400, 400, 400, 200])
+    self.assertIn("error", results[0])
+
+  def test_coalesces_mpd_commands(self):
+    results = self.timers.apply([
+      {"op": "setvol", "volume": 20},
+      {"op": "start", "timer": "kitchen", "duration": "100s"},
+      {"op": "pause"}
+    ])
+
+    self.assertEqual([result["status"] for result in results], [200, 200, 200])
+    self.assertEqual(self.mpd.received[-4:], ["command_list_ok_begin", 'setvol "20"', 'pause "1"', "command_list_end"])
+
+  def test_mpd_failure_fails_its_commands(self):
+    self.mpd.fail.add("pause")
+    results = self.timers.apply([{"op": "pause"}, {"op": "setvol", "volume": 20}])
+
+    self.assertEqual([result["status"] for result in results], [502, 502])
+
+  def test_default_start_pauses_given_mpd(self):
+    results = self.timers.apply([{"op": "start", "timer": None, "duration": "0.1s", "mpd_host": "127.0.0.1", "mpd_port": self.mpd.port}], self.default)
+
+    self.assertEqual(results[0]["status"], 200)
+
+    for _ in range(100):
+      if self.mpd.paused_at:
+        break
+
+      time.sleep(0.02)
+
+    self.assertTrue(self.mpd.paused_at)
+    self.assertEqual((self.default.mpd_host, self.default.mpd_port), ("localhost", 6600))
+
+  def test_default_start_keeps_running_timers_mpd(self):
+    self.default.start("100s")
+    results = self.timers.apply([{"op": "start", "timer": None, "duration": "10s", "mpd_host": "elsewhere", "mpd_port": 6601}], self.default)
+
+    self.assertEqual(results[0]["status"], 200)
+    self.assertEqual((self.default.mpd_host, self.default.mpd_port), ("localhost", 6600))
+    self.assertIsNone(self.default.state.targets)
+
+  def test_default_start_with_invalid_duration(self):
+    results = self.timers.apply([{"op": "start", "timer": None, "duration": "soon", "mpd_host": "elsewhere", "mpd_port": 6601}], self.default)
+
+    self.assertEqual(results[0]["status"], 400)
+    self.assertEqual(self.default.status, "stopped")
+    self.assertEqual((self.default.mpd_host, self.default.mpd_port), ("localhost", 6600))
+
+class TestApp(unittest.TestCase):
+  app_args = ()
+  keep_alive = False
+
+  def setUp(self):
+    self.port = free_port()
+    self.app = mas.App("127.0.0.1", self.port, *self.app_args)
+    self.app_thread = threading.Thread(target=self.app.start)
+    self.app_thread.daemon = True
+    self.app_thread.start()
+
+    for _ in range(100):
+      try:
+        socket.create_connection(("127.0.0.1", self.port), 1).close()
+
+        # listening already before start() stores its servers
+        if hasattr(self.app, "server"):
+          break
+      except socket.error:
+        pass
+
+      time.sleep(0.01)
+
+  def tearDown(self):
+    self.app.stop()
+    self.app_thread.join(5)
+
+  def _get(self, path):
+    sock = socket.create_connection(("127.0.0.1", self.port), 5)
+    sock.sendall("GET {0} HTTP/1.0\r\n\r\n".format(path).encode("ascii"))
+    chunks = []
+
+    while True:
+      chunk = sock.recv(4096)
+
+      if not chunk:
+        break
+
+      chunks.append(chunk)
+
+    sock.close()
+
+    return b"".join(chunks).decode("utf8")
+
+  def test_serves_requests(self):
+    response = self._get("/timer")
+
+    self.assertIn('"status"', response)
+
+  def test_response_framing(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("GET", "/timer")
+    response = connection.getresponse()
+    body = response.read()
+
+    self.assertEqual(response.status, 200)
+    self.assertEqual(response.version, 11)
+    self.assertEqual(int(response.getheader("Content-Length")), len(body))
+    self.assertEqual(response.getheader("Connection"), None if self.keep_alive else "close")
+    connection.close()
+
+  def test_metrics(self):
+    self._get("/timer")
+    response = self._get("/metrics")
+
+    self.assertIn("text/plain; version=0.0.4", response)
+    self.assertIn('mpd_auto_stop_http_requests_total{route="/timer",method="GET",status="200"} ', response)
+    self.assertIn('mpd_auto_stop_http_request_seconds_count{route="/timer",method="GET"}', response)
+    self.assertIn("mpd_auto_stop_active_timers", response)
+
+  def _request(self, path, headers):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("GET", path, headers=headers)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+
+    return (response, body)
+
+  def test_index_gzip(self):
+    (response, body) = self._request("/", {"Accept-Encoding": "gzip"})
+
+    self.assertEqual(response.getheader("Content-Encoding"), "gzip")
+    self.assertEqual(response.getheader("Vary"), "Accept-Encoding")
+    self.assertIn(b"MPD Auto Stop", zlib.decompress(body, 31))
+
+    (response, body) = self._request("/", {"Accept-Encoding": "gzip", "If-None-Match": response.getheader("ETag")})
+
+    self.assertEqual(response.status, 304)
+    self.assertEqual(body, b"")
+
+  def test_index_identity(self):
+    (response, body) = self._request("/", {"Accept-Encoding": "gzip;q=0"})
+
+    self.assertIsNone(response.getheader("Content-Encoding"))
+    self.assertIn(b"MPD Auto Stop", body)
+    self.assertTrue(response.getheader("Cache-Control").startswith("public"))
+
+  def test_timer_not_modified(self):
+    (response, _) = self._request("/timer", {})
+    etag = response.getheader("ETag")
+
+    self.assertEqual(response.getheader("Cache-Control"), "no-cache")
+
+    (response, body) = self._request("/timer", {"If-None-Match": etag})
+
+    self.assertEqual(response.status, 304)
+    self.assertEqual(body, b"")
+
+    mas.app.timer.start("100s")
+
+    try:
+      (response, body) = self._request("/timer", {"If-None-Match": etag})
+    finally:
+      mas.app.timer.stop()
+
+    self.assertEqual(response.status, 200)
+    self.assertNotEqual(response.getheader("ETag"), etag)
+    self.assertEqual(json.loads(body.decode("utf8"))["status"], "started")
+
+  def test_debug_off(self):
+    (response, _) = self._request("/debug/traces", {})
+
+    self.assertEqual(response.status, 404)
+
+  def test_debug_traces(self):
+    mas.app.diagnostics_enabled = mas.app.tracer.enabled = True
+
+    try:
+      self._request("/timer", {})
+
+      # a pooled worker finishes the trace after sending the response
+      for _ in range(100):
+        (response, body) = self._request("/debug/traces", {})
+        traces = [trace for trace in json.loads(body.decode("utf8"))["traces"] if trace["route"] == "/timer"]
+
+        if traces:
+          break
+
+        time.sleep(0.01)
+    finally:
+      mas.app.diagnostics_enabled = mas.app.tracer.enabled = False
+      mas.app.tracer.clear()
+
+    names = [span["name"] for span in traces[-1]["spans"]]
+
+    self.assertEqual(traces[-1]["route"], "/timer")
+    self.assertEqual(names, ["route", "json", "handler", "write"])
+
+  def test_rate_limited(self):
+    mas.app.write_limiter.rate = 0.1
+    mas.app.write_limiter.burst = 1
+
+    try:
+      (first, _) = self._request("/timer/stop", {})
+      (second, body) = self._request("/timer/restart", {})
+      (status, _) = self._request("/timer", {})
+    finally:
+      mas.app.write_limiter.rate = 0.0
+      mas.app.write_limiter.clear()
+
+    self.assertNotEqual(first.status, 429)
+    self.assertEqual(second.status, 429)
+    self.assertEqual(second.getheader("Retry-After"), "10")
+    self.assertIn("error", json.loads(body.decode("utf8")))
+    # reads have a budget of their own
+    self.assertEqual(status.status, 200)
+
+  def test_method_not_allowed(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("POST", "/timer")
+    response = connection.getresponse()
+    response.read()
+
+    self.assertEqual(response.status, 405)
+    self.assertEqual(response.getheader("Allow"), "GET")
+    connection.close()
+
+  def test_timer_batch(self):
+    body = '[{"op": "start", "timer": "batch-test", "duration": "100s"}, {"op": "stop", "timer": "batch-test"}]'
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("POST", "/timer/batch", body, {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    results = json.loads(response.read().decode("utf8"))
+
+    self.assertEqual(response.status, 200)
+    self.assertEqual([result["status"] for result in results], [200, 200])
+    connection.close()
+
+  def test_schedules(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("POST", "/schedules", '{"id": "http-test", "cron": "30 23 * * *"}')
+    response = connection.getresponse()
+    created = json.loads(response.read().decode("utf8"))
+
+    self.assertEqual(response.status, 200)
+    self.assertEqual(created["cron"], "30 23 * * *")
+    connection.close()
+
+    self.assertIn('"http-test"', self._get("/schedules/http-test"))
+
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("DELETE", "/schedules/http-test")
+    response = connection.getresponse()
+    response.read()
+
+    self.assertEqual(response.status, 200)
+    connection.close()
+
+    self.assertIn("404", self._get("/schedules/http-test").split("\r\n")[0])
+
+  def test_timer_batch_rejects_bad_body(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("POST", "/timer/batch", '{"op": "stop"}')
+    response = connection.getresponse()
+    response.read()
+
+    self.assertEqual(response.status, 400)
+    connection.close()
+
+  def test_timer_bad_requests(self):
+    mas.app.timer.stop()
+
+    for path in ("/timer/restart", "/timer/10s/extend", "/timer/soon/start"):
+      response = self._get(path)
+
+      self.assertIn(" 400 ", response.split("\r\n")[0], path)
+      self.assertIn('"error": "', response, path)
+
+    mas.app.timer.start("100s")
+
+    try:
+      response = self._get("/timer/soon/extend")
+    finally:
+      mas.app.timer.stop()
+
+    self.assertIn(" 400 ", response.split("\r\n")[0])
+    self.assertIn("soon", response)
+
+  def test_timer_errors(self):
+    def fail(*args):
+      raise RuntimeError("mpd on fire")
+
+    mas.app.timer.get_status_with_etag = mas.app.timer.stop = fail
+
+    try:
+      responses = [self._get(path) for path in ("/timer", "/timer/stop")]
+    finally:
+      del mas.app.timer.get_status_with_etag
+      del mas.app.timer.stop
+
+    for response in responses:
+      self.assertIn(" 500 ", response.split("\r\n")[0])
+      self.assertIn('"error": "mpd on fire"', response)
+
+  def test_stop_is_immediate(self):
+    started = time.time()
+    self.app.stop()
+    self.app_thread.join(5)
+
+    self.assertFalse(self.app_thread.is_alive())
+    self.assertTrue(time.time() - started < 1.0)
+
+class TestSocketActivation(unittest.TestCase):
+  def setUp(self):
+    self.environ = dict(os.environ)
+
+  def tearDown(self):
+    os.environ.clear()
+    os.environ.update(self.environ)
+
+  def test_listen_fds_for_another_process(self):
+    os.environ["LISTEN_PID"] = str(os.getpid() + 1)
+    os.environ["LISTEN_FDS"] = "1"
+
+    self.assertEqual(mas.listen_fds(), [])
+    self.assertNotIn("LISTEN_FDS", os.environ)
+
+  def test_listen_fds_without_activation(self):
+    os.environ.pop("LISTEN_PID", None)
+    os.environ.pop("LISTEN_FDS", None)
+
+    self.assertEqual(mas.listen_fds(), [])
+
+  def test_serves_passed_socket(self):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    sock.listen(5)
+    port = sock.getsockname()[1]
+    app = mas.App("0.0.0.0", 1, sockets=[sock])
+    thread = threading.Thread(target=app.start)
+    thread.daemon = True
+    thread.start()
+
+    connection = httplib.HTTPConnection("127.0.0.1", port, timeout=5)
+    connection.request("GET", "/timer")
+    response = connection.getresponse()
+
+    self.assertEqual(response.status, 200)
+    self.assertEqual(json.loads(response.read().decode("utf8"))["status"], "stopped")
+
+    connection.close()
+    app.stop()
+    thread.join(5)
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs unix domain sockets")
+class TestUnixSocket(unittest.TestCase):
+  app_args = ()
+
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    self.path = os.path.join(self.directory, "mpd-auto-stop.sock")
+    self.port = free_port()
+    self.app = mas.App("127.0.0.1", self.port, *self.app_args, unix_socket=self.path, unix_socket_mode=0o600)
+    self.thread = threading.Thread(target=self.app.start)
+    self.thread.daemon = True
+    self.thread.start()
+
+    for _ in range(100):
+      if os.path.exists(self.path):
+        break
+
+      time.sleep(0.01)
+
+  def tearDown(self):
+    self.app.stop()
+    self.thread.join(5)
+    shutil.rmtree(self.directory)
+
+  def _get(self, path):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(5)
+    sock.connect(self.path)
+    sock.sendall("GET {0} HTTP/1.0\r\n\r\n".format(path).encode("ascii"))
+    chunks = []
+
+    while True:
+      chunk = sock.recv(4096)
+
+      if not chunk:
+        break
+
+      chunks.append(chunk)
+
+    sock.close()
+
+    return b"".join(chunks).decode("utf8")
+
+  def test_serves_routes(self):
+    response = self._get("/timer")
+
+    self.assertTrue(response.startswith("HTTP/1.1 200"), response)
+    self.assertIn('"status": "stopped"', response)
+
+  def test_serves_tcp_too(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("GET", "/timer")
+
+    self.assertEqual(connection.getresponse().status, 200)
+
+    connection.close()
+
+  def test_mode(self):
+    self.assertEqual(os.stat(self.path).st_mode & 0o777, 0o600)
+
+  def test_removed_on_stop(self):
+    self.app.stop()
+    self.thread.join(5)
+
+    self.assertFalse(os.path.exists(self.path))
+
+  def test_refuses_path_in_use(self):
+    app = mas.App("127.0.0.1", self.port, *self.app_args, unix_socket=self.path, tcp=False)
+
+    with self.assertRaises(socket.error):
+      app._create_servers()
+
+class TestPooledUnixSocket(TestUnixSocket):
+  app_args = (2, 4)
+
+  def test_shares_pool(self):
+    self.assertIs(self.app.servers[0].pool, self.app.servers[1].pool)
+
+class TestIdleExit(unittest.TestCase):
+  def setUp(self):
+    self.port = free_port()
+    self.app = mas.App("127.0.0.1", self.port, 1, 2, idle_timeout=0.3)
+    self.thread = threading.Thread(target=self.app.start)
+    self.thread.daemon = True
+
+  def tearDown(self):
+    mas.app.timer.stop()
+    self.app.stop()
+    self.thread.join(5)
+
+  def test_stops_when_idle(self):
+    started = time.time()
+    self.thread.start()
+    self.thread.join(5)
+
+    self.assertFalse(self.thread.is_alive())
+    self.assertTrue(time.time() - started >= 0.3)
+
+  def test_pending_timer_keeps_it_running(self):
+    mas.app.timer.start("100s")
+    self.thread.start()
+    self.thread.join(1)
+
+    self.assertTrue(self.thread.is_alive())
+
+    mas.app.timer.stop()
+    self.thread.join(5)
+
+    self.assertFalse(self.thread.is_alive())
+
+class TestSharedRecord(unittest.TestCase):
+  def setUp(self):
+    self.record = mas.SharedRecord(64)
+
+  def tearDown(self):
+    self.record.close()
+
+  def test_empty(self):
+    self.assertEqual(self.record.read(), (0, None))
+
+  def test_read_since(self):
+    self.record.write(b"first")
+    (sequence, data) = self.record.read()
+
+    self.assertEqual(data, b"first")
+    self.assertEqual(self.record.read(sequence), (sequence, None))
+
+    self.record.write(b"second")
+
+    self.assertEqual(self.record.read(sequence)[1], b"second")
+
+  def test_too_big(self):
+    with self.assertRaises(ValueError):
+      self.record.write(b"x" * 64)
+
+class TestStateMirror(unittest.TestCase):
+  def setUp(self):
+    self.mirror = mas.StateMirror(mas.SharedRecord())
+
+  def test_stopped_before_anything_is_published(self):
+    (state, player_state) = self.mirror.read()
+
+    self.assertFalse(state.started)
+    self.assertIsNone(player_state)
+
+  def test_publish(self):
+    published = mas.TimerState().replace(status="started", deadline=100.0, duration=60, target="kitchen")
+    self.mirror.publish_state(published)
+    self.mirror.player_changed(None, {"state": "play", "volume": 50})
+    (state, player_state) = self.mirror.read()
+
+    self.assertEqual(player_state, "play")
+    self.assertEqual(state.etag(player_state), published.etag("play"))
+    self.assertEqual(state.to_json(40.0, player_state), published.to_json(40.0, "play"))
+    self.assertIs(self.mirror.read()[0], state)
+
+class TestTimerState(unittest.TestCase):
+  def test_start(self):
+    state = mas.TimerState().start(10.0, 60, fade=90, target="kitchen")
+
+    self.assertTrue(state.started)
+    self.assertEqual((state.deadline, state.fade, state.target), (70.0, 60, "kitchen"))
+    self.assertEqual(state.remaining(40.0), {"remaining_time": "30.0 seconds"})
+
+    with self.assertRaises(mas.InvalidTimerStateError):
+      state.start(20.0, 60)
+
+  def test_restart_and_extend(self):
+    state = mas.TimerState().start(10.0, 60)
+
+    self.assertEqual(state.restart(30.0).deadline, 90.0)
+    self.assertEqual(state.extend(15).deadline, 85.0)
+
+  def test_stopped(self):
+    state = mas.TimerState()
+
+    for transition in (lambda: state.restart(10.0), lambda: state.extend(10)):
+      with self.assertRaises(mas.InvalidTimerStateError):
+        transition()
+
+    self.assertIs(state.stop(), state)
+    self.assertFalse(mas.TimerState().start(10.0, 60).stop().started)
+
+  def test_due_and_expired(self):
+    state = mas.TimerState().start(10.0, 60)
+
+    self.assertTrue(state.due(70.0))
+    self.assertTrue(state.due(None))
+    self.assertFalse(state.extend(5).due(70.0))
+    self.assertFalse(state.expired(70.0))
+    self.assertTrue(state.expired(70.5))
+    self.assertFalse(state.stop().due(None))
+
+class DonePauser(object):
+  """
+  An AsyncTimer pauser answering right away, without mpd
+  """
+  def __init__(self, loop):
+    self.loop = loop
+    self.calls = 0
+
+  def pause(self):
+    self.calls += 1
+    future = self.loop.create_future()
+    future.set_result({"status": "paused"})
+
+    return future
+
+@unittest.skipUnless(hasattr(mas, "AsyncMPDClient"), "asyncio needs python 3")
+class TestAsyncMPDClient(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.loop = asyncio.new_event_loop()
+    self.client = mas.AsyncMPDClient("127.0.0.1", self.mpd.port)
+
+  def tearDown(self):
+    self.client.close()
+    self.loop.close()
+    self.mpd.close()
+
+  def complete(self, coroutine):
+    return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+
+  def test_command(self):
+    self.assertEqual(self.complete(self.client.command("status")), {"volume": "50", "state": "play"})
+    self.assertEqual(self.client.version, "0.21.0")
+
+    self.complete(self.client.command("pause", 1))
+
+    self.assertEqual(self.mpd.received[-1], 'pause "1"')
+    self.assertEqual(self.mpd.connections, 1)
+
+  def test_command_list(self):
+    results = self.complete(self.client.command_list([("status",), ("setvol", 10)]))
+
+    self.assertEqual(results, [{"volume": "50", "state": "play"}, {}])
+    self.assertEqual(self.mpd.volume, 10)
+
+  def test_command_with_ack(self):
+    self.mpd.fail.add("pause")
+
+    with self.assertRaises(mas.MPDCommandError) as context:
+      self.complete(self.client.command("pause", 1))
+
+    self.assertEqual(context.exception.command, "pause")
+
+  def test_connect_with_no_server(self):
+    self.mpd.close()
+
+    with self.assertRaises(mas.MPDConnectionError):
+      self.complete(mas.AsyncMPDClient("127.0.0.1", self.mpd.port, timeout=1).connect())
+
+@unittest.skipUnless(hasattr(mas, "AsyncTimer"), "asyncio needs python 3")
+class TestAsyncTimer(unittest.TestCase):
+  def setUp(self):
+    self.mpd = FakeMPD()
+    self.loop = asyncio.new_event_loop()
+    self.timer = mas.AsyncTimer("nap", mas.AsyncMPDPauser("127.0.0.1", self.mpd.port, timeout=1))
+    self.events = self.timer.events()
+
+  def tearDown(self):
+    self.complete(self.timer.close())
+    self.events.close()
+    self.loop.close()
+    self.mpd.close()
+
+  def complete(self, coroutine):
+    return self.loop.run_until_complete(asyncio.wait_for(coroutine, 5))
+
+  def event_types(self):
+    types = []
+
+    while self.events._events:
+      types.append(self.complete(self.events.get()).type)
+
+    return types
+
+  def test_start_and_status(self):
+    result = self.complete(self.timer.start("100s"))
+    status = self.complete(self.timer.status())
+
+    self.assertTrue(99.0 < float(result["remaining_time"].split()[0]) <= 100.0)
+    self.assertEqual(status["status"], "started")
+    # already started, left as it is
+    state = self.timer.state
+    self.complete(self.timer.start("5s"))
+
+    self.assertIs(self.timer.state, state)
+
+  def test_extend_restart_stop(self):
+    self.complete(self.timer.start("100s"))
+    self.complete(self.timer.extend("50s"))
+
+    self.assertTrue(149.0 < self.timer.state.deadline - self.loop.time() <= 150.0)
+
+    self.complete(self.timer.restart())
+
+    self.assertTrue(99.0 < self.timer.state.deadline - self.loop.time() <= 100.0)
+    self.assertEqual(self.complete(self.timer.stop()), {})
+    self.assertEqual(self.complete(self.timer.status()), {"status": "stopped"})
+    self.assertEqual(self.event_types(), ["started", "extended", "restarted", "stopped"])
+
+    for operation in (self.timer.restart(), self.timer.extend("1m")):
+      with self.assertRaises(mas.InvalidTimerStateError):
+        self.complete(operation)
+
+  def test_fires_and_pauses(self):
+    self.complete(self.timer.start("0.1s"))
+    self.complete(asyncio.sleep(0.5))
+
+    self.assertIn('pause "1"', self.mpd.received)
+    self.assertEqual(self.timer.state.status, "stopped")
+    self.assertEqual(self.event_types(), ["started", "fired", "paused", "stopped"])
+
+  def test_failed_pause(self):
+    self.mpd.fail.add("pause")
+    self.complete(self.timer.start("0.1s"))
+
+    events = [self.complete(self.events.get()) for _ in range(4)]
+
+    self.assertEqual(events[2].type, "paused")
+    self.assertEqual(events[2].data["targets"]["default"]["status"], "failed")
+    self.assertEqual(self.timer.state.status, "stopped")
+
+  def test_extend_moves_the_deadline(self):
+    self.complete(self.timer.start("0.1s"))
+    self.complete(self.timer.extend("10s"))
+    self.complete(asyncio.sleep(0.3))
+
+    self.assertNotIn('pause "1"', self.mpd.received)
+    self.assertEqual(self.timer.state.status, "started")
+
+  def test_no_threads(self):
+    timer = mas.AsyncTimer(pauser=DonePauser(self.loop))
+    threads = threading.active_count()
+
+    self.complete(timer.start("0.05s"))
+    self.complete(asyncio.sleep(0.2))
+
+    self.assertEqual(timer._pauser.calls, 1)
+    self.assertEqual(timer.state.status, "stopped")
+    self.assertEqual(threading.active_count(), threads)
+
+  def test_async_for_ends_on_close(self):
+    self.complete(self.timer.start("100s"))
+    self.events.close()
+    # async for, without syntax python 2 can't compile
+    iterator = self.events.__aiter__()
+
+    self.assertEqual(self.complete(iterator.__anext__()).type, "started")
+
+    with self.assertRaises(StopAsyncIteration):
+      self.complete(iterator.__anext__())
+
+  def test_close_wakes_a_waiting_get(self):
+    events = self.timer.events()
+    self.loop.call_later(0.05, events.close)
+
+    self.assertIsNone(self.complete(events.get()))
+
+class TestWorkerRouter(unittest.TestCase):
+  def setUp(self):
+    self.router = mas.app.WorkerRequestHandler.router
+
+  def test_status_is_local(self):
+    (handler, _, _) = self.router.match("GET", "/timer")
+
+    self.assertEqual(handler, mas.app.WorkerRequestHandler._timer_status)
+    self.assertNotIn(handler, self.router.mutating)
+
+  def test_rest_is_forwarded(self):
+    (handler, params, _) = self.router.match("GET", "/timer/kitchen/30m/start")
+
+    self.assertEqual(handler.__name__, "_named_timer_start")
+    self.assertEqual(params, {"name": "kitchen", "duration": "30m"})
+    self.assertIn(handler, self.router.mutating)
+    self.assertIn(self.router.match("POST", "/timer/batch")[0], self.router.mutating)
+    self.assertEqual(self.router.match("POST", "/timer")[2], ("GET",))
+
+@unittest.skipUnless(hasattr(socket, "AF_UNIX"), "needs unix domain sockets")
+class TestForwarding(unittest.TestCase):
+  """
+  A worker and the main process it forwards to, as threads of one process
+  """
+  def setUp(self):
+    self.directory = tempfile.mkdtemp()
+    path = os.path.join(self.directory, "main.sock")
+    self.port = free_port()
+    self.owner = mas.App("127.0.0.1", 0, 2, sockets=[mas.app.bind_unix_socket(path, 0o600)], handler_class=mas.app.ForwardedRequestHandler)
+    self.worker = mas.App("127.0.0.1", self.port, 2, handler_class=mas.app.WorkerRequestHandler)
+    mas.app.forwarder = mas.Forwarder(path, timeout=5)
+    mas.app.state_mirror = mas.app.timer.mirror = mas.StateMirror(mas.SharedRecord())
+    self.threads = [threading.Thread(target=app.start) for app in (self.owner, self.worker)]
+
+    for thread in self.threads:
+      thread.daemon = True
+      thread.start()
+
+    for _ in range(100):
+      try:
+        socket.create_connection(("127.0.0.1", self.port), 1).close()
+        break
+      except socket.error:
+        time.sleep(0.01)
+
+  def tearDown(self):
+    mas.app.timer.stop()
+    mas.app.timer.mirror = mas.app.state_mirror = mas.app.forwarder = None
+
+    for app in (self.owner, self.worker):
+      app.stop()
+
+    for thread in self.threads:
+      thread.join(5)
+
+    shutil.rmtree(self.directory)
+
+  def _request(self, method, path, body=None):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    body = response.read()
+    connection.close()
+
+    return (response, body)
+
+  def test_write_then_read(self):
+    (response, body) = self._request("GET", "/timer/100s/start")
+
+    self.assertEqual(response.status, 200)
+    self.assertIn(b"remaining_time", body)
+    self.assertEqual(mas.app.timer.status, "started")
+
+    (response, body) = self._request("GET", "/timer")
+
+    self.assertEqual(json.loads(body.decode("utf8"))["status"], "started")
+    self.assertEqual(response.getheader("ETag"), mas.app.timer.get_status_with_etag()[1])
+
+  def test_forwards_body(self):
+    (response, body) = self._request("POST", "/timer/batch", '[{"op": "start", "timer": "forwarded", "duration": "100s"}, {"op": "stop", "timer": "forwarded"}]')
+
+    self.assertEqual(response.status, 200)
+    self.assertEqual([result["status"] for result in json.loads(body.decode("utf8"))], [200, 200])
+
+  def test_drops_client_forwarded_for(self):
+    clients = []
+    acquire = mas.app.read_limiter.acquire
+    mas.app.read_limiter.acquire = lambda client: clients.append(client) or acquire(client)
+
+    try:
+      connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+      connection.putrequest("GET", "/timers")
+      connection.putheader("x-forwarded-for", "203.0.113.7")
+      connection.endheaders()
+      response = connection.getresponse()
+      response.read()
+      connection.close()
+    finally:
+      del mas.app.read_limiter.acquire
+
+    self.assertEqual(response.status, 200)
+    # once by the worker, once by the main process, for the worker's own client
+    self.assertEqual(clients, ["127.0.0.1", "127.0.0.1"])
+
+  def test_rejects_large_body(self):
+    (response, body) = self._request("POST", "/timer/batch", "[" + " " * mas.app.TimerRequestHandler.max_body + "]")
+
+    self.assertEqual(response.status, 413)
+    self.assertIn("error", json.loads(body.decode("utf8")))
+
+  def test_main_process_gone(self):
+    self.owner.stop()
+    self.threads[0].join(5)
+    mas.app.forwarder.discard()
+
+    (response, body) = self._request("GET", "/timers")
+
+    self.assertEqual(response.status, 502)
+    self.assertIn("error", json.loads(body.decode("utf8")))
+
+class ProcessesTestCase(unittest.TestCase):
+  args = ()
+
+  def setUp(self):
+    self.port = free_port()
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    self.process = subprocess.Popen([sys.executable, "-m", "mpd_auto_stop", "--host", "127.0.0.1", "--port", str(self.port), "--processes", "2", "--workers", "2", "--mpd-port", "1", "--log-level", "error"] + list(self.args), cwd=root)
+
+    for _ in range(200):
+      try:
+        socket.create_connection(("127.0.0.1", self.port), 1).close()
+        break
+      except socket.error:
+        time.sleep(0.02)
+
+  def tearDown(self):
+    if self.process.poll() is None:
+      # stopped properly, so it removes its socket directory
+      self.process.terminate()
+
+      for _ in range(250):
+        if self.process.poll() is not None:
+          break
+
+        time.sleep(0.02)
+      else:
+        self.process.kill()
+        self.process.wait()
+
+  def _request(self, path):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("GET", path)
+    response = connection.getresponse()
+    body = response.read().decode("utf8")
+    connection.close()
+
+    return (response.status, body)
+
+  def _get(self, path):
+    return json.loads(self._request(path)[1])
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork"), "needs SO_REUSEPORT and fork")
+class TestProcesses(ProcessesTestCase):
+  def test_every_worker_sees_the_timer(self):
+    self._get("/timer/1h/start")
+
+    # new connections, spread over the workers
+    statuses = set(self._get("/timer")["status"] for _ in range(20))
+
+    self.assertEqual(statuses, set(["started"]))
+
+    self._get("/timer/stop")
+
+    self.assertEqual(set(self._get("/timer")["status"] for _ in range(20)), set(["stopped"]))
+
+  def test_stops_workers(self):
+    # forwarded, answered once the main process is serving and handles signals
+    self._get("/timers")
+    self.process.send_signal(signal.SIGTERM)
+
+    self.assertEqual(self.process.wait(), 0)
+
+    with self.assertRaises(socket.error):
+      socket.create_connection(("127.0.0.1", self.port), 1)
+
+  def test_metrics_count_every_worker(self):
+    # answered by the workers themselves, new connections spread over them
+    for _ in range(20):
+      self._get("/timer")
+
+    sample = 'mpd_auto_stop_http_requests_total{route="/timer",method="GET",status="200"} 20\n'
+
+    # published every second
+    for _ in range(150):
+      if sample in self._request("/metrics")[1]:
+        break
+
+      time.sleep(0.02)
+
+    self.assertIn(sample, self._request("/metrics")[1])
+
+@unittest.skipUnless(hasattr(socket, "SO_REUSEPORT") and hasattr(os, "fork"), "needs SO_REUSEPORT and fork")
+class TestProcessesRateLimit(ProcessesTestCase):
+  args = ("--rate-limit-read", "0.01", "--rate-limit-read-burst", "4", "--rate-limit-write", "0.01", "--rate-limit-write-burst", "2")
+
+  def test_one_budget_for_all_workers(self):
+    # new connections, spread over the workers
+    reads = [self._request("/timer")[0] for _ in range(12)]
+    writes = [self._request("/timer/stop")[0] for _ in range(8)]
+
+    self.assertEqual(reads.count(200), 4)
+    self.assertEqual(reads.count(429), 8)
+    self.assertEqual(writes.count(200), 2)
+    self.assertEqual(writes.count(429), 6)
+
+class TestPooledApp(TestApp):
+  app_args = (1, 2)
+  keep_alive = True
+
+  def test_rejects_when_saturated(self):
+    # idle clients hold the only worker and then fill up the queue
+    clients = []
+
+    while self.app.server.pool.queued < 2 and len(clients) < 10:
+      clients.append(socket.create_connection(("127.0.0.1", self.port), 5))
+      time.sleep(0.05)
+
+    response = self._get("/timer")
+
+    self.assertTrue(response.startswith("HTTP/1.0 503"), response)
+    self.assertIn("Retry-After: 1", response)
+
+    for client in clients:
+      client.close()
+
+class TestKeepAlive(TestApp):
+  app_args = (2, 4, 5.0, 3)
+  keep_alive = True
+
+  def test_requests_share_connection(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+    connection.request("GET", "/timer")
+    response = connection.getresponse()
+    response.read()
+    sock = connection.sock
+
+    self.assertIsNone(response.getheader("Connection"))
+
+    connection.request("GET", "/timer")
+    response = connection.getresponse()
+    response.read()
+
+    self.assertIs(connection.sock, sock)
+    connection.close()
+
+  def test_closes_after_max_requests(self):
+    connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+
+    for _ in range(3):
+      connection.request("GET", "/timer")
+      response = connection.getresponse()
+      response.read()
+
+    self.assertEqual(response.getheader("Connection"), "close")
+    connection.close()
+
+  def test_idle_connections_leave_the_workers(self):
+    connections = []
+
+    # as many idle keep-alive connections as there are workers
+    for _ in range(2):
+      connection = httplib.HTTPConnection("127.0.0.1", self.port, timeout=5)
+      connection.request("GET", "/timer")
+      connection.getresponse().read()
+      connections.append(connection)
+
+    started = time.time()
+
+    self.assertIn('"status"', self._get("/timer"))
+    self.assertLess(time.time() - started, 1)
+
+    # and they're served again once they send another request
+    for connection in connections:
+      connection.request("GET", "/timer")
+      response = connection.getresponse()
+      response.read()
+
+      self.assertEqual(response.status, 200)
+      connection.close()
+
+class TestKeepAliveTimeout(TestApp):
+  app_args = (1, 4, 0.2)
+  keep_alive = True
+
+  def test_closes_idle_connection(self):
+    sock = socket.create_connection(("127.0.0.1", self.port), 5)
+    sock.sendall(b"GET /timer HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    rfile = sock.makefile("rb")
+
+    self.assertTrue(rfile.readline().startswith(b"HTTP/1.1 200"))
+
+    while rfile.readline() != b"\r\n":
+      pass
+
+    started = time.time()
+
+    # the body, and then the server closing it
+    rfile.read()
+
+    self.assertLess(time.time() - started, 2)
+
+    rfile.close()
+    sock.close()
+
+class TestEventStream(TestApp):
+  app_args = (2, 4, 5.0, 100, 0.1)
+  keep_alive = True
+
+  def tearDown(self):
+    mas.app.timer.stop()
+    TestApp.tearDown(self)
+
+  def _read_event(self, rfile):
+    lines = []
+
+    while True:
+      line = rfile.readline().decode("utf8").rstrip("\r\n")
+
+      if not line:
+        if lines:
+          return lines
+
+        continue
+
+      lines.append(line)
+
+  def test_streams_timer_events(self):
+    sock = socket.create_connection(("127.0.0.1", self.port), 5)
+    sock.sendall(b"GET /timer/events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+    rfile = sock.makefile("rb")
+
+    self.assertTrue(rfile.readline().startswith(b"HTTP/1.1 200"))
+    self.assertIn("Content-Type: text/event-stream", self._read_event(rfile))
+    self.assertEqual(self._read_event(rfile)[0], "event: status")
+
+    mas.app.timer.start("100s")
+
+    events = [self._read_event(rfile) for _ in range(2)]
+    events = [lines[0] for lines in events if not lines[0].startswith(":")]
+
+    self.assertIn("event: started", events)
+
+    rfile.close()
+    sock.close()
+
+  def test_streams_leave_a_worker(self):
+    streams = []
+
+    for _ in range(2):
+      sock = socket.create_connection(("127.0.0.1", self.port), 5)
+      sock.sendall(b"GET /timer/events HTTP/1.1\r\nHost: localhost\r\n\r\n")
+      streams.append((sock, sock.makefile("rb")))
+
+    self.assertTrue(streams[0][1].readline().startswith(b"HTTP/1.1 200"))
+    self.assertTrue(streams[1][1].readline().startswith(b"HTTP/1.1 503"))
+    self.assertIn('"status"', self._get("/timer"))
+
+    for (sock, rfile) in streams:
+      rfile.close()
+      sock.close()
+
+class TestEventBus(unittest.TestCase):
+  def setUp(self):
+    self.bus = mas.EventBus(max_pending=2)
+
+  def test_publish_fans_out(self):
+    subscriptions = [self.bus.subscribe() for _ in range(3)]
+    self.bus.publish("started", timer=None)
+
+    for subscription in subscriptions:
+      self.assertEqual(subscription.get(1).type, "started")
+
+  def test_slow_subscriber_drops_oldest(self):
+    subscription = self.bus.subscribe()
+
+    for index in range(5):
+      self.bus.publish("extended", index=index)
+
+    self.assertEqual(subscription.dropped, 3)
+    self.assertEqual(subscription.get(1).data, {"index": 3})
+
+  def test_close_wakes_subscriber(self):
+    subscription = self.bus.subscribe()
+    threading.Timer(0.05, subscription.close).start()
+
+    self.assertIsNone(subscription.get(5))
+    self.assertEqual(len(self.bus), 0)
+
+  def test_timer_publishes_transitions(self):
+    subscription = self.bus.subscribe(max_pending=10)
+    timer = mas.Timer(events=self.bus)
+    timer.start("100s")
+    timer.extend("10s")
+    timer.restart()
+    timer.stop()
+
+    types = [subscription.get(1).type for _ in range(4)]
+
+    self.assertEqual(types, ["started", "extended", "restarted", "stopped"])
+
+class TestRouter(unittest.TestCase):
+  def setUp(self):
+    self.router = mas.Router()
+    self.router.add("/timer", "status")
+    self.router.add("/timer/stop", "stop")
+    self.router.add("/timer/<duration>/start", "start")
+    self.router.add("/timer/<name>/<duration>/start", "named_start")
+    self.router.add("/timer/<name>", "named_status")
+    self.router.add("/timer/<name>", "named_delete", methods=("DELETE",))
+    self.router.compile()
+
+  def test_match_static_path(self):
+    self.assertEqual(self.router.match("GET", "/timer"), ("status", {}, ("GET",)))
+
+  def test_static_path_wins_over_parameters(self):
+    self.assertEqual(self.router.match("GET", "/timer/stop")[0], "stop")
+
+  def test_match_with_parameters(self):
+    (handler, params, _) = self.router.match("GET", "/timer/kitchen/1.5h/start")
+
+    self.assertEqual(handler, "named_start")
+    self.assertEqual(params, {"name": "kitchen", "duration": "1.5h"})
+
+  def test_match_by_method(self):
+    self.assertEqual(self.router.match("DELETE", "/timer/kitchen"), ("named_delete", {"name": "kitchen"}, ("DELETE", "GET")))
+
+  def test_match_with_wrong_method(self):
+    self.assertEqual(self.router.match("POST", "/timer"), (None, {}, ("GET",)))
+
+  def test_match_with_unknown_path(self):
+    self.assertEqual(self.router.match("GET", "/timer/a/b/c/d"), (None, {}, ()))
+
+  def test_mutating(self):
+    self.router.add("/timer/restart", "restart", mutating=True)
+
+    self.assertEqual(self.router.mutating, set(["named_delete", "restart"]))
+
+class TestWorkerPool(unittest.TestCase):
+  def test_submit_runs_task(self):
+    pool = mas.WorkerPool(2, 4)
+    event = threading.Event()
+    pool.submit(event.set)
+
+    self.assertTrue(event.wait(2))
+    pool.shutdown()
+
+  def test_submit_when_full(self):
+    pool = mas.WorkerPool(1, 1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+      started.set()
+      release.wait(5)
+
+    pool.submit(block)
+    started.wait(2)
+    pool.submit(block)
+
+    with self.assertRaises(mas.PoolFullError):
+      pool.submit(block)
+
+    release.set()
+    pool.shutdown()
+
 if __name__ == "__main__":
   unittest.main()
\ No newline at end of file
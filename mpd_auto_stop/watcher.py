@@ -0,0 +1,110 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+import threading
+from .mpd import MPDClient, MPDError
+from .logger import logger
+
+class PlayerWatcher(object):
+    """
+    Holds one `idle player mixer` connection to mpd and keeps the last known player state, so nobody has to ask
+    mpd for it per request. Listeners are called with (previous, current) state dicts whenever it changes.
+    """
+    def __init__(self, host, port, min_backoff=1.0, max_backoff=30.0):
+        self._host = host
+        self._port = port
+        self._min_backoff = min_backoff
+        self._max_backoff = max_backoff
+        self._listeners = []
+        self._client = None
+        self._thread = None
+        self._stopped = threading.Event()
+        # orders sending idle against stop() sending noidle, a noidle that overtakes the idle is lost
+        self._lock = threading.Lock()
+        self._backoff = min_backoff
+        self.state = None
+
+    def follows(self, host, port):
+        return (host, port) == (self._host, self._port)
+
+    @property
+    def connected(self):
+        return self.state is not None
+
+    def add_listener(self, listener):
+        self._listeners.append(listener)
+
+    def _read_state(self, client):
+        status = client.command("status")
+
+        return {
+            "state": status.get("state"),
+            "volume": int(status.get("volume", -1))
+        }
+
+    def _update(self, state):
+        previous, self.state = self.state, state
+
+        if previous == state:
+            return
+
+        for listener in self._listeners:
+            try:
+                listener(previous, state)
+            except Exception as exp:
+                logger.error("Error in player listener", error=exp)
+
+    def _watch(self):
+        # no timeout, idle legitimately blocks for hours, a dead peer is left to TCP keepalive
+        self._client = client = MPDClient(self._host, self._port, timeout=None)
+
+        try:
+            client.connect()
+            self._backoff = self._min_backoff
+            self._update(self._read_state(client))
+
+            while True:
+                with self._lock:
+                    if self._stopped.is_set():
+                        break
+
+                    client.send_idle("player", "mixer")
+
+                if client.fetch_idle():
+                    self._update(self._read_state(client))
+        finally:
+            client.close()
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self._watch()
+            except MPDError as exp:
+                if self._stopped.is_set():
+                    break
+
+                logger.warning("Lost player state from mpd, retrying", host=self._host, port=self._port, error=exp, retry_in=self._backoff)
+
+                self.state = None
+                self._stopped.wait(self._backoff)
+                self._backoff = min(self._backoff * 2, self._max_backoff)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="mpd-auto-stop-watcher")
+        self._thread.daemon = True
+        self._thread.start()
+
+        return self
+
+    def stop(self):
+        with self._lock:
+            self._stopped.set()
+
+            if self._client:
+                try:
+                    self._client.noidle()
+                except MPDError:
+                    pass
+
+        if self._thread:
+            self._thread.join(5)
@@ -41,6 +41,7 @@ setup(
     packages=find_packages(),
     zip_safe=True,
     keywords=["mpd"],
+    install_requires=['selectors34; python_version < "3.4"'],
     test_suite="mpd_auto_stop.tests",
     scripts=["bin/mpd_auto_stop"]
 )